@@ -5,267 +5,807 @@ Driver
 '''-------------------------- Imports & Constants --------------------------'''
 
 # pre-existing python libraries
-from dash import Dash, html, dcc, callback, Output, Input
+import functools
+import os
+import tempfile
+import flask
+from dash import (Dash, html, dcc, callback, Output, Input, State,
+                  ClientsideFunction)
+from dash.exceptions import PreventUpdate
 
 # our custom-made libraries
-from aft_pkg.aft_data_org import (CODES, YEARS, PROGRAM_LIST, 
-                                  DEMOGRAPHICS, COMPARISON_GROUPS, GRADES,
-                                  TREEMAP_DEMOGS)
+from aft_pkg.aft_data_org import (DATASET, DEMOGRAPHICS, COMPARISON_GROUPS,
+                                  GRADES, TREEMAP_DEMOGS, WATCH_INTERVAL)
 from aft_pkg.aft_plot_functions import *
+from aft_pkg.aft_cache import FigureCache
+from aft_pkg.aft_metrics import METRICS
+from aft_pkg.aft_results import (RESULTS, private_folder,
+                                 stored_heatmap_counts,
+                                 stored_treemap_counts)
+
+# the heatmap and treemap are computed as background jobs (in a separate
+# process, with their results in a disk cache shared by every server
+# worker) when diskcache, multiprocess and psutil are installed
+# (pip install "dash[diskcache]"); otherwise they run in the request
+try:
+    import diskcache
+    import multiprocess
+    import psutil
+    from dash import DiskcacheManager
+except ImportError:
+    diskcache = None
+
+# folder of the background job results (AFT_JOBS_DIR to change it, by
+# default next to the enrollment CSV); they are unpickled, so jobs only run
+# in the background if this user alone can write to it (see private_folder)
+JOBS_DIR = os.environ.get("AFT_JOBS_DIR", DATASET.path + ".jobs")
+JOB_POLL_MS = 250       # how often the browser checks on a running job
+JOB_EXPIRE_S = 3600     # job results are kept this long after last use
+
+# folder the server's processes (workers and background jobs) write their
+# metrics spans to, combined on /metrics (AFT_METRICS_DIR to change it)
+METRICS_DIR = os.environ.get(
+    "AFT_METRICS_DIR", os.path.join(tempfile.gettempdir(), "aft_metrics"))
+
+# progress bar styles while a figure is (or isn't) being computed
+SHOWN = {"display": "block", "width": "800px"}
+HIDDEN = {"display": "none"}
+
+# presentation-only controls, applied in the browser (see
+# assets/aft_clientside.js) to the figure the server last sent
+TICK_ANGLES = [{"label": "Slanted", "value": -45},
+               {"label": "Horizontal", "value": 0},
+               {"label": "Vertical", "value": -90}]
+BARMODES = {"group": "Grouped Bars", "stack": "Stacked Bars"}
+
+# what the bar charts and treemap count: every enrollment, or each
+# student once (see PandasBackend.distinct_students)
+COUNT_MODES = {"rows": "Enrollments", "students": "Unique students"}
 
 '''-------------------------------- Dashboard ------------------------------'''
 
 app = Dash(__name__)
 
-app.layout = html.Div(
-    [
-        html.H2(f"Afternoon Program Enrollment Visualizations", 
-                style={"textAlign": "center", "fontWeight": "bold"}),
-        html.Br(),
+# figures already computed for the current dataset version, so toggling
+# back to a previous selection doesn't recompute it
+FIGURE_CACHE = FigureCache(version=lambda: DATASET.current().version)
+
+# every callback and plot function stage is timed (see aft_metrics); the
+# request spans add Dash's JSON serialization and the response size
+METRICS.instrument_server(app.server)
+if METRICS.folder is None:
+    METRICS.share(METRICS_DIR)
+
+@app.server.route("/metrics")
+def metrics():
+    '''
+    latency percentiles, rows and payload bytes of every span, combined
+    over every process of the server (its workers and background jobs,
+    see Metrics.combined), plus the figure cache and result store
+    counters, as JSON. The figure cache counters are those of the worker
+    answering the request: each worker has its own cache.
+    '''
+    return flask.jsonify({"spans": METRICS.combined(),
+                          "figure_cache": FIGURE_CACHE.stats(),
+                          "result_store": RESULTS.stats()})
+
+if diskcache is not None:
+    class JobManager(DiskcacheManager):
+        '''
+        Class-- JobManager
+            DiskcacheManager for the dashboard's jobs. Each job runs in a
+            new process forked from the server worker and exits with it,
+            so anything the job itself builds is lost: the dataset
+            structures it loads, FIGURE_CACHE entries (the job's result
+            is cached by the manager instead, per inputs and dataset
+            version) and METRICS spans. So before a job is forked, the
+            current snapshot is warmed in the worker (see
+            EnrollmentDataset.warm), where it stays for every later job
+            to inherit, and the job hands its spans to the server (see
+            Metrics.flush) before its process exits.
+        '''
+
+        def call_job_fn(self, key, job_fn, args, context):
+            # a no-op once the snapshot is warm
+            DATASET.current().warm()
+            return super().call_job_fn(key, job_fn, args, context)
+
+        def make_job_fn(self, fn, progress, key=None):
+            @functools.wraps(fn)
+            def job(*args, **kwargs):
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    METRICS.flush(final=True)
+            return super().make_job_fn(job, progress, key)
+
+# background job manager, None if its packages aren't installed or
+# JOBS_DIR isn't private; results are cached per dataset version, so a new
+# version recomputes them
+BACKGROUND = JobManager(
+    diskcache.Cache(JOBS_DIR),
+    cache_by=[lambda: DATASET.current().version],
+    expire=JOB_EXPIRE_S) \
+    if diskcache is not None and private_folder(JOBS_DIR) else None
+
+
+def slow_callback(*dependencies, progress=None, running=None):
+    '''
+    Function-- slow_callback
+        app.callback for a slow figure. With BACKGROUND, it runs as a
+        background job: the request returns at once, the browser polls
+        for the result, and a job whose inputs change again before it
+        finishes is terminated, so only the latest selection's figure is
+        delivered. Without BACKGROUND, it is a regular callback.
+
+        Either way the decorated function is called with a
+        set_progress(value) function first (a no-op without BACKGROUND or
+        progress). See JobManager for what a job's process keeps.
+
+    Parameters:
+        dependencies : Output/Input/State of the callback
+        progress (list[Output]) : properties set by set_progress
+        running (list[tuple]) : (Output, value while running, value after)
+    '''
+    def decorator(func):
+        if BACKGROUND is not None:
+            job = func
+            if progress is None:
+                # Dash only passes set_progress if there are progress
+                # outputs
+                @functools.wraps(func)
+                def job(*args):
+                    return func(lambda value: None, *args)
+            return app.callback(
+                *dependencies, background=True, manager=BACKGROUND,
+                progress=progress, running=running,
+                interval=JOB_POLL_MS)(job)
+
+        @functools.wraps(func)
+        def without_progress(*args):
+            return func(lambda value: None, *args)
+        return app.callback(*dependencies, running=running)(without_progress)
+    return decorator
+
+
+@app.server.before_request
+def watch_dataset():
+    '''starts this process's check for new rows in the enrollment CSV
+    (once per process, so each server worker gets one)'''
+    DATASET.watch()
+
+
+def year_marks(years:list[int]) -> dict:
+    '''years slider marks, one per year'''
+    return {i: str(i) for i in range(min(years), max(years)+1)}
+
+
+def build_layout(codes:dict, years:list[int], program_list:list[str],
+                 version:str=None):
+    '''
+    Function-- build_layout
+        dashboard layout for the given dataset metadata (program codes,
+        years and programs used by the sliders, dropdowns and checklists,
+        and the dataset version they were taken from)
+    '''
+    return html.Div(
+        [
+            html.H2(f"Afternoon Program Enrollment Visualizations", 
+                    style={"textAlign": "center", "fontWeight": "bold"}),
+            html.Br(),
         
-        # years dropdown shared by all plots
-        ### slider start and end point, affects all* charts
-        html.Div("Select years:"),
-        dcc.RangeSlider(
-            min=min(YEARS),
-            max=max(YEARS),
-            step=1,
-            value=[min(YEARS),max(YEARS)],
-            marks={i: str(i) for i in range(min(YEARS), max(YEARS)+1)},
-            id="years-slider"),
-        html.Br(),
+            # years dropdown shared by all plots
+            ### slider start and end point, affects all* charts
+            html.Div("Select years:"),
+            dcc.RangeSlider(
+                min=min(years),
+                max=max(years),
+                step=1,
+                value=[min(years),max(years)],
+                marks=year_marks(years),
+                id="years-slider"),
+            html.Br(),
+
+            # dataset version the options above were built from, checked
+            # regularly so new seasons show up without reloading the page
+            dcc.Store(id="dataset-version", data=version),
+            dcc.Interval(id="dataset-refresh",
+                         interval=1000 * 2 * WATCH_INTERVAL),
         
-        # different visualization tabs
-        dcc.Tabs(
-            [
-                # Total Program Enrollment
-                ## basic histogram comparing overall enrollment
-                dcc.Tab([
-                    html.Div("Displays enrollment data for selected programs"),
-                    dcc.Graph(
-                        id="total-program-enroll-graph"
-                    ),
+            # different visualization tabs
+            dcc.Tabs(
+                [
+                    # Total Program Enrollment
+                    ## basic histogram comparing overall enrollment
+                    dcc.Tab([
+                        html.Div("Displays enrollment data for selected programs"),
+                        dcc.Graph(
+                            id="total-program-enroll-graph"
+                        ),
+                        ## figure from the server, before the bar controls
+                        dcc.Store(id="total-program-enroll-figure"),
                     
-                    ## program selection, random by default
-                    html.Div("Select programs:"),
-                    dcc.Dropdown(
-                        options=PROGRAM_LIST,
-                        value=np.random.choice(PROGRAM_LIST, 5),
-                        multi=True,
-                        id="total-program-enroll-dropdown"),
-                    html.Br(),
+                        ## program selection, random by default
+                        html.Div("Select programs:"),
+                        dcc.Dropdown(
+                            options=program_list,
+                            value=np.random.choice(program_list,
+                                                   min(5, len(program_list))),
+                            multi=True,
+                            id="total-program-enroll-dropdown"),
+                        html.Br(),
                     
-                    ## affects color of histogram bars
-                    html.Div("Select demographics to highlight:"),
-                    dcc.RadioItems(
-                        options=DEMOGRAPHICS,
-                        value="Program (name)",
-                        inline=True,
-                        id="total-program-enroll-demographics"),
-                    html.Br(),
+                        ## affects color of histogram bars
+                        html.Div("Select demographics to highlight:"),
+                        dcc.RadioItems(
+                            options=DEMOGRAPHICS,
+                            value="Program (name)",
+                            inline=True,
+                            id="total-program-enroll-demographics"),
+                        html.Br(),
                     
-                    ## middle school, high school, or whole school
-                    html.Div("Grades:"),
-                    dcc.RadioItems(
-                        options=GRADES,
-                        value="all",
-                        inline=True,
-                        id="total-program-enroll-grades"
-                    ), html.Br(),
+                        ## middle school, high school, or whole school
+                        html.Div("Grades:"),
+                        dcc.RadioItems(
+                            options=GRADES,
+                            value="all",
+                            inline=True,
+                            id="total-program-enroll-grades"
+                        ), html.Br(),
+
+                        ## enrollments or different students per bar
+                        html.Div("Count:"),
+                        dcc.RadioItems(
+                            options=COUNT_MODES,
+                            value="rows",
+                            inline=True,
+                            id="total-program-enroll-count"
+                        ), html.Br(),
                     
-                    ## changes whether bars are grouped or stacked together
-                    html.Div("Bar grouping mode:"),
-                    dcc.RadioItems(
-                        options={"group":"Grouped Bars", 
-                                 "stack":"Stacked Bars"},
-                        value="stack",
-                        inline=True,
-                        id="total-program-enroll-grouping"
-                    )
-                ], label="Total Program Enrollment"),
+                        ## changes whether bars are grouped or stacked together
+                        html.Div("Bar grouping mode:"),
+                        dcc.RadioItems(
+                            options=BARMODES,
+                            value="stack",
+                            inline=True,
+                            id="total-program-enroll-grouping"
+                        ), html.Br(),
+
+                        ## angle of the program names under the bars
+                        html.Div("Label angle:"),
+                        dcc.RadioItems(
+                            options=TICK_ANGLES,
+                            value=-45,
+                            inline=True,
+                            id="total-program-enroll-tickangle"
+                        )
+                    ], label="Total Program Enrollment"),
                 
-                # Enrollment Comparison
-                ## splits enrollment into different histograms for comparison
-                dcc.Tab([
-                    html.Div("Compares enrollment in selected programs "+
-                             " across demographics factors"),
-                    dcc.Graph(id="comparison-enroll-charts", 
-                              style= {'height': '900px'}),
+                    # Enrollment Comparison
+                    ## splits enrollment into different histograms for comparison
+                    dcc.Tab([
+                        html.Div("Compares enrollment in selected programs "+
+                                 " across demographics factors"),
+                        dcc.Graph(id="comparison-enroll-charts", 
+                                  style= {'height': '900px'}),
+                        ## figure from the server, before the chart controls
+                        dcc.Store(id="comparison-enroll-figure"),
                     
-                    ## program selection, random by default
-                    html.Div("Select programs:"),
-                    dcc.Dropdown(
-                        options=PROGRAM_LIST,
-                        value=np.random.choice(PROGRAM_LIST, 5),
-                        multi=True,
-                        id="comparison-enroll-programs"),
-                    html.Br(),
+                        ## program selection, random by default
+                        html.Div("Select programs:"),
+                        dcc.Dropdown(
+                            options=program_list,
+                            value=np.random.choice(program_list,
+                                                   min(5, len(program_list))),
+                            multi=True,
+                            id="comparison-enroll-programs"),
+                        html.Br(),
                     
-                    ## the facet that the charts are split along
-                    html.Div("Select chart to view:"),
-                    dcc.RadioItems(
-                        options=COMPARISON_GROUPS,
-                        value="Program (name)",
-                        inline=True,
-                        id="comparison-enroll-format"),
-                    html.Br(),
+                        ## the facet that the charts are split along
+                        html.Div("Select chart to view:"),
+                        dcc.RadioItems(
+                            options=COMPARISON_GROUPS,
+                            value="Program (name)",
+                            inline=True,
+                            id="comparison-enroll-format"),
+                        html.Br(),
                     
-                    ## affects histogram bar color
-                    html.Div("Select demographics to highlight:"),
-                    dcc.RadioItems(
-                        options=DEMOGRAPHICS,
-                        value="Program (name)",
-                        inline=True,
-                        id="comparison-enroll-demographics"),
-                    html.Br(),
+                        ## affects histogram bar color
+                        html.Div("Select demographics to highlight:"),
+                        dcc.RadioItems(
+                            options=DEMOGRAPHICS,
+                            value="Program (name)",
+                            inline=True,
+                            id="comparison-enroll-demographics"),
+                        html.Br(),
                     
-                    ## middle school, high school, or whole school
-                    html.Div("Grades:"),
-                    dcc.RadioItems(
-                        options=GRADES,
-                        value="all",
-                        inline=True,
-                        id="comparison-enroll-grades"
-                    ),
-                    html.Br(),
+                        ## middle school, high school, or whole school
+                        html.Div("Grades:"),
+                        dcc.RadioItems(
+                            options=GRADES,
+                            value="all",
+                            inline=True,
+                            id="comparison-enroll-grades"
+                        ),
+                        html.Br(),
+
+                        ## enrollments or different students per bar
+                        html.Div("Count:"),
+                        dcc.RadioItems(
+                            options=COUNT_MODES,
+                            value="rows",
+                            inline=True,
+                            id="comparison-enroll-count"
+                        ),
+                        html.Br(),
                     
-                    ## changes whether bars are grouped or stacked together
-                    html.Div("Bar grouping mode:"),
-                    dcc.RadioItems(
-                        options={"group":"Grouped Bars",
-                                 "stack":"Stacked Bars"},
-                        value="stack",
-                        inline=True,
-                        id="comparison-enroll-grouping"
-                    )
-                ], label="Enrollment Comparison Over Time"),
+                        ## changes whether bars are grouped or stacked together
+                        html.Div("Bar grouping mode:"),
+                        dcc.RadioItems(
+                            options=BARMODES,
+                            value="stack",
+                            inline=True,
+                            id="comparison-enroll-grouping"
+                        ),
+                        html.Br(),
+
+                        ## angle of the years under the bars
+                        html.Div("Label angle:"),
+                        dcc.RadioItems(
+                            options=TICK_ANGLES,
+                            value=-45,
+                            inline=True,
+                            id="comparison-enroll-tickangle"
+                        ),
+                        html.Br(),
+
+                        ## how many charts are shown side by side
+                        html.Div("Charts per row:"),
+                        dcc.Slider(
+                            min=1,
+                            max=4,
+                            step=1,
+                            value=2,
+                            id="comparison-enroll-wrap"
+                        )
+                    ], label="Enrollment Comparison Over Time"),
                 
-                # Correlation Heatmap
-                ## heatmap showing correlation of 12 most popular programs
-                dcc.Tab([
-                    html.Div("Displays correlation heatmap of the top 12 "
-                             "most popular activities in the selected program"
-                             " codes and years, as measured by their "
-                             "Cramer's V coefficient. "),
-
-                    dcc.Graph(id="correlation-heatmap",
-                              style= {'height': '600px', 'width': '800px'}),
-                    html.Br(),
+                    # Correlation Heatmap
+                    ## heatmap showing correlation of the most popular programs
+                    dcc.Tab([
+                        html.Div("Displays correlation heatmap of the top "
+                                 "most popular activities in the selected program"
+                                 " codes and years, as measured by their "
+                                 "Cramer's V coefficient. "),
+
+                        ## progress of a heatmap being computed
+                        html.Progress(id="correlation-heatmap-progress",
+                                      style=HIDDEN),
+
+                        ## heatmap, with details of the hovered cell beside it
+                        html.Div([
+                            dcc.Graph(id="correlation-heatmap",
+                                      style= {'height': '600px',
+                                              'width': '800px'}),
+                            html.Div(id="correlation-heatmap-details",
+                                     style={"marginLeft": "2em",
+                                            "fontSize": 16})
+                        ], style={"display": "flex"}),
+                        ## figure from the server, before the color range
+                        dcc.Store(id="correlation-heatmap-figure"),
+                        ## overlap counts behind it, for the hover details
+                        dcc.Store(id="correlation-heatmap-counts"),
+                        html.Br(),
+
+                        ## correlations mapped to the ends of the color scale
+                        html.Div("Color range:"),
+                        dcc.RangeSlider(
+                            min=0,
+                            max=1,
+                            step=0.05,
+                            value=[0, 0.4],
+                            marks={i / 10: str(i / 10) for i in range(11)},
+                            id="correlation-heatmap-range"
+                        ), html.Br(),
                     
-                    ## includes only selected program codes
-                    ## (i.e. sports or arts)
-                    html.Div("Program codes:"),
-                    dcc.Checklist(
-                        options:=CODES, # walrus assignment for use in value
-                        value=[option for option in options],
-                        inline=True,
-                        id="correlation-heatmap-program-codes"
-                    ),
-                    html.Br(),
+                        ## includes only selected program codes
+                        ## (i.e. sports or arts)
+                        html.Div("Program codes:"),
+                        dcc.Checklist(
+                            options:=codes, # walrus assignment for use in value
+                            value=[option for option in options],
+                            inline=True,
+                            id="correlation-heatmap-program-codes"
+                        ),
+                        html.Br(),
                     
-                    ## middle school, high school, or whole school
-                    html.Div("Grades:"),
-                    dcc.RadioItems(
-                        options=GRADES,
-                        value="hs",
-                        inline=True,
-                        id="correlation-heatmap-grades"
-                    ), html.Br()
-
-                ], label="Program Correlation"),
-
-                # Program Popularity Treemap
-                ## Displays program popularity across demographics
-                dcc.Tab([
-                    html.Div("Displays the 10 most popular programs among "+
-                             "selected demographics"),
-                    html.Div("Click into a square to expand it"),
-                    dcc.Graph(id="top-ten-table"),
-                    html.Br(),
-
-                    ## includes only selected program codes
-                    ## (i.e. sports or arts)
-                    html.Div("Program codes:"),
-                    dcc.Checklist(
-                        options:=CODES, # walrus assignment for use in value
-                        value=[option for option in options],
-                        inline=True,
-                        id="top-ten-program-codes"
-                    ),
-                    html.Br(),
-
-                    ## demographics filters for backend pivot table
-                    html.Div("Select demographics options"+
-                             " (best results with 3 or fewer selected):"),
-                    dcc.Checklist(
-                        options = TREEMAP_DEMOGS,
-                        value=["Race/ethnicity", "Gender code"],
-                        id = "top-ten-id-variables"
-                    )
-                ], label="Program Popularity")
-            ]
-        )
-    ],
-    style={"margin":"1em 5em", "fontSize":18, "fontFamily":"Verdana"}
+                        ## middle school, high school, or whole school
+                        html.Div("Grades:"),
+                        dcc.RadioItems(
+                            options=GRADES,
+                            value="hs",
+                            inline=True,
+                            id="correlation-heatmap-grades"
+                        ), html.Br(),
+
+                        ## how many of the most popular programs to compare
+                        html.Div("Number of programs:"),
+                        dcc.Slider(
+                            min=2,
+                            max=max(len(program_list), 2),
+                            step=1,
+                            value=min(12, len(program_list)),
+                            marks=None,
+                            tooltip={"placement": "bottom",
+                                     "always_visible": True},
+                            id="correlation-heatmap-n"
+                        ), html.Br()
+
+                    ], label="Program Correlation"),
+
+                    # Program Popularity Treemap
+                    ## Displays program popularity across demographics
+                    dcc.Tab([
+                        html.Div("Displays the 10 most popular programs among "+
+                                 "selected demographics"),
+                        html.Div("Click into a square to expand it"),
+                        html.Progress(id="top-ten-progress", style=HIDDEN),
+                        dcc.Graph(id="top-ten-table"),
+                        html.Br(),
+
+                        ## includes only selected program codes
+                        ## (i.e. sports or arts)
+                        html.Div("Program codes:"),
+                        dcc.Checklist(
+                            options:=codes, # walrus assignment for use in value
+                            value=[option for option in options],
+                            inline=True,
+                            id="top-ten-program-codes"
+                        ),
+                        html.Br(),
+
+                        ## demographics to group the treemap by, in order
+                        html.Div("Select demographics options:"),
+                        dcc.Checklist(
+                            options = TREEMAP_DEMOGS,
+                            value=["Race/ethnicity", "Gender code"],
+                            id = "top-ten-id-variables"
+                        ),
+                        html.Br(),
+
+                        ## programs ranked by enrollments or by students
+                        html.Div("Count:"),
+                        dcc.RadioItems(
+                            options=COUNT_MODES,
+                            value="rows",
+                            inline=True,
+                            id="top-ten-count"
+                        )
+                    ], label="Program Popularity"),
+
+                    # Student Pathways
+                    ## where students go next season, who comes back and
+                    ## who stays in a program through grade 12
+                    dcc.Tab([
+                        html.Div("Shows where the students of the most "
+                                 "enrolled programs go the next season"),
+                        dcc.Graph(id="pathways-transitions",
+                                  style={'height': '600px'}),
+                        html.Br(),
+
+                        ## includes only selected program codes
+                        ## (i.e. sports or arts)
+                        html.Div("Program codes:"),
+                        dcc.Checklist(
+                            options:=codes, # walrus assignment for use in value
+                            value=[option for option in options],
+                            inline=True,
+                            id="pathways-program-codes"
+                        ),
+                        html.Br(),
+
+                        ## how many of the most enrolled programs to show
+                        html.Div("Number of programs:"),
+                        dcc.Slider(
+                            min=2,
+                            max=30,
+                            step=1,
+                            value=12,
+                            marks={i: str(i) for i in range(5, 31, 5)},
+                            id="pathways-n"
+                        ),
+                        html.Br(),
+
+                        html.Div("Shows how many students of the selected "
+                                 "programs come back the next year, and "
+                                 "stay from one grade through grade 12"),
+                        dcc.Graph(id="pathways-retention"),
+                        dcc.Graph(id="pathways-persistence"),
+
+                        ## program selection, random by default
+                        html.Div("Select programs:"),
+                        dcc.Dropdown(
+                            options=program_list,
+                            value=np.random.choice(program_list,
+                                                   min(5, len(program_list))),
+                            multi=True,
+                            id="pathways-programs"),
+                        html.Br(),
+
+                        ## splits the bars and lines by demographics
+                        html.Div("Select demographics to highlight:"),
+                        dcc.RadioItems(
+                            options=DEMOGRAPHICS,
+                            value="Program (name)",
+                            inline=True,
+                            id="pathways-demographics"),
+                        html.Br(),
+
+                        ## grade the persistence lines start from
+                        html.Div("Starting grade:"),
+                        dcc.RadioItems(
+                            options=list(range(7, 12)),
+                            value=7,
+                            inline=True,
+                            id="pathways-start-grade"
+                        )
+                    ], label="Student Pathways")
+                ]
+            )
+        ],
+        style={"margin":"1em 5em", "fontSize":18, "fontFamily":"Verdana"}
+    )
+
+
+def serve_layout():
+    '''
+    Function-- serve_layout
+        Builds the layout on each page load, which is also when the
+        enrollment data is first read (see aft_data_org.DATASET). The app
+        therefore starts serving without waiting for the data to load.
+    '''
+    dataset = DATASET.current()
+    return build_layout(dataset.codes, dataset.years, dataset.program_list,
+                        dataset.version)
+
+# callbacks are validated against a layout with no data in it,
+# so setting app.layout below doesn't load the dataset
+app.validation_layout = build_layout(codes={}, years=[0], program_list=[])
+app.layout = serve_layout
+
+# Every callback takes the current dataset snapshot once, at entry, and
+# passes it down, so a dataset swap mid-callback can't mix two versions.
+# The figures are memoized per snapshot (see EnrollmentDataset.cache_key).
+# Figures are sent to a dcc.Store with default presentation (stacked bars,
+# slanted labels, 2 charts per row, default colors), and the bar mode,
+# label angle, charts per row and heatmap color range are applied in the
+# browser, so changing only those needs no request at all.
+cached_total_program_enrollment_bar = FIGURE_CACHE.memoize(
+    unordered=("programs",))(total_program_enrollment_bar)
+cached_program_comparison_bar = FIGURE_CACHE.memoize(
+    unordered=("programs",))(program_comparison_bar)
+
+# the heatmap counts and treemap aggregates are also kept on disk (see
+# aft_results), so they survive restarts and are shared by every worker
+# and background job; python -m aft_pkg.aft_results precomputes the
+# common ones
+@FIGURE_CACHE.memoize(unordered=("program_codes",))
+def cached_treemap(years, program_codes, id_variables, unique_students,
+                   dataset):
+    '''treemap figure of a dataset snapshot, from its stored aggregates'''
+    return treemap_figure(stored_treemap_counts(
+        years=years,
+        program_codes=program_codes,
+        id_variables=id_variables,
+        unique_students=unique_students,
+        dataset=dataset), id_variables)
+
+## New data callback
+@app.callback(
+    Output("dataset-version", "data"),
+    Output("years-slider", "min"),
+    Output("years-slider", "max"),
+    Output("years-slider", "marks"),
+    Output("years-slider", "value"),
+    Output("total-program-enroll-dropdown", "options"),
+    Output("comparison-enroll-programs", "options"),
+    Output("correlation-heatmap-program-codes", "options"),
+    Output("top-ten-program-codes", "options"),
+    Output("pathways-programs", "options"),
+    Output("pathways-program-codes", "options"),
+    Output("correlation-heatmap-program-codes", "value"),
+    Output("top-ten-program-codes", "value"),
+    Output("pathways-program-codes", "value"),
+    Output("correlation-heatmap-n", "max"),
+    Input("dataset-refresh", "n_intervals"),
+    State("dataset-version", "data"),
+    State("years-slider", "value"),
+    State("years-slider", "max"),
+    State("correlation-heatmap-program-codes", "options"),
+    State("correlation-heatmap-program-codes", "value"),
+    State("top-ten-program-codes", "value"),
+    State("pathways-program-codes", "value")
 )
+def update_dataset_options(n_intervals, version, years, last_year,
+                           last_codes, *selected_codes):
+    '''Updates the years, programs and codes to choose from when the
+    dataset has a new version (e.g. a new season was appended to the CSV,
+    see DatasetHandle.watch). A years selection ending at the last year
+    is extended to the new last year, and a codes checklist with every
+    code checked gets the new codes checked too.'''
+    dataset = DATASET.current()
+    if dataset.version == version:
+        raise PreventUpdate
+    if years[1] == last_year:
+        years = [years[0], max(dataset.years)]
+    selected_codes = [list(dataset.codes) if set(codes) >= set(last_codes)
+                      else codes for codes in selected_codes]
+    return (dataset.version, min(dataset.years), max(dataset.years),
+            year_marks(dataset.years), years,
+            dataset.program_list, dataset.program_list,
+            dataset.codes, dataset.codes,
+            dataset.program_list, dataset.codes,
+            *selected_codes,
+            max(len(dataset.program_list), 2))
 
-## Total Program Enrollment callback
+## Total Program Enrollment callbacks
 @app.callback(
-    Output("total-program-enroll-graph", "figure"),
+    Output("total-program-enroll-figure", "data"),
     Input("total-program-enroll-dropdown", "value"), # programs
     Input("years-slider", "value"), # years
     Input("total-program-enroll-demographics", "value"), # demographics
-    Input("total-program-enroll-grouping", "value"), # groupmode
-    Input("total-program-enroll-grades", "value")
+    Input("total-program-enroll-grades", "value"),
+    Input("total-program-enroll-count", "value")
 )
-def update_total_program_enrollment(programs, years, demographics,
-                                    groupmode, grades):
+@METRICS.timed()
+def update_total_program_enrollment(programs, years, demographics, grades,
+                                    count):
     '''total program enrollment chart'''
-    return total_program_enrollment_bar(
+    return cached_total_program_enrollment_bar(
         programs=programs,
         years=years,
         demographics=demographics,
-        groupmode=groupmode,
-        grades=grades)
+        groupmode="stack",
+        grades=grades,
+        unique_students=count == "students",
+        dataset=DATASET.current())
+
+app.clientside_callback(
+    ClientsideFunction(namespace="aft", function_name="bars"),
+    Output("total-program-enroll-graph", "figure"),
+    Input("total-program-enroll-figure", "data"),
+    Input("total-program-enroll-grouping", "value"), # barmode
+    Input("total-program-enroll-tickangle", "value")
+)
 
 
-## Program Comparison callback
+## Program Comparison callbacks
 @app.callback(
-    Output("comparison-enroll-charts", "figure"),
+    Output("comparison-enroll-figure", "data"),
     Input("comparison-enroll-programs", "value"), # programs
     Input("years-slider", "value"), # years
     Input("comparison-enroll-format", "value"), # groupby
     Input("comparison-enroll-demographics", "value"), # demographics
-    Input("comparison-enroll-grouping", "value"), # groupmode
-    Input("comparison-enroll-grades", "value")
+    Input("comparison-enroll-grades", "value"),
+    Input("comparison-enroll-count", "value")
 )
-def update_comparison_charts(programs, years, groupby,
-                             demographics, groupmode, grades):
+@METRICS.timed()
+def update_comparison_charts(programs, years, groupby, demographics, grades,
+                             count):
     '''program comparison charts'''
-    return program_comparison_bar(
+    return cached_program_comparison_bar(
         programs=programs,
         years=years,
         groupby=groupby,
         demographics=demographics,
-        groupmode=groupmode,
-        grades=grades)
+        groupmode="stack",
+        grades=grades,
+        unique_students=count == "students",
+        dataset=DATASET.current())
 
+app.clientside_callback(
+    ClientsideFunction(namespace="aft", function_name="facets"),
+    Output("comparison-enroll-charts", "figure"),
+    Input("comparison-enroll-figure", "data"),
+    Input("comparison-enroll-grouping", "value"), # barmode
+    Input("comparison-enroll-tickangle", "value"),
+    Input("comparison-enroll-wrap", "value") # charts per row
+)
 
-# Correlation Heatmap callback
-@app.callback(
-    Output('correlation-heatmap', 'figure'),
+
+# Correlation Heatmap callbacks
+## overlap counts behind the heatmap
+cached_heatmap_counts = FIGURE_CACHE.memoize(
+    unordered=("program_codes",))(stored_heatmap_counts)
+
+@FIGURE_CACHE.memoize(unordered=("program_codes",))
+def cached_heatmap(years, program_codes, grades, n, dataset):
+    '''heatmap figure of a dataset snapshot, from its cached counts'''
+    return heatmap_figure(cached_heatmap_counts(
+        years=years,
+        program_codes=program_codes,
+        grades=grades,
+        n=n,
+        dataset=dataset))
+
+@slow_callback(
+    Output("correlation-heatmap-figure", "data"),
+    Output("correlation-heatmap-counts", "data"),
     Input("years-slider", "value"),
     Input("correlation-heatmap-program-codes", "value"),
     Input("correlation-heatmap-grades", "value"),
-    [Input('correlation-heatmap', 'hoverData')]
+    Input("correlation-heatmap-n", "value"),
+    progress=[Output("correlation-heatmap-progress", "value"),
+              Output("correlation-heatmap-progress", "max")],
+    running=[(Output("correlation-heatmap-progress", "style"),
+              SHOWN, HIDDEN)]
 )
-def update_heatmap(years, program_codes, grades, hoverData):
-    '''program correlation heatmap'''
-    heatmap = generate_dash_heatmap(
-        years=years,
-        program_codes=program_codes,
-        grades=grades)
-    return heatmap
+@METRICS.timed()
+def update_heatmap(set_progress, years, program_codes, grades, n):
+    '''program correlation heatmap: overlap counts, then the figure; the
+    counts are sent along for the hover details'''
+    dataset = DATASET.current()
+    set_progress((0, 2))
+    counts = cached_heatmap_counts(years=years, program_codes=program_codes,
+                                   grades=grades, n=n, dataset=dataset)
+    set_progress((1, 2))
+    return (cached_heatmap(years, program_codes, grades, n, dataset=dataset),
+            {"programs": counts["programs"],
+             "both": counts["both"].tolist(),
+             "totals": counts["totals"].tolist(),
+             "n": int(counts["n"])})
+
+app.clientside_callback(
+    ClientsideFunction(namespace="aft", function_name="colorRange"),
+    Output("correlation-heatmap", "figure"),
+    Input("correlation-heatmap-figure", "data"),
+    Input("correlation-heatmap-range", "value")
+)
+
+
+# the selection (years, codes, grades, n) only reaches the heatmap job:
+# the details read the counts it sent with the figure, so hovering or
+# changing the selection never computes them here
+@app.callback(
+    Output("correlation-heatmap-details", "children"),
+    Input('correlation-heatmap', 'hoverData'),
+    Input("correlation-heatmap-counts", "data")
+)
+@METRICS.timed()
+def update_heatmap_details(hoverData, counts):
+    '''contingency table and test results of the hovered heatmap cell,
+    looked up in the heatmap's overlap counts (no recompute)'''
+    point = (hoverData or {}).get("points", [{}])[0]
+    if counts is None or point.get("y") not in counts["programs"] or \
+        point.get("x") not in counts["programs"]:
+        return html.Div("Hover over a cell to see how many students "
+                        "enrolled in both programs.")
+
+    program_a, program_b = point["y"], point["x"]
+    details = heatmap_pair_details(counts, program_a, program_b)
+    [[both, only_a], [only_b, neither]] = details["table"].tolist()
+
+    return html.Div([
+        html.H4(f"{program_a} & {program_b}"),
+        html.Table([
+            html.Tr([html.Th(""), html.Th(f"In {program_b}"),
+                     html.Th(f"Not in {program_b}")]),
+            html.Tr([html.Th(f"In {program_a}"),
+                     html.Td(both), html.Td(only_a)]),
+            html.Tr([html.Th(f"Not in {program_a}"),
+                     html.Td(only_b), html.Td(neither)])
+        ]),
+        html.Br(),
+        html.Div(f"Cramer's V: {details['cramers_v']:.4f}"),
+        html.Div(f"Chi-squared: {details['chi2']:.2f} "
+                 f"(p-value: {details['pvalue']:.3g})"),
+        html.Div(f"{both / max(both + only_a, 1):.0%} of {program_a} "
+                 f"students also enrolled in {program_b}"),
+        html.Div(f"{both / max(both + only_b, 1):.0%} of {program_b} "
+                 f"students also enrolled in {program_a}"),
+        html.Div(f"{details['n']} students in the top {len(counts['programs'])}"
+                 " programs")
+    ])
 
 
 # checklist disabling callback (for popularity treemap)
@@ -291,21 +831,73 @@ def update_multi_options(value):
 
 
 # Program Popularity callback
-@app.callback(
+@slow_callback(
     Output("top-ten-table", "figure"),
     Input("years-slider", "value"),
     Input("top-ten-program-codes", "value"),
-    Input("top-ten-id-variables", "value")
+    Input("top-ten-id-variables", "value"),
+    Input("top-ten-count", "value"),
+    running=[(Output("top-ten-progress", "style"), SHOWN, HIDDEN)]
     )
-def update_treemap(years, codes, id_demogs):
+@METRICS.timed()
+def update_treemap(set_progress, years, codes, id_demogs, count):
     '''program popularity treemap'''
-    return treemap(years=years, program_codes=codes,
-                   id_variables=id_demogs)
+    return cached_treemap(years=years, program_codes=codes,
+                          id_variables=id_demogs,
+                          unique_students=count == "students",
+                          dataset=DATASET.current())
+
+
+
+## Student Pathways callbacks
+cached_transition_heatmap = FIGURE_CACHE.memoize(
+    unordered=("program_codes",))(transition_heatmap)
+cached_retention_bar = FIGURE_CACHE.memoize(
+    unordered=("programs",))(retention_bar)
+cached_persistence_funnel = FIGURE_CACHE.memoize(
+    unordered=("programs",))(persistence_funnel)
+
+# the trajectories are sorted once per dataset snapshot, in the server
+# process (EnrollmentDataset.warm), so the queries stay out of the
+# background jobs that would each build them again
+@app.callback(
+    Output("pathways-transitions", "figure"),
+    Input("years-slider", "value"),
+    Input("pathways-program-codes", "value"),
+    Input("pathways-n", "value")
+)
+@METRICS.timed()
+def update_transitions(years, codes, n):
+    '''season to season program transition heatmap'''
+    return cached_transition_heatmap(years=years, program_codes=codes, n=n,
+                                     dataset=DATASET.current())
+
+@app.callback(
+    Output("pathways-retention", "figure"),
+    Output("pathways-persistence", "figure"),
+    Input("pathways-programs", "value"),
+    Input("years-slider", "value"),
+    Input("pathways-demographics", "value"),
+    Input("pathways-start-grade", "value")
+)
+@METRICS.timed()
+def update_pathways(programs, years, demographics, start_grade):
+    '''retention bars and persistence funnel of the selected programs'''
+    dataset = DATASET.current()
+    return (cached_retention_bar(programs=programs, years=years,
+                                 demographics=demographics,
+                                 dataset=dataset),
+            cached_persistence_funnel(programs=programs, years=years,
+                                      demographics=demographics,
+                                      start_grade=start_grade,
+                                      dataset=dataset))
 
 
 '''----------------------------------- Main --------------------------------'''
 
 if __name__ == "__main__":
     
+    # spans of a previous run aren't this server's
+    METRICS.share(METRICS.folder, clear=True)
     app.run_server(debug=False)
     
\ No newline at end of file
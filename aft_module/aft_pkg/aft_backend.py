@@ -0,0 +1,396 @@
+'''
+AFT Data Visualization Tool
+Query Backends
+'''
+'''-------------------------- Imports & Constants --------------------------'''
+
+# pre-existing python libraries
+import datetime
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+# our custom-made libraries
+from .aft_filters import FilterSpec
+from .aft_ingest import (CODES, FA_VALUES, FIRST_YEAR, GRADES,
+                         YEARS_TO_GRADUATION)
+from .aft_sketch import EXACT_MAX_ROWS, distinct_counts
+from .aft_years import YEAR_COLUMN
+
+# DuckDB runs the queries over the CSV/Parquet file itself, without
+# loading it into memory (pip install duckdb); without it, only the
+# pandas backend is available
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# cells of the students' year spans (EnrollmentDataset.student_years),
+# program first so a program filter takes slices of them
+STUDENT_YEAR_COLUMNS = ["Full name", "Person ID", "Code",
+                        "Grade at Time of Activity"]
+
+# query engines to choose from (see EnrollmentDataset.query)
+ENGINES = ["pandas", "duckdb"]
+
+# columns holding whole numbers, read as text and checked like
+# aft_ingest.validate_enrollment before use
+WHOLE_NUMBER_COLUMNS = [
+    "Person ID",
+    "FA",
+    "Acad Yr (start)",
+    "Grade at Time of Activity",
+    "Grad year"]
+
+'''----------------------------- Pandas Backend ----------------------------'''
+
+class PandasBackend:
+    '''
+    Class-- PandasBackend
+        Enrollment queries over a loaded EnrollmentDataset, served from
+        its pre-aggregated structures where they can be: counts from the
+        count cube (see aft_cube) and student/program pairs from the
+        students' year spans (see aft_years), other rows from the data
+        (filtered in one plan, most selective filter first, see
+        aft_filters).
+
+        Every query takes the same selection: a years range and
+        {column: allowed values} filters. Results are plain DataFrames,
+        the same (up to dtypes) for every backend.
+
+    Attributes:
+        dataset (EnrollmentDataset) : snapshot the queries run on
+    '''
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def _select(self, columns: list[str], years: list[int] = None,
+                filters: dict = None, name: str = "query") -> pd.DataFrame:
+        '''the given columns of the data rows in the selection'''
+        return FilterSpec(filters, years, YEAR_COLUMN).apply(
+            self.dataset.data, self.dataset.stats, columns, name)
+
+    def filter(self,
+               columns: list[str],
+               years: list[int] = None,
+               filters: dict = None,
+               distinct: bool = False
+               ) -> pd.DataFrame:
+        '''
+        Method-- filter
+            The given columns of the selected rows.
+
+        Parameters:
+            columns (list[str]) : columns to return
+            years (list[int]) : selected years range (default: all)
+            filters (dict) : {column name: allowed values}
+            distinct (bool) : return each distinct row only once
+
+        Returns:
+            pd.DataFrame : the selected rows (in file order if not distinct)
+        '''
+        filters = dict(filters or {})
+        if distinct and set(STUDENT_YEAR_COLUMNS).issuperset(
+                list(columns) + list(filters)):
+            # one run per student, program, code and grade already
+            student_years = self.dataset.student_years
+            rows = student_years.select(years, filters)
+            return student_years.cells[list(columns)].take(rows)\
+                .drop_duplicates(ignore_index=True)
+
+        selected = self._select(columns, years, filters, "query.filter")
+        if distinct:
+            return selected.drop_duplicates(ignore_index=True)
+        return selected
+
+    def group_count(self,
+                    by: list[str],
+                    years: list[int] = None,
+                    filters: dict = None
+                    ) -> pd.DataFrame:
+        '''
+        Method-- group_count
+            Enrollment rows per group of the selected rows (see
+            CountCube.counts).
+
+        Returns:
+            pd.DataFrame : by columns and 'count', one row per non-empty
+                group
+        '''
+        return self.dataset.cube.counts(by, years=years, filters=filters)
+
+    def top_k(self,
+              column: str,
+              k: int,
+              years: list[int] = None,
+              filters: dict = None
+              ) -> pd.DataFrame:
+        '''
+        Method-- top_k
+            The k values of column with the most selected enrollment rows.
+
+        Returns:
+            pd.DataFrame : column and 'count', most rows first (ties in
+                alphabetical order)
+        '''
+        counts = self.group_count([column], years, filters)
+        order = np.lexsort((counts[column].astype(str).to_numpy(),
+                            -counts["count"].to_numpy()))
+        return counts.iloc[order[:k]].reset_index(drop=True)
+
+    def distinct_students(self,
+                          by: list[str] = (),
+                          years: list[int] = None,
+                          filters: dict = None,
+                          exact: bool = None
+                          ) -> pd.DataFrame:
+        '''
+        Method-- distinct_students
+            Number of different students (Person IDs) per group of the
+            selected rows; a student enrolled several times in a group is
+            counted once.
+
+            Selections estimated (from the column statistics) to have at
+            most EXACT_MAX_ROWS rows are counted exactly from the rows
+            (see aft_sketch.distinct_counts); larger ones are estimated
+            from the student sketches of the cells they cover (see
+            aft_sketch.StudentSketches), without a pass over the rows.
+
+        Parameters:
+            by (list[str]) : columns to group by
+            years (list[int]) : selected years range (default: all)
+            filters (dict) : {column name: allowed values}
+            exact (bool) : count exactly (True) or from the sketches
+                (False) whatever the selection's size
+
+        Returns:
+            pd.DataFrame : by columns and 'students', one row per
+                non-empty group (a single row if by is empty)
+        '''
+        by = list(dict.fromkeys(by))
+        spec = FilterSpec(filters, years, YEAR_COLUMN)
+        if exact is None:
+            stats = self.dataset.stats
+            estimated = len(self.dataset.data) * np.prod(
+                [stats.selectivity(p) for p in spec.predicates])
+            exact = estimated <= EXACT_MAX_ROWS
+        if not exact:
+            return self.dataset.sketches.students(by, years, filters)
+
+        selected = spec.apply(self.dataset.data, self.dataset.stats,
+                              by + ["Person ID"], "query.distinct_students")
+        ids = selected["Person ID"].to_numpy()
+        if not by:
+            return pd.DataFrame(
+                {"students": distinct_counts(np.zeros(len(ids), np.int64),
+                                             ids, 1)})
+        grouped = selected.groupby(by, observed=True, dropna=False)
+        groups = grouped.size().reset_index()[by]
+        return groups.assign(students=distinct_counts(
+            grouped.ngroup().to_numpy(), ids, len(groups)))
+
+'''----------------------------- DuckDB Backend ----------------------------'''
+
+def _quote(name: str) -> str:
+    '''SQL identifier of a column name'''
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _whole_sql(expression: str, low: int, high: int) -> str:
+    '''SQL condition: expression is a whole number from low to high'''
+    return (f"({expression} BETWEEN {low} AND {high}"
+            f" AND {expression} = floor({expression}))")
+
+
+class DuckDBBackend:
+    '''
+    Class-- DuckDBBackend
+        Enrollment queries run by an embedded DuckDB database directly
+        over the enrollment CSV or Parquet file, so data that doesn't fit
+        in memory can still be charted. Rows are checked with the same
+        rules as aft_ingest.validate_enrollment, and invalid ones left
+        out, as they are when the data is loaded with pandas.
+
+        Has the same queries as PandasBackend (filter, group_count,
+        top_k and distinct_students), which see the file as it is when
+        they run.
+
+    Attributes:
+        source (str) : enrollment CSV or Parquet (".parquet") file
+        full_name_columns (list[str]) : program columns joined into
+            each program's 'Full name'
+    '''
+
+    def __init__(self, source: str, full_name_columns: list[str]):
+        if duckdb is None:
+            raise ImportError("the duckdb query engine needs duckdb "
+                              "(pip install duckdb)")
+        self.source = source
+        self.full_name_columns = full_name_columns
+        self._lock = threading.Lock()
+        self._database = None
+        self._pid = None
+
+    def _view_sql(self) -> str:
+        '''SQL creating the 'enrollment' view of the valid rows'''
+        path = "'" + self.source.replace("'", "''") + "'"
+        if self.source.endswith(".parquet"):
+            table = f"read_parquet({path})"
+        else:
+            # all text, so a number column with text in it rejects only
+            # those rows
+            table = f"read_csv({path}, header=true, all_varchar=true)"
+
+        as_numbers = ", ".join(
+            f"TRY_CAST({_quote(c)} AS DOUBLE) AS {_quote(c)}"
+            for c in WHOLE_NUMBER_COLUMNS)
+        as_integers = ", ".join(
+            f"CAST({_quote(c)} AS INTEGER) AS {_quote(c)}"
+            for c in WHOLE_NUMBER_COLUMNS)
+        full_name = "concat_ws(' ', " + ", ".join(
+            _quote(c) for c in self.full_name_columns) + ")"
+        codes = ", ".join("'" + code + "'" for code in CODES)
+        year = _quote(YEAR_COLUMN)
+        last_year = datetime.date.today().year + 1
+
+        valid = " AND ".join([
+            _whole_sql(_quote("Person ID"), 1, 2 ** 31 - 1),
+            _whole_sql(_quote("Grade at Time of Activity"),
+                       min(GRADES), max(GRADES)),
+            _whole_sql(_quote("FA"), min(FA_VALUES), max(FA_VALUES)),
+            f"{_quote('Code')} IN ({codes})",
+            f"{_quote('Program (name)')} IS NOT NULL",
+            _whole_sql(year, FIRST_YEAR, last_year),
+            _whole_sql(f"({_quote('Grad year')} - {year})",
+                       min(YEARS_TO_GRADUATION),
+                       max(YEARS_TO_GRADUATION))])
+
+        return (f"CREATE VIEW enrollment AS "
+                f"WITH parsed AS (SELECT * REPLACE ({as_numbers}) "
+                f"FROM {table}) "
+                f"SELECT * REPLACE ({as_integers}), "
+                f"{full_name} AS {_quote('Full name')} "
+                f"FROM parsed WHERE {valid}")
+
+    def _cursor(self):
+        '''
+        Method-- _cursor
+            New cursor on this process's database (a forked server worker
+            opens its own, since a connection can't be shared across a
+            fork); each query gets its own, so threads can query at once.
+        '''
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    database = duckdb.connect()
+                    database.execute(self._view_sql())
+                    self._database, self._pid = database, os.getpid()
+        return self._database.cursor()
+
+    def _where(self, years: list[int] = None,
+               filters: dict = None) -> tuple[str, list]:
+        '''WHERE clause (and its parameters) of a selection'''
+        conditions, parameters = [], []
+        if years is not None:
+            conditions.append(f"{_quote(YEAR_COLUMN)} BETWEEN ? AND ?")
+            parameters += [int(min(years)), int(max(years))]
+        for column, values in (filters or {}).items():
+            values = [value.item() if isinstance(value, np.generic)
+                      else value for value in values]
+            if not values:
+                conditions.append("FALSE")
+                continue
+            conditions.append(f"list_contains(?, {_quote(column)})")
+            parameters.append(values)
+        if not conditions:
+            return "", parameters
+        return " WHERE " + " AND ".join(conditions), parameters
+
+    def _query(self, sql: str, parameters: list) -> pd.DataFrame:
+        cursor = self._cursor()
+        try:
+            return cursor.execute(sql, parameters).df()
+        finally:
+            cursor.close()
+
+    def filter(self,
+               columns: list[str],
+               years: list[int] = None,
+               filters: dict = None,
+               distinct: bool = False
+               ) -> pd.DataFrame:
+        '''
+        Method-- filter
+            The given columns of the selected rows (see PandasBackend.filter)
+        '''
+        where, parameters = self._where(years, filters)
+        selected = ", ".join(_quote(c) for c in columns)
+        return self._query(
+            f"SELECT {'DISTINCT ' if distinct else ''}{selected} "
+            f"FROM enrollment{where}", parameters)
+
+    def group_count(self,
+                    by: list[str],
+                    years: list[int] = None,
+                    filters: dict = None
+                    ) -> pd.DataFrame:
+        '''
+        Method-- group_count
+            Enrollment rows per group of the selected rows (see
+            PandasBackend.group_count)
+        '''
+        by = list(dict.fromkeys(by))
+        where, parameters = self._where(years, filters)
+        if not by:
+            return self._query(
+                f"SELECT count(*) AS count FROM enrollment{where}",
+                parameters)
+        groups = ", ".join(_quote(c) for c in by)
+        return self._query(
+            f"SELECT {groups}, count(*) AS count FROM enrollment{where} "
+            f"GROUP BY {groups} ORDER BY {groups}", parameters)
+
+    def top_k(self,
+              column: str,
+              k: int,
+              years: list[int] = None,
+              filters: dict = None
+              ) -> pd.DataFrame:
+        '''
+        Method-- top_k
+            The k values of column with the most selected enrollment rows
+            (see PandasBackend.top_k)
+        '''
+        where, parameters = self._where(years, filters)
+        return self._query(
+            f"SELECT {_quote(column)}, count(*) AS count "
+            f"FROM enrollment{where} GROUP BY {_quote(column)} "
+            f"ORDER BY count DESC, CAST({_quote(column)} AS VARCHAR) "
+            f"LIMIT ?", parameters + [int(k)])
+
+    def distinct_students(self,
+                          by: list[str] = (),
+                          years: list[int] = None,
+                          filters: dict = None,
+                          exact: bool = None
+                          ) -> pd.DataFrame:
+        '''
+        Method-- distinct_students
+            Number of different students per group of the selected rows
+            (see PandasBackend.distinct_students), counted exactly unless
+            exact is False (then with DuckDB's HyperLogLog estimate)
+        '''
+        by = list(dict.fromkeys(by))
+        where, parameters = self._where(years, filters)
+        person = _quote("Person ID")
+        students = (f"approx_count_distinct({person})" if exact is False
+                    else f"count(DISTINCT {person})") + " AS students"
+        if not by:
+            return self._query(
+                f"SELECT {students} FROM enrollment{where}", parameters)
+        groups = ", ".join(_quote(c) for c in by)
+        return self._query(
+            f"SELECT {groups}, {students} FROM enrollment{where} "
+            f"GROUP BY {groups} ORDER BY {groups}", parameters)
@@ -0,0 +1,278 @@
+'''
+AFT Data Visualization Tool
+Benchmarks
+'''
+'''-------------------------- Imports & Constants --------------------------'''
+
+# pre-existing python libraries
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+# our custom-made libraries
+from . import aft_plot_functions
+from .aft_cache import payload_bytes
+from .aft_columnar import cache_path
+from .aft_data_org import EnrollmentDataset, TREEMAP_DEMOGS
+from .aft_index import index_path
+from .aft_synth import parse_rows, write_enrollment_csv
+
+# dataset sizes benchmarked by default (see aft_synth.parse_rows)
+SCALES = ["38k", "1M"]
+
+# parameter grids
+YEAR_SPANS = [1, 5, 22]         # years selected, ending at the last year
+PROGRAM_COUNTS = [5, 20, None]  # programs selected (None: all of them)
+COMPARISON_COUNTS = [2, 10, 30] # comparison facets (plotly caps the rows)
+DEMOGRAPHIC_COUNTS = [1, 3, 6]  # treemap demographics (of TREEMAP_DEMOGS)
+HEATMAP_SIZES = [12, 30]        # programs compared in the heatmap
+
+'''--------------------------- Benchmark Functions -------------------------'''
+
+def measure(func, repeat: int = 3) -> dict:
+    '''
+    Function-- measure
+        Times func() once cold (first call, which also builds any cached
+        cube or index it needs) and `repeat` times warm, then runs it once
+        more under tracemalloc for its peak memory. Timed runs are not
+        traced, since tracing slows down allocations.
+
+    Returns:
+        dict : "cold_s", "warm_s" (median), "peak_mb" and "json_bytes"
+            (size of the result once serialized for the browser, or None
+            if it isn't a figure)
+    '''
+    start = time.perf_counter()
+    result = func()
+    cold = time.perf_counter() - start
+
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        warm.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "cold_s": round(cold, 6),
+        "warm_s": round(statistics.median(warm), 6) if warm else None,
+        "peak_mb": round(peak / 1024 ** 2, 3),
+        "json_bytes": payload_bytes(result)
+            if hasattr(result, "to_plotly_json") else None}
+
+
+def synthetic_csv(rows: int, data_dir: str, seed: int = 0) -> str:
+    '''
+    Function-- synthetic_csv
+        path of a synthetic enrollment CSV with `rows` rows in data_dir,
+        generated (see aft_synth) unless it is already there
+    '''
+    path = os.path.join(data_dir, f"synthetic_{rows}_{seed}.csv")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        write_enrollment_csv(path, rows, seed=seed)
+    return path
+
+
+def benchmark_load(csv_path: str, repeat: int = 3) -> list[dict]:
+    '''
+    Function-- benchmark_load
+        Data load from the CSV (no columnar cache or index yet) and from
+        the columnar cache, each with a new EnrollmentDataset.
+    '''
+    def from_csv():
+        for path in (cache_path(csv_path), index_path(csv_path)):
+            if os.path.exists(path):
+                os.remove(path)
+        return EnrollmentDataset(csv_path).data
+
+    def from_cache():
+        return EnrollmentDataset(csv_path).data
+
+    return [
+        {"function": "load_enrollment_data",
+         "params": {"source": "csv"},
+         **measure(from_csv, repeat)},
+        {"function": "load_enrollment_data",
+         "params": {"source": "columnar cache"},
+         **measure(from_cache, repeat)}]
+
+
+def benchmark_plots(dataset: EnrollmentDataset, repeat: int = 3) -> list[dict]:
+    '''
+    Function-- benchmark_plots
+        Every plot function over the YEAR_SPANS, PROGRAM_COUNTS,
+        COMPARISON_COUNTS, DEMOGRAPHIC_COUNTS and HEATMAP_SIZES grids, on
+        one dataset.
+
+    Returns:
+        list[dict] : one result per function and parameter combination
+    '''
+    last_year = dataset.years[-1]
+    codes = list(dataset.codes)
+    programs = dataset.program_list
+    cases = []
+
+    for span in YEAR_SPANS:
+        years = [last_year - span + 1, last_year]
+        for count in PROGRAM_COUNTS:
+            selected = programs[:count]
+            cases.append(("total_program_enrollment_bar",
+                          {"years": span, "programs": len(selected)},
+                          lambda years=years, selected=selected:
+                          aft_plot_functions.total_program_enrollment_bar(
+                              programs=selected, years=years,
+                              demographics="Gender code",
+                              groupmode="group", grades="all",
+                              dataset=dataset)))
+        for count in COMPARISON_COUNTS:
+            selected = programs[:count]
+            cases.append(("program_comparison_bar",
+                          {"years": span, "programs": len(selected)},
+                          lambda years=years, selected=selected:
+                          aft_plot_functions.program_comparison_bar(
+                              programs=selected, years=years,
+                              groupby="Program (name)",
+                              demographics="Gender code",
+                              groupmode="group", grades="all",
+                              dataset=dataset)))
+
+        for count in DEMOGRAPHIC_COUNTS:
+            demographics = list(TREEMAP_DEMOGS)[:count]
+            cases.append(("treemap",
+                          {"years": span, "demographics": count},
+                          lambda years=years, demographics=demographics:
+                          aft_plot_functions.treemap(
+                              years=years, program_codes=codes,
+                              id_variables=demographics,
+                              dataset=dataset)))
+
+        for n in HEATMAP_SIZES:
+            cases.append(("generate_dash_heatmap",
+                          {"years": span, "n": n},
+                          lambda years=years, n=n:
+                          aft_plot_functions.generate_dash_heatmap(
+                              years=years, program_codes=codes,
+                              grades="all", n=n, dataset=dataset)))
+            cases.append(("filter_top_progs",
+                          {"years": span, "n": n},
+                          lambda years=years, n=n:
+                          aft_plot_functions.filter_top_progs(
+                              dataset.data, years=years,
+                              program_codes=codes, grades="all", n=n,
+                              stats=dataset.stats)))
+
+    return [{"function": function, "params": params, **measure(func, repeat)}
+            for function, params, func in cases]
+
+
+def run_benchmarks(
+    scales: list[str] = SCALES,
+    data_dir: str = None,
+    repeat: int = 3,
+    seed: int = 0
+    ) -> dict:
+    '''
+    Function-- run_benchmarks
+        Benchmarks the data load and every plot function at each scale,
+        on synthetic data (see aft_synth).
+
+    Parameters:
+        scales (list[str]) : # of rows per dataset, e.g. ["38k", "1M"]
+        data_dir (str) : folder for the synthetic CSVs, reused between runs
+            (default: a temporary folder)
+        repeat (int) : warm runs per measurement
+        seed (int) : synthetic data seed
+
+    Returns:
+        dict : "meta" (when and where it ran) and "results" (one dict per
+            scale, function and parameters)
+    '''
+    results = []
+    with contextlib.ExitStack() as stack:
+        if data_dir is None:
+            data_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        for scale in scales:
+            rows = parse_rows(scale)
+            csv_path = synthetic_csv(rows, data_dir, seed)
+            dataset = EnrollmentDataset(csv_path)
+            for result in benchmark_load(csv_path, repeat) \
+                + benchmark_plots(dataset, repeat):
+                results.append({"scale": scale, "rows": rows, **result})
+
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "machine": platform.platform(),
+            "repeat": repeat,
+            "seed": seed},
+        "results": results}
+
+
+def compare(before: dict, after: dict) -> pd.DataFrame:
+    '''
+    Function-- compare
+        Warm time and peak memory of two benchmark runs side by side,
+        matched on scale, function and parameters.
+
+    Returns:
+        pd.DataFrame : one row per shared measurement, with "speedup"
+            (before / after warm time)
+    '''
+    def table(run):
+        df = pd.DataFrame(run["results"])
+        df["params"] = df["params"].map(lambda p: json.dumps(p, sort_keys=True))
+        return df.set_index(["scale", "function", "params"])\
+            [["warm_s", "peak_mb"]]
+
+    joined = table(before).join(table(after), how="inner",
+                                lsuffix=" (before)", rsuffix=" (after)")
+    joined["speedup"] = (joined["warm_s (before)"]
+                         / joined["warm_s (after)"]).round(2)
+    return joined
+
+'''----------------------------------- Main --------------------------------'''
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the plot functions on synthetic data")
+    parser.add_argument("--scales", nargs="+", default=SCALES,
+                        help="# of rows, e.g. 38k 1M 10M")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=None,
+                        help="folder to keep the synthetic CSVs in")
+    parser.add_argument("--out", default="aft_benchmark.json",
+                        help="JSON file to save the results to")
+    parser.add_argument("--compare", default=None,
+                        help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    run = run_benchmarks(args.scales, args.data_dir, args.repeat, args.seed)
+    with open(args.out, "w") as file:
+        json.dump(run, file, indent=2)
+
+    pd.set_option("display.width", 200)
+    print(pd.DataFrame(run["results"]).to_string(index=False))
+    if args.compare:
+        with open(args.compare) as file:
+            print(compare(json.load(file), run).to_string())
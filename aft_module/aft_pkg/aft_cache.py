@@ -0,0 +1,202 @@
+'''
+AFT Data Visualization Tool
+Figure Cache
+'''
+'''-------------------------- Imports & Constants --------------------------'''
+
+# pre-existing python libraries
+import functools
+import inspect
+import json
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+from plotly.basedatatypes import BaseFigure
+from plotly.utils import PlotlyJSONEncoder
+
+'''--------------------------------- Cache ---------------------------------'''
+
+def payload_bytes(value) -> int:
+    '''
+    Function-- payload_bytes
+        size of a callback output (figure, component, ...) once it is
+        serialized to JSON for the browser
+    '''
+    return len(json.dumps(value, cls=PlotlyJSONEncoder))
+
+
+def estimated_bytes(value) -> int:
+    '''
+    Function-- estimated_bytes
+        Rough size of a callback output, to bound the cache without
+        serializing every entry (see payload_bytes for the exact size):
+        numeric arrays count their bytes, text its characters, and
+        figures, components, dicts and lists the sum of their parts.
+    '''
+    if isinstance(value, BaseFigure):
+        # the figure's own trace and layout dicts: to_plotly_json() would
+        # deep-copy them first
+        return estimated_bytes(value._data) + estimated_bytes(value._layout)
+    if hasattr(value, "to_plotly_json"):
+        value = value.to_plotly_json()
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(estimated_bytes(key) + estimated_bytes(item)
+                   for key, item in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sum(estimated_bytes(item) for item in value)
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        value = np.asarray(value)
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            return sum(estimated_bytes(item) for item in value.ravel())
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+def normalize(value, unordered: bool = False):
+    '''
+    Function-- normalize
+        Hashable, canonical form of a callback argument: lists become
+        tuples (sorted and de-duplicated if their order doesn't matter,
+        e.g. selected programs or codes), dicts become sorted tuples and
+        objects with a cache_key() method (e.g. a dataset snapshot) are
+        replaced by their key.
+    '''
+    if hasattr(value, "cache_key"):
+        return value.cache_key()
+    if isinstance(value, dict):
+        return tuple(sorted((key, normalize(item))
+                            for key, item in value.items()))
+    if hasattr(value, "tolist") and getattr(value, "ndim", None) == 0:
+        # numpy scalar (e.g. a year from a slider or the data)
+        return value.tolist()
+    if isinstance(value, (list, tuple, set)) or hasattr(value, "tolist"):
+        items = [normalize(item) for item in list(value)]
+        return tuple(sorted(set(items), key=repr)) if unordered \
+            else tuple(items)
+    return value
+
+
+class FigureCache:
+    '''
+    Class-- FigureCache
+        Bounded, thread-safe LRU cache of callback outputs.
+
+        Entries are evicted least recently used first once there are more
+        than max_entries of them or their estimated size (see
+        estimated_bytes) adds up to more than max_bytes. The whole cache is cleared whenever version()
+        (the dataset version) changes.
+
+    Attributes:
+        hits (int) : lookups answered from the cache
+        misses (int) : lookups that had to be computed
+        evictions (int) : entries dropped to stay within the bounds
+        size_bytes (int) : estimated size of all entries
+    '''
+
+    def __init__(self, max_entries: int = 256,
+                 max_bytes: int = 64 * 1024 ** 2,
+                 version=lambda: None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._version = version
+        self._seen_version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        '''drops every entry (counters are kept)'''
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def _check_version(self) -> None:
+        '''clears the cache if the dataset version has changed'''
+        version = self._version()
+        if version != self._seen_version:
+            self._entries.clear()
+            self.size_bytes = 0
+            self._seen_version = version
+
+    def get(self, key, compute):
+        '''
+        Method-- get
+            Returns the cached value for key, or computes, stores and
+            returns it. compute() runs outside the lock so a slow figure
+            doesn't block other callbacks.
+        '''
+        with self._lock:
+            self._check_version()
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            version = self._seen_version
+
+        value = compute()
+        size = estimated_bytes(value)
+
+        with self._lock:
+            # skip values too big to cache, or computed for an old dataset
+            if size > self.max_bytes or version != self._seen_version:
+                return value
+            if key in self._entries:
+                self.size_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.size_bytes += size
+
+            while len(self._entries) > self.max_entries or \
+                self.size_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size_bytes -= evicted_size
+                self.evictions += 1
+        return value
+
+    def stats(self) -> dict:
+        '''hit/miss counters and current size'''
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions}
+
+    def memoize(self, unordered: tuple = (), ignored: tuple = ()):
+        '''
+        Method-- memoize
+            Decorator caching a function's output, keyed on its normalized
+            arguments.
+
+        Parameters:
+            unordered (tuple[str]) : argument names whose order doesn't
+                matter (e.g. selected programs or program codes)
+            ignored (tuple[str]) : argument names left out of the key
+        '''
+        def decorator(func):
+            signature = inspect.signature(func)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                key = (func.__qualname__,) + tuple(
+                    (name, normalize(value, name in unordered))
+                    for name, value in bound.arguments.items()
+                    if name not in ignored)
+                return self.get(key, lambda: func(*args, **kwargs))
+            return wrapper
+        return decorator
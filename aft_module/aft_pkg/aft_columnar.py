@@ -0,0 +1,208 @@
+'''
+AFT Data Visualization Tool
+Columnar Data Cache
+'''
+'''-------------------------- Imports & Constants --------------------------'''
+
+# pre-existing python libraries
+import hashlib
+import json
+import os
+import pandas as pd
+
+# pyarrow is optional: without it the enrollment CSV is parsed every time
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
+# bumped whenever the cached columns or dtypes change
+CACHE_VERSION = 2
+
+# schema metadata keys describing the CSV a cache was built from
+SIZE_KEY = b"aft.source.size"
+MTIME_KEY = b"aft.source.mtime_ns"
+HASH_KEY = b"aft.source.sha256"
+VERSION_KEY = b"aft.cache.version"
+
+# categorical columns are stored as their integer codes, with the
+# categories of each one in the schema metadata
+CATEGORIES_KEY = b"aft.categories"
+
+'''---------------------------- Cache Functions ----------------------------'''
+
+def cache_path(csv_path: str) -> str:
+    '''
+    Function-- cache_path
+        location of the columnar cache, next to the CSV it was built from
+    '''
+    return csv_path + ".feather"
+
+
+def content_hash(path: str, chunk_size: int = 1 << 20,
+                 size: int = None) -> str:
+    '''
+    Function-- content_hash
+        sha256 of a file's contents (or of its first `size` bytes), read
+        in chunks
+    '''
+    digest = hashlib.sha256()
+    remaining = float("inf") if size is None else size
+    with open(path, "rb") as file:
+        while remaining > 0 and \
+            (chunk := file.read(int(min(chunk_size, remaining)))):
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def read_columnar_cache(csv_path: str) -> pd.DataFrame | None:
+    '''
+    Function-- read_columnar_cache
+        Memory-maps the Arrow IPC (Feather v2) cache of csv_path. Every
+        column of the returned frame is a read-only view of the mapped
+        file, so processes that map the same cache share its pages
+        instead of each holding a copy of the data.
+
+        The cache is valid if it was written by this CACHE_VERSION and
+        the CSV has the same size and mtime as when it was written. If
+        only the mtime differs (e.g. the file was copied or touched), the
+        content hash decides.
+
+    Parameters:
+        csv_path (str) : path of the enrollment CSV
+
+    Returns:
+        pd.DataFrame, or None if pyarrow is missing or the cache is
+        missing or out of date
+    '''
+    if pa is None or not os.path.exists(cache_path(csv_path)):
+        return None
+
+    try:
+        source = pa.memory_map(cache_path(csv_path))
+        table = pa.ipc.open_file(source).read_all()
+    except (OSError, pa.ArrowInvalid):
+        return None
+
+    metadata = table.schema.metadata or {}
+    stat = os.stat(csv_path)
+    if metadata.get(VERSION_KEY) != str(CACHE_VERSION).encode() or \
+        metadata.get(SIZE_KEY) != str(stat.st_size).encode():
+        return None
+    if metadata.get(MTIME_KEY) != str(stat.st_mtime_ns).encode() and \
+        metadata.get(HASH_KEY) != content_hash(csv_path).encode():
+        return None
+
+    categories = json.loads(metadata.get(CATEGORIES_KEY, b"{}"))
+    columns = []
+    for name in table.column_names:
+        column = table.column(name)
+        if column.num_chunks > 1:
+            return None
+        array = column.chunk(0) if column.num_chunks else \
+            column.combine_chunks()
+        try:
+            # fails rather than copies (e.g. for a column with nulls)
+            values = array.to_numpy(zero_copy_only=True)
+        except pa.ArrowInvalid:
+            return None
+        if name in categories:
+            values = pd.Categorical.from_codes(values, categories[name],
+                                               validate=False)
+        columns.append(pd.Series(values, name=name, copy=False))
+
+    # concat (unlike the DataFrame constructor) doesn't consolidate the
+    # columns into new 2D blocks, so they stay views of the mapped file
+    return pd.concat(columns, axis=1, copy=False)
+
+
+def stored_content_hash(csv_path: str, size: int,
+                        mtime_ns: int) -> str | None:
+    '''
+    Function-- stored_content_hash
+        Content hash the columnar cache of csv_path was tagged with, if it
+        was written for the CSV at this size and mtime, so a loaded CSV
+        needn't be read again to hash it. Only the cache's schema is read.
+
+    Returns:
+        str, or None if pyarrow is missing or the cache is missing or was
+        written for another version of the CSV
+    '''
+    if pa is None or not os.path.exists(cache_path(csv_path)):
+        return None
+    try:
+        with pa.memory_map(cache_path(csv_path)) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    if metadata.get(VERSION_KEY) != str(CACHE_VERSION).encode() or \
+        metadata.get(SIZE_KEY) != str(size).encode() or \
+        metadata.get(MTIME_KEY) != str(mtime_ns).encode() or \
+        HASH_KEY not in metadata:
+        return None
+    return metadata[HASH_KEY].decode()
+
+
+def write_columnar_cache(df: pd.DataFrame, csv_path: str,
+                         digest: str = None) -> None:
+    '''
+    Function-- write_columnar_cache
+        Writes df as an uncompressed Arrow IPC (Feather v2) file next to
+        csv_path, tagged with the CSV's size, mtime and content hash.
+        Uncompressed and in a single record batch, with categoricals as
+        their (never null) codes, so every column can be memory-mapped
+        without a copy; written to a temporary file first so readers
+        never see a half-written cache.
+
+    Parameters:
+        df (pd.DataFrame) : parsed contents of csv_path
+        csv_path (str) : path of the enrollment CSV
+        digest (str) : content hash of csv_path, if already known
+            (default: it is read and hashed)
+    '''
+    stat = os.stat(csv_path)
+    categorical = df.select_dtypes("category").columns
+    table = pa.Table.from_pandas(
+        df.assign(**{name: df[name].cat.codes for name in categorical}),
+        preserve_index=False)
+    table = table.replace_schema_metadata({
+        CATEGORIES_KEY: json.dumps({
+            name: df[name].cat.categories.tolist() for name in categorical}),
+        VERSION_KEY: str(CACHE_VERSION),
+        SIZE_KEY: str(stat.st_size),
+        MTIME_KEY: str(stat.st_mtime_ns),
+        HASH_KEY: digest or content_hash(csv_path)})
+
+    temporary = f"{cache_path(csv_path)}.{os.getpid()}.tmp"
+    feather.write_feather(table, temporary, compression="uncompressed",
+                          chunksize=max(len(df), 1))
+    os.replace(temporary, cache_path(csv_path))
+
+
+def load_columnar(csv_path: str, read_csv) -> pd.DataFrame:
+    '''
+    Function-- load_columnar
+        Loads csv_path from its columnar cache, or parses it with read_csv
+        and (re)writes the cache when the cache is missing or out of date.
+
+    Parameters:
+        csv_path (str) : path of the enrollment CSV
+        read_csv (callable) : parses csv_path into a pd.DataFrame
+
+    Returns:
+        pd.DataFrame
+    '''
+    df = read_columnar_cache(csv_path)
+    if df is not None:
+        return df
+
+    df = read_csv(csv_path)
+    if pa is not None:
+        try:
+            write_columnar_cache(df, csv_path)
+        except OSError:
+            # read-only data folder: parse the CSV every time instead
+            pass
+    return df
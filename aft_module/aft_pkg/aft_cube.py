@@ -0,0 +1,159 @@
+'''
+AFT Data Visualization Tool
+Enrollment Count Cube
+'''
+'''-------------------------- Imports & Constants --------------------------'''
+
+# pre-existing python libraries
+import threading
+import pandas as pd
+
+# our custom-made libraries
+from .aft_years import YEAR_COLUMN, append_rows, build_year_prefix_sums
+
+# every cube is counted over these columns, plus the requested extras
+CUBE_DIMENSIONS = [
+    "Acad Yr (start)",
+    "Program (name)",
+    "Grade at Time of Activity"]
+
+'''---------------------------------- Cube ---------------------------------'''
+
+class CountCube:
+    '''
+    Class-- CountCube
+        Pre-aggregated enrollment row counts over year x program x grade
+        (CUBE_DIMENSIONS) x any DEMOGRAPHICS/COMPARISON_GROUPS columns.
+
+        Each combination of extra columns is counted once, on first use,
+        into a long-form table with only the non-empty cells. Its size
+        depends on the number of distinct values, not on the number of
+        rows, so the bar charts can be served from it without row scans.
+        Counts that aren't split by year are served from cumulative
+        year totals (see aft_years), so any year range costs the same.
+
+    Attributes:
+        cubes (dict) : {tuple of extra columns: long-form count table}
+        year_sums (dict) : {tuple of extra columns: YearPrefixSums of the
+            same counts, one cell per non-year combination}
+    '''
+
+    def __init__(self, df: pd.DataFrame):
+        self._df = df
+        self._lock = threading.Lock()
+        self.cubes = {}
+        self.year_sums = {}
+
+    def cube(self, extra_columns: list[str] = ()) -> pd.DataFrame:
+        '''
+        Method-- cube
+            count table over CUBE_DIMENSIONS + extra_columns, with a
+            'count' column of enrollment rows per cell
+        '''
+        key = tuple(sorted(set(extra_columns) - set(CUBE_DIMENSIONS)))
+        if key not in self.cubes:
+            with self._lock:
+                if key not in self.cubes:
+                    self.cubes[key] = self._df\
+                        .groupby(CUBE_DIMENSIONS + list(key),
+                                 observed=True, dropna=False)\
+                        .size().rename("count").reset_index()
+        return self.cubes[key]
+
+    def appended(self, df: pd.DataFrame,
+                 tail: pd.DataFrame) -> "CountCube":
+        '''
+        Method-- appended
+            New CountCube over df (the enrollment rows with tail appended)
+            that keeps every cube and year total already counted here,
+            adding only the tail's counts to them.
+
+        Parameters:
+            df (pd.DataFrame) : all enrollment rows, including tail
+            tail (pd.DataFrame) : the newly appended rows
+
+        Returns:
+            CountCube
+        '''
+        updated = CountCube(df)
+        for key, cube in list(self.cubes.items()):
+            columns = CUBE_DIMENSIONS + list(key)
+            new_counts = tail.groupby(columns, observed=True, dropna=False)\
+                .size().rename("count").reset_index()
+            updated.cubes[key] = append_rows(cube, new_counts)\
+                .groupby(columns, observed=True, dropna=False)\
+                ["count"].sum().reset_index()
+
+            if key in self.year_sums:
+                updated.year_sums[key] = self.year_sums[key].appended(
+                    new_counts, weights="count")
+        return updated
+
+    def year_prefix_sums(self, extra_columns: list[str] = ()):
+        '''
+        Method-- year_prefix_sums
+            YearPrefixSums of cube(extra_columns) along the year axis
+        '''
+        key = tuple(sorted(set(extra_columns) - set(CUBE_DIMENSIONS)))
+        if key not in self.year_sums:
+            cube = self.cube(key)
+            with self._lock:
+                if key not in self.year_sums:
+                    self.year_sums[key] = build_year_prefix_sums(
+                        cube,
+                        [c for c in CUBE_DIMENSIONS if c != YEAR_COLUMN]
+                        + list(key),
+                        weights="count")
+        return self.year_sums[key]
+
+    def counts(self,
+               by: list[str],
+               programs: list[str] = None,
+               years: list[int] = None,
+               grades: list[int] = None,
+               filters: dict = None
+               ) -> pd.DataFrame:
+        '''
+        Method-- counts
+            Enrollment row counts for the selected programs, years and
+            grades, grouped by the given columns.
+
+        Parameters:
+            by (list[str]) : columns to group by (duplicates are ignored)
+            programs (list[str]) : selected program names (default: all)
+            years (list[int]) : selected years range (first and last year)
+            grades (list[int]) : selected grades (default: all)
+            filters (dict) : other filters, {column name: allowed values}
+                (e.g. {"Code": ["S", "A"]})
+
+        Returns:
+            pd.DataFrame : one row per non-empty group (in order of first
+                appearance) with a 'count' column
+        '''
+        by = list(dict.fromkeys(by))
+        filters = dict(filters or {})
+        if programs is not None:
+            filters["Program (name)"] = programs
+        if grades is not None:
+            filters["Grade at Time of Activity"] = grades
+        extra_columns = by + list(filters)
+
+        if YEAR_COLUMN in by or years is None:
+            # split by year: filter the (small) long-form cube
+            cells = self.cube(extra_columns)
+            counts = cells["count"].to_numpy()
+            if years is not None:
+                filters[YEAR_COLUMN] = range(min(years), max(years)+1)
+        else:
+            # year range totals: difference of two cumulative rows
+            year_sums = self.year_prefix_sums(extra_columns)
+            cells = year_sums.cells
+            counts = year_sums.between(min(years), max(years))
+
+        keep = counts > 0
+        for column, values in filters.items():
+            keep &= cells[column].isin(list(values)).to_numpy()
+        selected = cells[keep].assign(count=counts[keep])
+
+        return selected.groupby(by, observed=True, sort=False, dropna=False)\
+            ["count"].sum().reset_index()
@@ -5,28 +5,687 @@ Data Organization
 '''-------------------------- Imports & Constants --------------------------'''
 
 # pre-existing python libraries
+import io
+import logging
+import os
+import threading
+import time
+import numpy as np
 import pandas as pd
 
+# our custom-made libraries
+from .aft_backend import (ENGINES, STUDENT_YEAR_COLUMNS, DuckDBBackend,
+                          PandasBackend)
+from .aft_columnar import (content_hash, load_columnar, pa,
+                           stored_content_hash, write_columnar_cache)
+from .aft_cube import CountCube
+from .aft_filters import ColumnStats
+from .aft_index import load_enrollment_index
+from .aft_ingest import CODE_LABELS, quarantine_path, read_validated_csv
+from .aft_sketch import StudentSketches
+from .aft_trajectory import TRAJECTORY_COLUMNS, StudentTrajectories
+from .aft_years import build_year_spans
+
+# in-memory schema of the enrollment CSV: low-cardinality text columns are
+# stored as categoricals and numbers with the smallest integer type that fits
+SCHEMA = {
+    "Person ID": "int32",
+    "Gender code": "category",
+    "Race/ethnicity": "category",
+    "FA": "int8",
+    "Acad Yr (start)": "int16",
+    "Code": "category",
+    "Program (name)": "category",
+    "Program (Gender)": "category",
+    "Program (Level)": "category",
+    "Program (Season)": "category",
+    "Grade at Time of Activity": "int8",
+    "Grad year": "int16"}
+
+# program columns combined into a program's 'Full name'
+FULL_NAME_COLUMNS = ['Program (Gender)', 'Program (Level)', 'Program (name)']
+
+# last bytes of the loaded CSV kept with each snapshot: if the file still
+# has them at the same offset, it was only appended to
+TAIL_BYTES = 4096
+
+# times the CSV is re-read if it changes while being read
+LOAD_ATTEMPTS = 3
+
+# seconds between checks of the CSV for new rows (see DatasetHandle.watch)
+WATCH_INTERVAL = 5
+
+# count cubes warm() builds besides one per demographic: the heatmap's
+# top programs per code and the default treemap's demographics per code
+WARM_CUBES = [["Full name", "Code"],
+              ["Race/ethnicity", "Gender code", "Code"]]
+
+# engine the charts are queried with (see aft_backend): "pandas" loads the
+# data into memory, "duckdb" queries the file itself, for data too large
+# to load (set AFT_QUERY_ENGINE to change it)
+QUERY_ENGINE = os.environ.get("AFT_QUERY_ENGINE", "pandas")
+
+'''----------------------------- Data Functions ----------------------------'''
+
+def read_enrollment_csv(path: str) -> pd.DataFrame:
+    '''
+    Function-- read_enrollment_csv
+        Parses the enrollment CSV in chunks with the compact SCHEMA dtypes
+        and adds each program's 'Full name'. Invalid rows are left out and
+        written to its quarantine CSV (see aft_ingest).
+
+    Parameters:
+        path (str) : enrollment data CSV
+
+    Returns:
+        pd.DataFrame : enrollment data
+    '''
+    df = read_validated_csv(path, SCHEMA, quarantine=quarantine_path(path))
+
+    # program 'Full name' (e.g. "Girls Varsity Crew"), computed once at load
+    df['Full name'] = program_full_name(df)
+    return df
+
+
+def read_enrollment_rows(
+    content: bytes,
+    columns: list[str],
+    path: str,
+    first_line: int
+    ) -> pd.DataFrame:
+    '''
+    Function-- read_enrollment_rows
+        Parses headerless enrollment CSV rows (e.g. the ones appended to
+        the file since it was loaded) like read_enrollment_csv(), adding
+        invalid rows to the file's quarantine CSV.
+
+    Parameters:
+        content (bytes) : complete CSV lines, without the header
+        columns (list[str]) : the CSV's columns, in file order
+        path (str) : enrollment data CSV the lines are from
+        first_line (int) : line number of the first line in the file
+
+    Returns:
+        pd.DataFrame : enrollment rows
+    '''
+    df = read_validated_csv(
+        io.BytesIO(content),
+        {c: SCHEMA[c] for c in columns if c in SCHEMA},
+        quarantine=quarantine_path(path), append=True,
+        names=columns, first_line=first_line)
+    df['Full name'] = program_full_name(df)
+    return df
+
+
+def count_lines(path: str, size: int) -> int:
+    '''
+    Function-- count_lines
+        number of lines in the first `size` bytes of a file, read 1 MB at
+        a time
+    '''
+    lines = 0
+    with open(path, "rb") as file:
+        while size > 0:
+            block = file.read(min(size, 1 << 20))
+            if not block:
+                break
+            lines += block.count(b"\n")
+            size -= len(block)
+    return lines
+
+
+def concat_enrollment(df: pd.DataFrame, rows: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Function-- concat_enrollment
+        df with rows appended, keeping df's dtypes: categorical columns
+        keep their categories (and codes), with any new values added
+        after them.
+
+    Parameters:
+        df (pd.DataFrame) : enrollment data
+        rows (pd.DataFrame) : new rows, with the same columns
+
+    Returns:
+        pd.DataFrame
+    '''
+    columns = {}
+    for name in df.columns:
+        if isinstance(df[name].dtype, pd.CategoricalDtype):
+            columns[name] = pd.api.types.union_categoricals(
+                [df[name].array, rows[name].astype("category").array])
+        else:
+            columns[name] = np.concatenate(
+                [df[name].to_numpy(), rows[name].to_numpy(df[name].dtype)])
+    return pd.DataFrame(columns)
+
+
+def load_enrollment_data(path: str) -> pd.DataFrame:
+    '''
+    Function-- load_enrollment_data
+        Loads the enrollment data, from its memory-mapped columnar cache
+        (see aft_columnar) when the CSV hasn't changed since it was built.
+
+    Parameters:
+        path (str) : enrollment data CSV
+
+    Returns:
+        pd.DataFrame : enrollment data
+    '''
+    return load_columnar(path, read_enrollment_csv)
+
+
+def csv_version(path: str) -> str:
+    '''
+    Function-- csv_version
+        version string of the enrollment CSV, from its size and mtime;
+        it changes whenever the file is rewritten or appended to
+    '''
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Function-- memory_report
+        Compares the memory footprint of two versions of the same data,
+        e.g. a plain pd.read_csv frame vs. load_enrollment_data().
+
+    Parameters:
+        before (pd.DataFrame) : original data
+        after (pd.DataFrame) : compacted data
+
+    Returns:
+        pd.DataFrame : dtype and MB per column before and after,
+            plus a "Total" row
+    '''
+    megabytes = 1024 ** 2
+    report = pd.DataFrame({
+        "dtype (before)": before.dtypes.astype(str),
+        "MB (before)": before.memory_usage(index=False, deep=True) / megabytes,
+        "dtype (after)": after.dtypes.astype(str),
+        "MB (after)": after.memory_usage(index=False, deep=True) / megabytes})
+    report.loc["Total"] = ["", report["MB (before)"].sum(),
+                           "", report["MB (after)"].sum()]
+    return report.round(3)
+
+
+def read_only(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Function-- read_only
+        Same frame, with every column backed by a read-only array, so any
+        attempt to modify it in place raises instead of changing data
+        other callbacks are reading. Columns are not copied.
+    '''
+    columns = []
+    for name in df.columns:
+        values = df[name].array
+        if isinstance(values, pd.Categorical):
+            codes = values.codes
+            codes.flags.writeable = False
+            values = pd.Categorical.from_codes(codes, values.categories,
+                                               validate=False)
+        else:
+            values = df[name].to_numpy()
+            values.flags.writeable = False
+        columns.append(pd.Series(values, name=name, copy=False))
+    if not columns:
+        return df
+    return pd.concat(columns, axis=1, copy=False)
+
+
+def program_full_name(df: pd.DataFrame) -> pd.Series:
+    '''
+    Function-- program_full_name
+        Vectorized 'Full name' of each row's program: the non-NaN values of
+        'Program (Gender)', 'Program (Level)' and 'Program (name)' joined
+        by spaces (e.g. "Girls Varsity Crew").
+
+    Parameters:
+        df (pd.DataFrame) : rows with the FULL_NAME_COLUMNS
+
+    Returns:
+        pd.Series : categorical of full program names,
+            "" if all columns are NaN
+
+    Note:
+        Names are only built once per distinct program, then broadcast
+        back to the rows through the category codes.
+    '''
+    programs = df.groupby(FULL_NAME_COLUMNS, dropna=False, sort=False,
+                          observed=True)
+    program_codes = programs.ngroup().to_numpy()
+    distinct = programs.size().reset_index()
+
+    full_name = pd.Series("", index=distinct.index, dtype=object)
+    for column in FULL_NAME_COLUMNS:
+        value = distinct[column]
+        full_name = full_name.where(value.isna(),
+                                    full_name + " " + value.astype(str))
+    # every non-empty name starts with the separator
+    name_codes, names = pd.factorize(full_name.str[1:])
+
+    return pd.Series(
+        pd.Categorical.from_codes(name_codes[program_codes], names),
+        index=df.index,
+        name='Full name')
+
+'''-------------------------------- Dataset --------------------------------'''
+
+class EnrollmentDataset:
+    '''
+    Class-- EnrollmentDataset
+        Immutable snapshot of one version of the enrollment data. Nothing
+        is read until one of the attributes below is first used; each is
+        then built once (under a lock, so concurrent callbacks don't load
+        it twice) and reused. The data itself is read-only (see
+        read_only()), and a newer CSV gets a new snapshot (see
+        DatasetHandle) rather than changing this one.
+
+    Attributes:
+        path (str) : enrollment data CSV
+        version (str) : identifies the loaded data (see csv_version())
+        content_hash (str) : sha256 of the loaded part of the CSV, which
+            identifies the data across restarts and copies of the file;
+            taken from the columnar cache when it was written for this
+            version of the CSV, so only hashed when the cache is written
+        query : the chart queries' backend (see aft_backend), by
+            QUERY_ENGINE
+        data (pd.DataFrame) : all data (see load_enrollment_data())
+        stats (ColumnStats) : row shares of each column's values, to plan
+            filters (see aft_filters)
+        index (EnrollmentIndex) : student membership index (see
+            aft_index), for set queries; loaded (or built and saved) only
+            when first used, as no chart needs it
+        cube (CountCube) : pre-aggregated enrollment counts (see aft_cube)
+        sketches (StudentSketches) : mergeable sketches of each cube
+            cell's students, to estimate unique students (see aft_sketch)
+        trajectories (StudentTrajectories) : program transitions,
+            retention and persistence of the students (see aft_trajectory)
+        student_years (YearSpans) : years each student has rows in, per
+            program, code and grade (see aft_years)
+        codes (dict) : program codes and their labels, e.g. {"A": "Arts (A)"}
+        years (list[int]) : all years in the data
+        program_list (list[str]) : all unique programs, ordered by code
+    '''
+
+    def __init__(self, path: str, values: dict = None):
+        self.path = path
+        self._values = dict(values or {})
+        self._lock = threading.RLock()
+
+    def _get(self, name: str, build):
+        '''returns the named value, building it on first use'''
+        if name not in self._values:
+            with self._lock:
+                if name not in self._values:
+                    self._values[name] = build()
+        return self._values[name]
+
+    def load(self) -> "EnrollmentDataset":
+        '''
+        Method-- load
+            Reads what the first chart needs now: the data with the pandas
+            engine, only the years, codes and programs with duckdb.
+        '''
+        if QUERY_ENGINE == "pandas":
+            self.data
+        self.program_list
+        return self
+
+    def warm(self) -> "EnrollmentDataset":
+        '''
+        Method-- warm
+            Loads the data and builds every derived structure now instead
+            of on first use, e.g. in a server's master process before it
+            forks its workers (see wsgi.py), or in a worker before it
+            forks a background job (see aft_dashboard.JobManager), so the
+            forked processes share them. With the duckdb engine there is
+            nothing to build besides the years, codes and programs.
+            Only the first call builds anything.
+        '''
+        if QUERY_ENGINE != "pandas":
+            return self.load()
+        for name in ["data", "student_years", "codes", "years",
+                     "program_list", "content_hash"]:
+            getattr(self, name)
+        for column in DEMOGRAPHICS:
+            self.cube.year_prefix_sums([column])
+        for columns in WARM_CUBES:
+            self.cube.year_prefix_sums(columns)
+        self.trajectories.warm()
+        return self
+
+    @property
+    def version(self) -> str:
+        return self._get("version", lambda: csv_version(self.path))
+
+    @property
+    def content_hash(self) -> str:
+        return self._get("content_hash", self._content_hash)
+
+    def _content_hash(self) -> str:
+        size, mtime_ns = map(int, self.version.split("-"))
+        return stored_content_hash(self.path, size, mtime_ns) or \
+            content_hash(self.path, size=size)
+
+    @property
+    def size(self) -> int:
+        '''bytes of the CSV the data was read from'''
+        return int(self.version.split("-")[0])
+
+    def _load_data(self) -> pd.DataFrame:
+        # rows appended while the file is read would be in the data but
+        # not in its version (and be appended again by appended()), so
+        # the file is read again until it stays the same throughout
+        for _ in range(LOAD_ATTEMPTS):
+            version = csv_version(self.path)
+            data = load_enrollment_data(self.path)
+            size = int(version.split("-")[0])
+            with open(self.path, "rb") as file:
+                file.seek(max(size - TAIL_BYTES, 0))
+                tail = file.read(size - max(size - TAIL_BYTES, 0))
+            if csv_version(self.path) == version:
+                break
+        self._values["version"] = version
+        self._values["tail"] = tail
+        return read_only(data)
+
+    def appended(self) -> "EnrollmentDataset":
+        '''
+        Method-- appended
+            Next snapshot, if rows were only appended to the CSV since this
+            one was loaded: only the new rows are read, and the structures
+            already built here (index, cube, student sketches, student
+            year spans, codes, years and programs) are updated with them
+            instead of rebuilt. Student trajectories, if built here, are
+            rebuilt now (see StudentTrajectories.warm), so the snapshot
+            is complete before it is swapped in.
+
+        Returns:
+            EnrollmentDataset : the new snapshot (or this one, if no
+                complete row was appended yet), or None if the CSV was
+                rewritten rather than appended to, so it must be reloaded
+                (always None with the duckdb engine, which has nothing
+                loaded to update)
+        '''
+        if QUERY_ENGINE != "pandas":
+            return None
+        data = self.data
+        tail = self._values["tail"]
+        stat = os.stat(self.path)
+        if stat.st_size < self.size or (tail and not tail.endswith(b"\n")):
+            return None
+        with open(self.path, "rb") as file:
+            file.seek(self.size - len(tail))
+            if file.read(len(tail)) != tail:
+                return None
+            content = file.read(stat.st_size - self.size)
+
+        # a row still being written is left for the next snapshot
+        end = content.rfind(b"\n") + 1
+        if end == 0:
+            return self
+        content = content[:end]
+        built = self._values
+        lines = built["lines"] if "lines" in built \
+            else count_lines(self.path, self.size)
+        rows = read_enrollment_rows(
+            content, [c for c in data.columns if c != "Full name"],
+            self.path, first_line=lines + 1)
+
+        values = {
+            "version": f"{self.size + end}-{stat.st_mtime_ns}",
+            "tail": (tail + content)[-TAIL_BYTES:],
+            "lines": lines + content.count(b"\n")}
+        if len(rows) == 0:
+            # every new row was invalid (and quarantined)
+            kept = {name: value for name, value in built.items()
+                    if name != "content_hash"}
+            return EnrollmentDataset(self.path, {**kept, **values})
+
+        combined = read_only(concat_enrollment(data, rows))
+        values["data"] = combined
+        if "index" in built:
+            values["index"] = built["index"].appended(rows)
+        if "cube" in built:
+            values["cube"] = built["cube"].appended(combined, rows)
+        if "sketches" in built:
+            values["sketches"] = built["sketches"].appended(combined, rows)
+        if "student_years" in built:
+            values["student_years"] = built["student_years"].appended(rows)
+        if "codes" in built:
+            values["codes"] = _label_codes(
+                set(built["codes"]) | set(rows["Code"].unique()))
+        if "years" in built:
+            values["years"] = sorted(set(built["years"]) | {
+                int(year) for year in rows["Acad Yr (start)"].unique()})
+        if "programs" in built:
+            values["programs"] = pd.concat(
+                [built["programs"], rows[["Code", "Program (name)"]]],
+                ignore_index=True).drop_duplicates(ignore_index=True)
+        snapshot = EnrollmentDataset(self.path, values)
+        if "trajectories" in built:
+            # a new season changes which students left, so the sequences
+            # are sorted again here (on the watcher's thread), not by the
+            # first Student Pathways request
+            snapshot.trajectories.warm()
+        return snapshot
+
+    def cache_key(self) -> tuple:
+        '''identifies the snapshot in cache keys (see aft_cache.normalize)'''
+        return ("EnrollmentDataset", self.path, self.version)
+
+    @property
+    def query(self):
+        return self._get("query", self._open_query)
+
+    def _open_query(self):
+        if QUERY_ENGINE == "duckdb":
+            return DuckDBBackend(self.path, FULL_NAME_COLUMNS)
+        if QUERY_ENGINE != "pandas":
+            raise ValueError(f"unknown query engine {QUERY_ENGINE!r} "
+                             f"(expected one of {ENGINES})")
+        return PandasBackend(self)
+
+    def _distinct(self, columns: list[str]) -> pd.DataFrame:
+        '''distinct rows of the given columns (in order of first
+        appearance with the pandas engine)'''
+        if QUERY_ENGINE == "pandas":
+            return self.data[columns].drop_duplicates(ignore_index=True)
+        return self.query.filter(columns, distinct=True)
+
+    @property
+    def data(self) -> pd.DataFrame:
+        return self._get("data", self._load_data)
+
+    @property
+    def stats(self) -> ColumnStats:
+        return self._get("stats", lambda: ColumnStats(self.data))
+
+    @property
+    def index(self):
+        return self._get(
+            "index", lambda: load_enrollment_index(self.path, self.data))
+
+    @property
+    def cube(self) -> CountCube:
+        return self._get("cube", lambda: CountCube(self.data))
+
+    @property
+    def sketches(self) -> StudentSketches:
+        return self._get("sketches", lambda: StudentSketches(self.data))
+
+    @property
+    def trajectories(self) -> StudentTrajectories:
+        # with duckdb, only the columns the tab needs are loaded
+        return self._get("trajectories", lambda: StudentTrajectories(
+            self.data if QUERY_ENGINE == "pandas" else self.query.filter(
+                list(dict.fromkeys(TRAJECTORY_COLUMNS + ["Code"]
+                                   + list(DEMOGRAPHICS))))))
+
+    @property
+    def student_years(self):
+        return self._get("student_years", lambda: build_year_spans(
+            self.data, STUDENT_YEAR_COLUMNS))
+
+    @property
+    def codes(self) -> dict:
+        return self._get(
+            "codes", lambda: _label_codes(self._distinct(["Code"])["Code"]))
+
+    @property
+    def years(self) -> list[int]:
+        return self._get("years", lambda: [
+            int(year) for year in
+            sorted(self._distinct(["Acad Yr (start)"])["Acad Yr (start)"])
+            ])
+
+    @property
+    def program_list(self) -> list[str]:
+        # distinct (code, program) pairs, in order of first appearance
+        programs = self._get(
+            "programs",
+            lambda: self._distinct(["Code", "Program (name)"]))
+        return self._get("program_list", lambda: list(
+            programs.sort_values("Code", kind="stable")["Program (name)"]
+            ))
+
+
+def _label_codes(codes) -> dict:
+    '''the program codes present (sorted) mapped to their CODE_LABELS'''
+    return {code: CODE_LABELS.get(code, code) for code in sorted(set(codes))}
+
+
+class DatasetHandle:
+    '''
+    Class-- DatasetHandle
+        Reference to the current EnrollmentDataset snapshot, swapped
+        atomically when the data changes.
+
+        Callbacks take the current snapshot once, at entry, and use only
+        it, so a swap in the middle of a callback can't mix two versions
+        of the data. Reading the reference is a single attribute lookup,
+        so callbacks never wait on a lock.
+
+    Attributes:
+        path (str) : enrollment data CSV
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self._snapshot = EnrollmentDataset(path)
+        self._lock = threading.Lock()
+
+    def current(self) -> EnrollmentDataset:
+        '''the current snapshot'''
+        return self._snapshot
+
+    def swap(self, snapshot: EnrollmentDataset) -> EnrollmentDataset:
+        '''
+        Method-- swap
+            Makes snapshot the current one; callbacks already running keep
+            the snapshot they started with.
+
+        Returns:
+            EnrollmentDataset : the previous snapshot
+        '''
+        with self._lock:
+            previous, self._snapshot = self._snapshot, snapshot
+        return previous
+
+    def refresh(self) -> bool:
+        '''
+        Method-- refresh
+            Swaps in a new, already loaded snapshot if the CSV has changed
+            since the current one was taken. Rows appended to the CSV are
+            added to the current snapshot's data and structures (see
+            EnrollmentDataset.appended); any other change reloads it.
+
+        Returns:
+            bool : whether a new snapshot was swapped in
+        '''
+        with self._lock:
+            current = self._snapshot
+            if csv_version(self.path) == current.version:
+                return False
+            # built before the swap, so no callback sees it half built
+            snapshot = current.appended()
+            if snapshot is current:
+                return False
+            appended = snapshot is not None
+            if not appended:
+                snapshot = EnrollmentDataset(self.path).load()
+            self._snapshot = snapshot
+
+        # a reload already rewrote them (see load_columnar)
+        if appended:
+            self._save(snapshot)
+        return True
+
+    def _save(self, snapshot: EnrollmentDataset) -> None:
+        '''
+        Method-- _save
+            Rewrites the columnar cache after an append, so the next start
+            doesn't parse the whole CSV again. Skipped if the CSV has
+            changed again since snapshot was taken.
+        '''
+        try:
+            if csv_version(self.path) != snapshot.version:
+                return
+            if pa is not None:
+                # the snapshot's hash, shared with the result store
+                write_columnar_cache(snapshot.data, self.path,
+                                     snapshot.content_hash)
+        except OSError:
+            # read-only data folder: keep it in memory only
+            pass
+
+    def watch(self, interval: float = WATCH_INTERVAL) -> None:
+        '''
+        Method-- watch
+            Checks the CSV for changes every `interval` seconds from a
+            background thread, refreshing the snapshot when it changed.
+            Starts at most one thread per process (each server worker
+            needs its own, as threads aren't copied when it is forked).
+        '''
+        with self._lock:
+            if getattr(self, "_watcher_pid", None) == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception:
+                    # keep serving the current snapshot; retried next time
+                    logging.getLogger(__name__).exception(
+                        "could not refresh the enrollment data")
+
+        threading.Thread(target=poll, name="aft-dataset-watch",
+                         daemon=True).start()
+
 '''--------------------------------- Data ----------------------------------'''
 
-# all data
+# all data, loaded on first use; DATASET.current() is the current snapshot
 enrollment_data = "aft_v3.csv" # file name
-DATA = pd.read_csv(enrollment_data)
+DATASET = DatasetHandle(enrollment_data)
 
-# program codes (i.e., "sports", "arts")
-codes_unique = list(DATA.sort_values("Code")["Code"].unique())
-# 'A', 'C', 'E', 'IP', 'L', 'O', 'S', 'SA', 'SC', 'TM'
-code_labels = ['Arts (A)', 'Community Service (C)', 'Exempt (E)', 
-               'Independent Project (IP)', 'Leave (L)', 'Other (O)',
-               'Sports (S)',  'Semester Away (SA)', 
-               'Strength & Conditioning (SC)', 'Team Manager (TM)']
-CODES = {codes_unique[i]: code_labels[i] for i in range(len(code_labels))}
+# DATA, INDEX, CODES, YEARS and PROGRAM_LIST (of the current snapshot) are
+# still importable from this module, but are only loaded when first
+# imported/accessed
+_LAZY_NAMES = {
+    "DATA": "data",
+    "INDEX": "index",
+    "CODES": "codes",
+    "YEARS": "years",
+    "PROGRAM_LIST": "program_list"}
 
-# all years in the data
-YEARS = list(DATA.sort_values("Acad Yr (start)")["Acad Yr (start)"].unique())
-
-# all unique programs in the data
-PROGRAM_LIST = list(DATA.sort_values("Code")["Program (name)"].unique())
+def __getattr__(name: str):
+    if name in _LAZY_NAMES:
+        return getattr(DATASET.current(), _LAZY_NAMES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # demographics filters
 DEMOGRAPHICS={
@@ -61,4 +720,12 @@ TREEMAP_DEMOGS = {
     "Grade at Time of Activity":"Grade", 
     "Program (Level)":"Program Level",
     "Code":"Program Code"
-}
\ No newline at end of file
+}
+
+'''----------------------------------- Main --------------------------------'''
+
+if __name__ == "__main__":
+
+    # memory footprint of the compact schema vs. a plain read_csv
+    print(memory_report(pd.read_csv(enrollment_data),
+                        DATASET.current().data.drop(columns='Full name')))
@@ -0,0 +1,215 @@
+'''
+AFT Data Visualization Tool
+Filter Planner
+'''
+'''-------------------------- Imports & Constants --------------------------'''
+
+# pre-existing python libraries
+import contextlib
+import threading
+import numpy as np
+import pandas as pd
+
+# our custom-made libraries
+from .aft_metrics import METRICS, Span
+
+'''---------------------------- Column Statistics --------------------------'''
+
+class ColumnStats:
+    '''
+    Class-- ColumnStats
+        Share of the rows holding each value of a column, counted once per
+        column on first use (from the category codes of categoricals), to
+        estimate how many rows a filter keeps before running it.
+
+    Attributes:
+        frequencies (dict) : {column: pd.Series of row shares by value}
+    '''
+
+    def __init__(self, df: pd.DataFrame):
+        self._df = df
+        self._lock = threading.Lock()
+        self.frequencies = {}
+
+    def frequency(self, column: str) -> pd.Series:
+        '''
+        Method-- frequency
+            share of the rows holding each value of column (NaN included)
+        '''
+        if column not in self.frequencies:
+            with self._lock:
+                if column not in self.frequencies:
+                    self.frequencies[column] = self._count(column)
+        return self.frequencies[column]
+
+    def _count(self, column: str) -> pd.Series:
+        values = self._df[column]
+        n_rows = max(len(values), 1)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # code -1 (missing) is counted in the first bin
+            counts = np.bincount(values.cat.codes.to_numpy() + 1,
+                                 minlength=len(values.cat.categories) + 1)
+            index = [np.nan] + list(values.cat.categories)
+            return pd.Series(counts / n_rows, index=index)
+        return values.value_counts(dropna=False, sort=False) / n_rows
+
+    def selectivity(self, predicate: "Predicate") -> float:
+        '''estimated share of the rows predicate keeps (0 to 1)'''
+        frequency = self.frequency(predicate.column)
+        return float(frequency[predicate.matches(frequency.index)].sum())
+
+'''------------------------------- Predicates ------------------------------'''
+
+class Predicate:
+    '''
+    Class-- Predicate
+        One condition on a column: its value is one of `values`, or (if
+        low/high are given instead) between low and high, inclusive.
+
+    Attributes:
+        column (str) : column name
+        values (list) : allowed values (None for a range)
+        low, high : range bounds (None for a list of values)
+    '''
+
+    def __init__(self, column: str, values=None, low=None, high=None):
+        self.column = column
+        self.values = None if values is None else list(values)
+        self.low = low
+        self.high = high
+
+    def matches(self, values) -> np.ndarray:
+        '''whether each of values passes (values: array-like or Index)'''
+        if self.values is not None:
+            return pd.Index(values).isin(self.values)
+        values = pd.Index(values)
+        if not pd.api.types.is_numeric_dtype(values):
+            values = pd.to_numeric(values, errors="coerce")
+        return np.asarray((values >= self.low) & (values <= self.high),
+                          dtype=bool)
+
+    def mask(self, column: pd.Series,
+             rows: np.ndarray = None) -> np.ndarray:
+        '''
+        Method-- mask
+            Whether each row of column (or only each of the given row
+            positions) passes. Categoricals are tested once per category,
+            then looked up by code.
+        '''
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # code -1 (missing) picks the trailing entry
+            passes = np.append(self.matches(column.cat.categories),
+                               self.matches([np.nan])[0])
+            codes = column.cat.codes.to_numpy()
+            return passes[codes if rows is None else codes[rows]]
+        values = column.to_numpy()
+        if rows is not None:
+            values = values[rows]
+        if self.values is not None:
+            return pd.Series(values).isin(self.values).to_numpy()
+        return (values >= self.low) & (values <= self.high)
+
+    def __repr__(self) -> str:
+        if self.values is not None:
+            return f"{self.column} in {self.values}"
+        return f"{self.low} <= {self.column} <= {self.high}"
+
+'''------------------------------ Filter Spec ------------------------------'''
+
+class FilterSpec:
+    '''
+    Class-- FilterSpec
+        Every filter of a selection, run as one plan instead of a chain of
+        filtered copies: the predicates are ordered by how many rows they
+        are estimated to keep (from ColumnStats, most selective first),
+        the first is tested on every row, each next one only on the rows
+        still selected, and the selected rows are gathered once at the
+        end.
+
+            spec = FilterSpec({"Code": ["S"]}, years=[2010, 2015])
+            rows = spec.apply(df, stats, name="filter_top_progs")
+
+    Attributes:
+        predicates (list[Predicate]) : conditions, in the order given
+    '''
+
+    def __init__(self, filters: dict = None, years: list[int] = None,
+                 year_column: str = "Acad Yr (start)"):
+        self.predicates = []
+        if years is not None:
+            self.between(year_column, min(years), max(years))
+        for column, values in (filters or {}).items():
+            self.isin(column, values)
+
+    def isin(self, column: str, values) -> "FilterSpec":
+        '''adds "column is one of values"'''
+        self.predicates.append(Predicate(column, values=values))
+        return self
+
+    def between(self, column: str, low, high) -> "FilterSpec":
+        '''adds "column is from low to high (inclusive)"'''
+        self.predicates.append(Predicate(column, low=low, high=high))
+        return self
+
+    def plan(self, stats: ColumnStats = None) -> list[Predicate]:
+        '''
+        Method-- plan
+            the predicates, most selective first (in the given order
+            without stats)
+        '''
+        if stats is None:
+            return list(self.predicates)
+        return sorted(self.predicates, key=stats.selectivity)
+
+    def select(self, df: pd.DataFrame, stats: ColumnStats = None,
+               name: str = None) -> tuple[np.ndarray, list]:
+        '''
+        Method-- select
+            Positions of the rows passing every predicate.
+
+        Parameters:
+            df (pd.DataFrame) : rows to filter
+            stats (ColumnStats) : df's column statistics, for the plan
+            name (str) : if given, each predicate is timed as a METRICS
+                span "<name>.<column>", whose rows are the rows still
+                selected after it
+
+        Returns:
+            np.array : selected row positions, in order
+            list[tuple] : (predicate, rows still selected after it), in
+                plan order
+        '''
+        rows = None
+        counts = []
+        for predicate in self.plan(stats):
+            timer = METRICS.span(f"{name}.{predicate.column}") \
+                if name else contextlib.nullcontext(Span(""))
+            with timer as span:
+                passes = predicate.mask(df[predicate.column], rows)
+                rows = np.flatnonzero(passes) if rows is None \
+                    else rows[passes]
+                span.rows = len(rows)
+            counts.append((predicate, len(rows)))
+            if len(rows) == 0:
+                break
+        if rows is None:
+            rows = np.arange(len(df))
+        return rows, counts
+
+    def apply(self, df: pd.DataFrame, stats: ColumnStats = None,
+              columns: list[str] = None, name: str = "filter"
+              ) -> pd.DataFrame:
+        '''
+        Method-- apply
+            The rows of df passing every predicate (only the given
+            columns, if any), gathered once. Timed as a METRICS span
+            `name`, with a span per predicate (see select).
+
+        Returns:
+            pd.DataFrame : selected rows, with a new 0..n-1 index
+        '''
+        with METRICS.span(name, rows=len(df)):
+            rows, _ = self.select(df, stats, name)
+            if columns is not None:
+                df = df[list(columns)]
+            return df.take(rows).reset_index(drop=True)
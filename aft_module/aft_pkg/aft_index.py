@@ -0,0 +1,351 @@
+'''
+AFT Data Visualization Tool
+Enrollment Index
+'''
+'''-------------------------- Imports & Constants --------------------------'''
+
+# pre-existing python libraries
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+# our custom-made libraries
+from .aft_years import append_rows
+
+# columns the index can answer queries on
+KEY_COLUMNS = [
+    "Program (name)",
+    "Program (Gender)",
+    "Program (Level)",
+    "Full name",
+    "Code",
+    "Acad Yr (start)",
+    "Grade at Time of Activity"]
+
+# bumped whenever the saved file layout or KEY_COLUMNS change
+INDEX_VERSION = 2
+
+# number of set bits in every possible byte, for popcounts of packed bitsets
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+'''--------------------------------- Index ---------------------------------'''
+
+class EnrollmentIndex:
+    '''
+    Class-- EnrollmentIndex
+        Student x enrollment-key membership index.
+
+        Person IDs are integer-coded (0 ... n_students - 1) and every
+        distinct combination of KEY_COLUMNS (program, code, year, grade)
+        becomes one column of a sparse boolean matrix. Any selection of
+        keys (e.g. "program A during 2010-2015 in high school") is then
+        a set of matrix columns, and the students in it are returned as a
+        packed bitset (np.packbits) so set algebra is just &, | and ~.
+
+    Attributes:
+        person_ids (np.array) : unique Person IDs, sorted when built (any
+            appended later come last); position = code
+        keys (pd.DataFrame) : one row per distinct key combination,
+            with a 'rows' column counting the enrollment rows behind it
+        matrix (sparse.csc_matrix) : n_students x len(keys) 0/1 matrix
+    '''
+
+    def __init__(self, person_ids, keys, matrix):
+        self.person_ids = person_ids
+        self.keys = keys
+        self.matrix = matrix
+
+    @property
+    def n_students(self) -> int:
+        return len(self.person_ids)
+
+    def _columns(self, filters: dict = None) -> np.ndarray:
+        '''
+        Method-- _columns
+            positions of the key columns matching every filter
+            (filters = {column name: list of allowed values})
+        '''
+        mask = np.ones(len(self.keys), dtype=bool)
+        for column, values in (filters or {}).items():
+            mask &= self.keys[column].isin(list(values)).to_numpy()
+        return np.flatnonzero(mask)
+
+    def students(self, filters: dict = None) -> np.ndarray:
+        '''
+        Method-- students
+            Students with at least one enrollment row matching the filters.
+
+        Parameters:
+            filters (dict) : {column name: list of allowed values},
+                e.g. {"Program (name)": ["Crew"],
+                      "Acad Yr (start)": range(2010, 2016)}
+
+        Returns:
+            np.array (uint8) : packed bitset over the student codes
+        '''
+        rows = self.matrix[:, self._columns(filters)].indices
+        bits = np.zeros(self.n_students, dtype=bool)
+        bits[rows] = True
+        return np.packbits(bits)
+
+    def query(self,
+              all_of: list = (),
+              none_of: list = (),
+              column: str = "Program (name)",
+              filters: dict = None
+              ) -> np.ndarray:
+        '''
+        Method-- query
+            Set algebra over programs, e.g. "enrolled in A and B but not C
+            during 2010-2015":
+
+                index.query(all_of=["A", "B"], none_of=["C"],
+                            filters={"Acad Yr (start)": range(2010, 2016)})
+
+        Parameters:
+            all_of (list) : values of column the student must have
+            none_of (list) : values of column the student must not have
+            column (str) : column all_of/none_of refer to
+            filters (dict) : extra filters applied to every lookup
+
+        Returns:
+            np.array (uint8) : packed bitset, see count() and decode()
+        '''
+        filters = dict(filters or {})
+        result = self.students(filters)
+        for value in all_of:
+            result &= self.students({**filters, column: [value]})
+        for value in none_of:
+            result &= ~self.students({**filters, column: [value]})
+        return result
+
+    @staticmethod
+    def count(bitset: np.ndarray) -> int:
+        '''
+        Method-- count
+            number of students in a packed bitset (vectorized popcount)
+        '''
+        return int(_POPCOUNT[bitset].sum())
+
+    def decode(self, bitset: np.ndarray) -> np.ndarray:
+        '''
+        Method-- decode
+            Person IDs of the students in a packed bitset
+        '''
+        bits = np.unpackbits(bitset, count=self.n_students).astype(bool)
+        return self.person_ids[bits]
+
+    def membership(self,
+                   column: str,
+                   values: list,
+                   filters: dict = None
+                   ) -> tuple[list, sparse.csr_matrix]:
+        '''
+        Method-- membership
+            Student x value membership matrix for the Cramer's V engine
+            (see aft_stats.cramers_v_matrix).
+
+        Parameters:
+            column (str) : column to split membership by (e.g. programs)
+            values (list) : values of column to include, in output order
+            filters (dict) : extra filters (years, grades, codes)
+
+        Returns:
+            values (list) : the values, in the order of the matrix columns
+            membership (sparse.csr_matrix) : n x len(values) 0/1 matrix,
+                only keeping the n students enrolled in at least one value
+        '''
+        values = list(values)
+        columns = self._columns({**(filters or {}), column: values})
+
+        # map each selected key column onto the value it belongs to
+        positions = pd.Index(values).get_indexer(
+            self.keys[column].to_numpy()[columns])
+        collapse = sparse.csr_matrix(
+            (np.ones(len(columns), dtype=np.int64),
+             (np.arange(len(columns)), positions)),
+            shape=(len(columns), len(values)))
+
+        membership = (self.matrix[:, columns].astype(np.int64) @ collapse)\
+            .tocsr()
+        membership.data[:] = 1
+        membership = membership[np.diff(membership.indptr) > 0]
+        return values, membership
+
+    def appended(self, tail: pd.DataFrame) -> "EnrollmentIndex":
+        '''
+        Method-- appended
+            New EnrollmentIndex that also covers tail (newly appended
+            enrollment rows). Existing students and keys keep their codes;
+            new ones are added at the end, so only tail is scanned.
+
+        Parameters:
+            tail (pd.DataFrame) : the new enrollment rows
+
+        Returns:
+            EnrollmentIndex
+        '''
+        if len(tail) == 0:
+            return self
+        key_columns = list(self.keys.columns.drop("rows"))
+
+        # student codes, new students after the existing ones
+        known = pd.Index(self.person_ids)
+        student_codes = known.get_indexer(tail["Person ID"])
+        new_ids = pd.unique(tail["Person ID"].to_numpy()[student_codes < 0])
+        person_ids = np.concatenate([self.person_ids, new_ids])
+        student_codes[student_codes < 0] = len(self.person_ids) \
+            + pd.Index(new_ids).get_indexer(
+                tail["Person ID"].to_numpy()[student_codes < 0])
+
+        # key codes, new keys after the existing ones
+        grouped = tail.groupby(key_columns, dropna=False, sort=False,
+                               observed=True)
+        new_keys = grouped.size().rename("rows").reset_index()
+        position = new_keys[key_columns].merge(
+            self.keys[key_columns].assign(_position=np.arange(len(self.keys))),
+            on=key_columns, how="left")["_position"]
+        unseen = position.isna().to_numpy()
+        position = position.to_numpy(dtype=np.float64)
+        position[unseen] = len(self.keys) + np.arange(unseen.sum())
+        position = position.astype(np.int64)
+
+        rows = np.zeros(len(self.keys) + unseen.sum(), dtype=np.int64)
+        rows[:len(self.keys)] = self.keys["rows"].to_numpy()
+        np.add.at(rows, position, new_keys["rows"].to_numpy())
+        keys = append_rows(self.keys[key_columns],
+                           new_keys.loc[unseen, key_columns])
+        keys["rows"] = rows
+
+        # existing matrix widened to the new shape, plus the tail's pairs
+        shape = (len(person_ids), len(keys))
+        matrix = sparse.csc_matrix(
+            (self.matrix.data, self.matrix.indices,
+             np.concatenate([self.matrix.indptr, np.repeat(
+                 self.matrix.indptr[-1], shape[1] - self.matrix.shape[1])])),
+            shape=shape)
+        matrix = matrix + sparse.csc_matrix(
+            (np.ones(len(tail), dtype=np.int8),
+             (student_codes, position[grouped.ngroup().to_numpy()])),
+            shape=shape)
+        matrix.data[:] = 1
+
+        return EnrollmentIndex(person_ids, keys, matrix)
+
+'''----------------------------- Build & Store -----------------------------'''
+
+def build_enrollment_index(
+    df: pd.DataFrame,
+    key_columns: list[str] = KEY_COLUMNS
+    ) -> EnrollmentIndex:
+    '''
+    Function-- build_enrollment_index
+        Builds an EnrollmentIndex from enrollment rows in a single pass.
+
+    Parameters:
+        df (pd.DataFrame) : enrollment data (i.e. DATA)
+        key_columns (list[str]) : columns to index on
+
+    Returns:
+        EnrollmentIndex
+    '''
+    student_codes, person_ids = pd.factorize(df["Person ID"], sort=True)
+
+    # one code per distinct key combination (NaN kept as its own value)
+    grouped = df.groupby(list(key_columns), dropna=False, sort=True,
+                         observed=True)
+    key_codes = grouped.ngroup().to_numpy()
+    keys = grouped.size().rename("rows").reset_index()
+
+    n_keys = len(keys)
+    pairs = np.unique(student_codes.astype(np.int64) * n_keys + key_codes)
+    rows, cols = np.divmod(pairs, n_keys)
+    matrix = sparse.csc_matrix(
+        (np.ones(len(pairs), dtype=np.int8), (rows, cols)),
+        shape=(len(person_ids), n_keys))
+
+    return EnrollmentIndex(np.asarray(person_ids), keys, matrix)
+
+
+def index_path(csv_path: str) -> str:
+    '''
+    Function-- index_path
+        location of the saved index, next to the CSV it was built from
+    '''
+    return csv_path + ".index.npz"
+
+
+def _csv_signature(csv_path: str) -> np.ndarray:
+    '''size and modification time of the CSV, used to detect changes'''
+    stat = os.stat(csv_path)
+    return np.array([INDEX_VERSION, stat.st_size, stat.st_mtime_ns],
+                    dtype=np.int64)
+
+
+def save_enrollment_index(index: EnrollmentIndex, csv_path: str) -> None:
+    '''
+    Function-- save_enrollment_index
+        Saves the index next to csv_path. Key columns are stored as
+        categorical codes + categories, the categories as numbers or
+        fixed-width strings, so the file loads without pickling.
+    '''
+    arrays = {
+        "signature": _csv_signature(csv_path),
+        "person_ids": index.person_ids,
+        "indptr": index.matrix.indptr,
+        "indices": index.matrix.indices,
+        "rows": index.keys["rows"].to_numpy(),
+        "key_columns": np.array(index.keys.columns.drop("rows"), dtype=str)}
+    for i, column in enumerate(arrays["key_columns"]):
+        codes, categories = pd.factorize(index.keys[column])
+        arrays[f"codes_{i}"] = codes
+        categories = np.asarray(categories)
+        if categories.dtype == object:
+            # object arrays are pickled (and refused by np.load)
+            categories = categories.astype(str)
+        arrays[f"categories_{i}"] = categories
+
+    np.savez(index_path(csv_path), **arrays)
+
+
+def load_enrollment_index(csv_path: str, df: pd.DataFrame) -> EnrollmentIndex:
+    '''
+    Function-- load_enrollment_index
+        Loads the saved index for csv_path, rebuilding (and re-saving) it
+        from df if it is missing or the CSV has changed since it was saved.
+
+    Parameters:
+        csv_path (str) : path of the enrollment CSV
+        df (pd.DataFrame) : data read from csv_path
+
+    Returns:
+        EnrollmentIndex
+    '''
+    try:
+        with np.load(index_path(csv_path)) as saved:
+            if not np.array_equal(saved["signature"],
+                                  _csv_signature(csv_path)):
+                raise ValueError("enrollment index is out of date")
+
+            keys = pd.DataFrame({
+                column: pd.Categorical.from_codes(
+                    saved[f"codes_{i}"], saved[f"categories_{i}"]
+                    ).to_numpy()
+                for i, column in enumerate(saved["key_columns"])})
+            keys["rows"] = saved["rows"]
+            matrix = sparse.csc_matrix(
+                (np.ones(len(saved["indices"]), dtype=np.int8),
+                 saved["indices"], saved["indptr"]),
+                shape=(len(saved["person_ids"]), len(keys)))
+            return EnrollmentIndex(saved["person_ids"], keys, matrix)
+    except (OSError, KeyError, ValueError):
+        pass
+
+    index = build_enrollment_index(df)
+    try:
+        save_enrollment_index(index, csv_path)
+    except OSError:
+        # read-only data folder: keep the index in memory only
+        pass
+    return index
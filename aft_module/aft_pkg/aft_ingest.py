@@ -0,0 +1,270 @@
+'''
+AFT Data Visualization Tool
+Streaming Ingestion
+'''
+'''-------------------------- Imports & Constants --------------------------'''
+
+# pre-existing python libraries
+import datetime
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+# rows parsed and validated at a time, which bounds the memory used by
+# the raw text of a large export to one chunk
+CHUNK_ROWS = 200_000
+
+# program codes (i.e., "sports", "arts") and their labels
+CODE_LABELS = {
+    'A': 'Arts (A)',
+    'C': 'Community Service (C)',
+    'E': 'Exempt (E)',
+    'IP': 'Independent Project (IP)',
+    'L': 'Leave (L)',
+    'O': 'Other (O)',
+    'S': 'Sports (S)',
+    'SA': 'Semester Away (SA)',
+    'SC': 'Strength & Conditioning (SC)',
+    'TM': 'Team Manager (TM)'}
+
+# valid values
+CODES = list(CODE_LABELS)
+GRADES = range(7, 13)
+FA_VALUES = [0, 1, 2]
+FIRST_YEAR = 1990
+YEARS_TO_GRADUATION = range(1, 7)   # Grad year - Acad Yr (start)
+
+# columns every row needs
+REQUIRED_COLUMNS = [
+    "Person ID",
+    "FA",
+    "Acad Yr (start)",
+    "Code",
+    "Program (name)",
+    "Grade at Time of Activity",
+    "Grad year"]
+
+'''--------------------------- Validation Functions ------------------------'''
+
+def quarantine_path(csv_path: str) -> str:
+    '''
+    Function-- quarantine_path
+        location of the rows rejected from csv_path, next to it
+    '''
+    return csv_path + ".quarantine.csv"
+
+
+def _whole(values: pd.Series, low: int, high: int) -> np.ndarray:
+    '''whether each value is a whole number from low to high'''
+    values = values.to_numpy(np.float64)
+    return (values >= low) & (values <= high) & (values % 1 == 0)
+
+
+def _known(values: pd.Series, allowed: list) -> np.ndarray:
+    '''whether each value is one of allowed (checked once per category
+    for categoricals)'''
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # code -1 (missing) picks the trailing False
+        known = np.append(values.cat.categories.isin(allowed), False)
+        return known[values.cat.codes.to_numpy()]
+    return values.isin(allowed).to_numpy()
+
+
+def validate_enrollment(df: pd.DataFrame) -> pd.Series:
+    '''
+    Function-- validate_enrollment
+        Checks every row of an enrollment chunk at once (vectorized, one
+        boolean mask per rule).
+
+    Parameters:
+        df (pd.DataFrame) : enrollment rows, with numeric columns already
+            parsed as floats (NaN where missing or not a number)
+
+    Returns:
+        pd.Series : why each invalid row is invalid (the rules it breaks,
+            separated by "; "), indexed like df; empty if all are valid
+    '''
+    year = df["Acad Yr (start)"]
+    last_year = datetime.date.today().year + 1
+
+    checks = {
+        "Person ID is missing or not a positive whole number":
+            ~_whole(df["Person ID"], 1, 2 ** 31 - 1),
+        "Grade at Time of Activity is not 7-12":
+            ~_whole(df["Grade at Time of Activity"], min(GRADES), max(GRADES)),
+        "FA is not 0, 1 or 2":
+            ~_whole(df["FA"], min(FA_VALUES), max(FA_VALUES)),
+        "Code is not a known program code":
+            ~_known(df["Code"], CODES),
+        "Program (name) is missing":
+            df["Program (name)"].isna().to_numpy(),
+        f"Acad Yr (start) is not {FIRST_YEAR}-{last_year}":
+            ~_whole(year, FIRST_YEAR, last_year),
+        "Grad year is not 1-6 years after Acad Yr (start)":
+            ~_whole(df["Grad year"] - year, min(YEARS_TO_GRADUATION),
+                    max(YEARS_TO_GRADUATION))}
+
+    # reasons are only joined for the (few) invalid rows
+    invalid = np.logical_or.reduce(list(checks.values()))
+    broken = pd.DataFrame({reason: rows[invalid]
+                           for reason, rows in checks.items()},
+                          index=df.index[invalid])
+    reasons = pd.Series("", index=broken.index, dtype=object)
+    for reason in broken.columns:
+        reasons[broken[reason].to_numpy()] += "; " + reason
+    # every reason starts with the separator
+    return reasons.str[2:]
+
+'''--------------------------- Ingestion Functions -------------------------'''
+
+def _concat_columns(pieces: dict) -> pd.DataFrame:
+    '''
+    Function-- _concat_columns
+        joins each column's chunks into one array, freeing the chunks of
+        a column as soon as it is joined (so the data is held about once,
+        not twice, at the end)
+    '''
+    columns = {}
+    for name in list(pieces):
+        parts = pieces.pop(name)
+        if isinstance(parts[0], pd.Categorical):
+            # sorted, like pd.read_csv's categories
+            columns[name] = pd.api.types.union_categoricals(
+                parts, sort_categories=True)
+        else:
+            columns[name] = np.concatenate(parts)
+        del parts
+    return pd.DataFrame(columns)
+
+
+def read_validated_csv(
+    source,
+    dtypes: dict,
+    quarantine: str = None,
+    append: bool = False,
+    names: list[str] = None,
+    first_line: int = 2,
+    chunk_rows: int = CHUNK_ROWS
+    ) -> pd.DataFrame:
+    '''
+    Function-- read_validated_csv
+        Streams an enrollment CSV in chunks of chunk_rows rows with fixed
+        dtypes, validates each chunk (see validate_enrollment) and keeps
+        only the valid rows. Invalid rows are written to the quarantine
+        CSV with their line number and the reasons they were rejected.
+
+    Parameters:
+        source (str or file) : CSV path or file-like object
+        dtypes (dict) : {column: dtype} of the valid rows (e.g. SCHEMA)
+        quarantine (str) : CSV path for the invalid rows (None: not saved)
+        append (bool) : add to the quarantine CSV instead of replacing it
+        names (list[str]) : column names if source has no header row
+        first_line (int) : line number of the first row in source
+        chunk_rows (int) : rows per chunk
+
+    Returns:
+        pd.DataFrame : the valid rows, in file order
+    '''
+    if quarantine is not None and not append and os.path.exists(quarantine):
+        os.remove(quarantine)
+    start = source.tell() if hasattr(source, "tell") else None
+    kept = os.path.getsize(quarantine) \
+        if quarantine is not None and os.path.exists(quarantine) else 0
+    options = (dtypes, quarantine, names, first_line, chunk_rows)
+    try:
+        # whole numbers are parsed as floats, so a missing value is just
+        # NaN (and rejects its row) instead of failing the whole load
+        return _read_chunks(source, *options, as_text=False)
+    except ValueError:
+        # some number column has text in it: read them as text instead,
+        # which is slower, but rejects only the rows with text
+        if start is not None:
+            source.seek(start)
+        if quarantine is not None and os.path.exists(quarantine):
+            os.truncate(quarantine, kept)
+        return _read_chunks(source, *options, as_text=True)
+
+
+def _read_chunks(
+    source,
+    dtypes: dict,
+    quarantine: str,
+    names: list[str],
+    first_line: int,
+    chunk_rows: int,
+    as_text: bool
+    ) -> pd.DataFrame:
+    '''
+    Function-- _read_chunks
+        read_validated_csv(), with whole number columns parsed as floats
+        or (if as_text) as text
+    '''
+    integer_columns = [c for c, dtype in dtypes.items()
+                       if pd.api.types.is_integer_dtype(dtype)]
+    read_dtypes = {c: (dtype if c not in integer_columns
+                       else str if as_text else np.float64)
+                   for c, dtype in dtypes.items()}
+
+    pieces = {}
+    n_rejected = 0
+    rejected = pd.Series(dtype=np.int64)  # rows per reason
+    reader = pd.read_csv(source, dtype=read_dtypes, chunksize=chunk_rows,
+                         header=None if names else "infer", names=names)
+    with reader:
+        for chunk in reader:
+            missing = set(REQUIRED_COLUMNS) - set(chunk.columns)
+            if missing:
+                raise ValueError(
+                    f"enrollment data has no {sorted(missing)} column(s)")
+
+            parsed = chunk.assign(**{
+                c: pd.to_numeric(chunk[c], errors="coerce")
+                for c in integer_columns if c in chunk}) if as_text else chunk
+            reasons = validate_enrollment(parsed)
+            invalid = chunk.index.isin(reasons.index)
+
+            if invalid.any():
+                bad = chunk[invalid].assign(
+                    Line=chunk.index[invalid] + first_line,
+                    Reason=reasons)
+                n_rejected += len(bad)
+                rejected = rejected.add(
+                    bad["Reason"].str.split("; ").explode().value_counts(),
+                    fill_value=0)
+                if quarantine is not None:
+                    _write_quarantine(bad, quarantine)
+
+            valid = parsed[~invalid] if invalid.any() else parsed
+            for column in valid.columns:
+                values = valid[column]
+                if not isinstance(values.dtype, pd.CategoricalDtype):
+                    values = values.to_numpy(dtypes.get(column))
+                elif invalid.any():
+                    # drop values only the rejected rows had
+                    values = values.array.remove_unused_categories()
+                else:
+                    values = values.array
+                pieces.setdefault(column, []).append(values)
+            del chunk, parsed, valid
+
+    if n_rejected:
+        logging.getLogger(__name__).warning(
+            "%d invalid enrollment rows%s: %s", n_rejected,
+            f" written to {quarantine}" if quarantine else "",
+            rejected.astype(int).to_dict())
+
+    if not pieces:
+        return pd.DataFrame({c: pd.Series(dtype=d) for c, d in dtypes.items()})
+    return _concat_columns(pieces)
+
+
+def _write_quarantine(bad: pd.DataFrame, quarantine: str) -> None:
+    '''appends rejected rows to the quarantine CSV (with a header if new)'''
+    try:
+        header = not os.path.exists(quarantine) \
+            or os.path.getsize(quarantine) == 0
+        bad.to_csv(quarantine, mode="a", header=header, index=False)
+    except OSError:
+        # read-only data folder: the rows are still left out (and logged)
+        pass
@@ -0,0 +1,364 @@
+'''
+AFT Data Visualization Tool
+Callback Metrics
+'''
+'''-------------------------- Imports & Constants --------------------------'''
+
+# pre-existing python libraries
+import contextlib
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from collections import deque
+import numpy as np
+
+# file locks for the shared metrics archive (POSIX only); without them each
+# process keeps its own file instead of folding it into the archive
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# latency percentiles are computed over each span's most recent samples
+WINDOW = 1024
+
+# set AFT_METRICS_LOG to a file path to also log every span there
+# (rotated at 10 MB, keeping 3 old files)
+METRICS_LOG = os.environ.get("AFT_METRICS_LOG")
+LOG_MAX_BYTES = 10 * 1024 ** 2
+LOG_BACKUPS = 3
+
+# set AFT_METRICS_DIR to the folder the processes of a server (workers and
+# background jobs) write their spans to, so /metrics can combine them
+METRICS_DIR = os.environ.get("AFT_METRICS_DIR")
+
+# a process writes its spans to the folder at most this often
+FLUSH_INTERVAL = 1.0
+
+# spans of processes that have exited (e.g. background jobs) are folded
+# into this file of the folder
+ARCHIVE = "archive.json"
+
+'''-------------------------------- Metrics --------------------------------'''
+
+class Span:
+    '''
+    Class-- Span
+        One timed stage. Code inside the span can set how many rows it
+        processed and how many bytes it produced.
+
+    Attributes:
+        name (str) : stage name, e.g. "treemap.counts"
+        rows (int) : rows processed, if known
+        payload_bytes (int) : size of the output sent to the browser
+        seconds (float) : duration, once the span has ended
+    '''
+
+    def __init__(self, name: str):
+        self.name = name
+        self.rows = None
+        self.payload_bytes = None
+        self.seconds = None
+
+
+class SpanStats:
+    '''
+    Class-- SpanStats
+        Running totals of one span name, and its latest WINDOW durations
+        for the latency percentiles.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.rows = 0
+        self.payload_bytes = 0
+        self.recent = deque(maxlen=WINDOW)
+
+    def add(self, span: Span, failed: bool) -> None:
+        self.count += 1
+        self.errors += failed
+        self.total_seconds += span.seconds
+        self.rows += span.rows or 0
+        self.payload_bytes += span.payload_bytes or 0
+        self.recent.append(span.seconds)
+
+    def to_dict(self) -> dict:
+        '''the totals and recent durations, as JSON-able values'''
+        return {"count": self.count, "errors": self.errors,
+                "total_seconds": self.total_seconds, "rows": self.rows,
+                "payload_bytes": self.payload_bytes,
+                "recent": list(self.recent)}
+
+    def merge(self, saved: dict) -> "SpanStats":
+        '''adds another process's to_dict() to these totals'''
+        for name in ["count", "errors", "total_seconds", "rows",
+                     "payload_bytes"]:
+            setattr(self, name, getattr(self, name) + saved[name])
+        self.recent.extend(saved["recent"])
+        return self
+
+    def summary(self) -> dict:
+        p50, p95, p99 = np.percentile(self.recent, [50, 95, 99]) \
+            if self.recent else (0.0, 0.0, 0.0)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": round(1000 * self.total_seconds
+                             / max(self.count, 1), 3),
+            "p50_ms": round(1000 * p50, 3),
+            "p95_ms": round(1000 * p95, 3),
+            "p99_ms": round(1000 * p99, 3),
+            "max_ms": round(1000 * max(self.recent, default=0.0), 3),
+            "rows": self.rows,
+            "payload_bytes": self.payload_bytes}
+
+
+class Metrics:
+    '''
+    Class-- Metrics
+        Thread-safe registry of timed spans (callbacks and the stages
+        inside them): latency percentiles, rows processed and payload
+        bytes per span name.
+
+        The registry is per process. With a shared folder (see share),
+        every process also writes its spans there, and combined() adds up
+        the spans of every process of the server: its workers and its
+        background jobs. A forked process starts with no spans of its own,
+        so the parent's are never counted twice.
+
+    Attributes:
+        stats (dict) : {span name: SpanStats}
+        folder (str) : folder shared with the server's other processes
+            (None if the spans are only kept in this process)
+        logger (logging.Logger) : if log_path is given, every span is
+            written to it as a JSON line
+    '''
+
+    def __init__(self, log_path: str = None, folder: str = None):
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._flushed = 0.0
+        self.folder = None
+        if folder:
+            self.share(folder)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._forked)
+        self.logger = None
+        if log_path:
+            self.logger = logging.getLogger(f"aft.metrics.{id(self)}")
+            self.logger.setLevel(logging.INFO)
+            self.logger.propagate = False
+            self.logger.addHandler(logging.handlers.RotatingFileHandler(
+                log_path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS))
+
+    def record(self, span: Span, failed: bool = False) -> None:
+        '''adds a finished span to its name's stats (and to the log)'''
+        with self._lock:
+            if span.name not in self.stats:
+                self.stats[span.name] = SpanStats()
+            self.stats[span.name].add(span, failed)
+        if self.folder is not None \
+            and time.monotonic() - self._flushed > FLUSH_INTERVAL:
+            self.flush()
+        if self.logger is not None:
+            self.logger.info(json.dumps({
+                "time": round(time.time(), 3),
+                "span": span.name,
+                "ms": round(1000 * span.seconds, 3),
+                "rows": span.rows,
+                "payload_bytes": span.payload_bytes,
+                "failed": failed}))
+
+    @contextlib.contextmanager
+    def span(self, name: str, rows: int = None):
+        '''
+        Method-- span
+            Times the body of a with block:
+
+                with METRICS.span("treemap.figure") as span:
+                    fig = ...
+                    span.rows = len(top_ten)
+        '''
+        span = Span(name)
+        span.rows = rows
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield span
+            failed = False
+        finally:
+            span.seconds = time.perf_counter() - start
+            self.record(span, failed)
+
+    def timed(self, name: str = None):
+        '''
+        Method-- timed
+            Decorator timing every call of a function as one span
+            (named after the function by default)
+        '''
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name or func.__name__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> dict:
+        '''{span name: summary} of every span recorded so far'''
+        with self._lock:
+            return {name: stats.summary()
+                    for name, stats in sorted(self.stats.items())}
+
+    def reset(self) -> None:
+        '''forgets every recorded span'''
+        with self._lock:
+            self.stats.clear()
+
+    def _forked(self) -> None:
+        '''in a forked child: start with no spans (they are the parent's)'''
+        self._lock = threading.Lock()
+        self.stats = {}
+        self._flushed = 0.0
+
+    '''----------------------- Sharing Between Processes -------------------'''
+
+    def share(self, folder: str, clear: bool = False) -> None:
+        '''
+        Method-- share
+            Writes this process's spans to folder (created if needed), at
+            most every FLUSH_INTERVAL seconds and on flush(), for
+            combined().
+
+        Parameters:
+            folder (str) : folder shared by the server's processes
+            clear (bool) : first remove the spans of earlier runs (only
+                when the server starts, before its workers do)
+        '''
+        os.makedirs(folder, exist_ok=True)
+        if clear:
+            for file_name in os.listdir(folder):
+                if file_name.endswith(".json"):
+                    os.remove(os.path.join(folder, file_name))
+        self.folder = folder
+
+    def _path(self) -> str:
+        return os.path.join(self.folder, f"{os.getpid()}.json")
+
+    def flush(self, final: bool = False) -> None:
+        '''
+        Method-- flush
+            Writes this process's spans to the shared folder now.
+
+        Parameters:
+            final (bool) : the process is about to exit (e.g. a background
+                job): its spans are folded into the folder's ARCHIVE and
+                its own file removed, so the folder doesn't grow with
+                every job
+        '''
+        if self.folder is None:
+            return
+        with self._lock:
+            saved = {name: stats.to_dict()
+                     for name, stats in self.stats.items()}
+            self._flushed = time.monotonic()
+        try:
+            if final and fcntl is not None:
+                self._archive(saved)
+                if os.path.exists(self._path()):
+                    os.remove(self._path())
+            else:
+                _write_json(self._path(), saved)
+        except OSError:
+            # metrics are best effort: the spans stay in this process
+            logging.getLogger(__name__).exception(
+                "could not write the metrics to %s", self.folder)
+
+    def _archive(self, saved: dict) -> None:
+        '''adds saved spans to the ARCHIVE file, under a file lock'''
+        path = os.path.join(self.folder, ARCHIVE)
+        with open(path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive = _read_json(path)
+            for name, stats in saved.items():
+                if name in archive:
+                    stats = SpanStats().merge(archive[name]).merge(stats)\
+                        .to_dict()
+                archive[name] = stats
+            _write_json(path, archive)
+
+    def combined(self) -> dict:
+        '''
+        Method-- combined
+            {span name: summary} over every process sharing the folder
+            (their totals added up, their recent durations pooled for the
+            percentiles); the same as snapshot() without a folder.
+        '''
+        if self.folder is None:
+            return self.snapshot()
+        self.flush()
+        stats = {}
+        for file_name in os.listdir(self.folder):
+            if not file_name.endswith(".json"):
+                continue
+            saved = _read_json(os.path.join(self.folder, file_name))
+            for name, totals in saved.items():
+                stats.setdefault(name, SpanStats()).merge(totals)
+        return {name: stats[name].summary() for name in sorted(stats)}
+
+    def instrument_server(self, server, prefix: str = "request:") -> None:
+        '''
+        Method-- instrument_server
+            Times every Dash callback request on a Flask server, from the
+            request to the serialized JSON response, as a span named after
+            the callback's output (e.g. "request:top-ten-table.figure"),
+            with the response size as its payload bytes. Compared with the
+            callback's own span, this shows the time spent in Dash's JSON
+            serialization and request handling.
+        '''
+        import flask
+
+        @server.before_request
+        def start_timer():
+            flask.g.aft_metrics_start = time.perf_counter()
+
+        @server.after_request
+        def stop_timer(response):
+            start = flask.g.pop("aft_metrics_start", None)
+            if start is None or \
+                not flask.request.path.endswith("_dash-update-component"):
+                return response
+            body = flask.request.get_json(silent=True) or {}
+            span = Span(prefix + str(body.get("output", "unknown")))
+            span.seconds = time.perf_counter() - start
+            span.payload_bytes = response.calculate_content_length()
+            self.record(span, failed=response.status_code >= 400)
+            return response
+
+def _write_json(path: str, value: dict) -> None:
+    '''writes value to path atomically (readers see the old or new file),
+    through a temporary file of its own for each thread'''
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, "w") as file:
+        json.dump(value, file)
+    os.replace(temporary, path)
+
+
+def _read_json(path: str) -> dict:
+    '''the JSON object saved at path ({} if missing or unreadable)'''
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+'''---------------------------- Shared Registry ----------------------------'''
+
+# shared by the plot functions and the dashboard callbacks
+METRICS = Metrics(METRICS_LOG, METRICS_DIR)
@@ -5,14 +5,19 @@ Plot Functions
 '''-------------------------- Imports & Constants --------------------------'''
 
 # pre-existing python libraries
+# (scipy.stats and plotly.express are slow to import, so they are only
+# imported inside the functions that use them)
 import pandas as pd
 import numpy as np
-import scipy.stats as stats
-import plotly.express as px
 import plotly.graph_objects as go
 
 # our custom-made libraries
-from .aft_data_org import DATA
+from .aft_data_org import DATASET, EnrollmentDataset
+from .aft_filters import ColumnStats, FilterSpec
+from .aft_metrics import METRICS
+from .aft_stats import (membership_matrix, cramers_v_matrix,
+                        cooccurrence_counts, cramers_v_from_counts,
+                        contingency_table_from_counts, chi2_test_from_counts)
 
 # Resolves potential errors related to deprecated downcasting methods and
 # automatically adapts to future versions of pandas.
@@ -60,90 +65,56 @@ def filter_dataframe(*, # requires kwargs to have kwarg name in calls
     return df[df[column_name].isin(filters)]
 
 
-def pivot_dataframe(*, # requires kwargs to have kwarg name in calls
-    df: pd.DataFrame,
-    index:list[str]
-    ) -> pd.DataFrame:
+def as_discrete(df: pd.DataFrame, column: str) -> pd.DataFrame:
     """
-    Function-- pivot_dataframe
-        outputs a partially-flattened pivot table, use with treemap()
-        
+    Function-- as_discrete
+        returns a copy of df where a numeric column (e.g. FA or Grade) is
+        converted to strings, so plotly colors it by value (like
+        px.histogram does) instead of with a continuous color scale
     Parameters:
-        df (pd.DataFrame)
-        index (list[str]): column indicies to use
-        
+        df (pd.DataFrame): dataframe to convert
+        column (str): name of the column used for color
     Returns:
-        pd.DataFrame: pivoted dataframe
-    """
-    pivot = df.pivot_table(
-        index=list(index),
-        columns="Program (name)",
-        values="Person ID",
-        aggfunc="count",
-        fill_value=0
-    ).reset_index(level =[i for i in range(len(list(index)))])
-    # reset index helps organize the pivot table for melt_pivottable()
-    return pivot
-
-
-def melt_pivottable(
-    df: pd.DataFrame,
-    id_variables: list[str],
-    var_name: str,
-    value_name: str
-    ) -> pd.DataFrame:
+        pd.DataFrame: converted dataframe
     """
-    Function-- melt_pivottable
-        turns a Pandas pivot table into a one-dimensional dataframe,
-        use with treemap()
-        
-    Parameters:
-        df (pd.DataFrame): dataframe to melt
-        id_variables (list[str]): main column indices used in the pivot table
-        var_name (str): column to group counts by
-        value_name (str): column with counts for each row
-        
-    Returns:
-        pd.DataFrame: each row is a count of program enrollment by the selected
-        id varibles
-    """
-    melted = pd.melt(
-        df,
-        id_vars=list(id_variables),
-        var_name=var_name,
-        value_name=value_name
-        )
-    return melted
-
+    if pd.api.types.is_numeric_dtype(df[column]):
+        df = df.assign(**{column: df[column].astype(str)})
+    return df
 
-def concatenate_program_details(row: pd.Series) -> str:
-    '''
-    Function-- concatenate_program_details
-        Concatenates important program details into a single string
-        This function is used to add a 'Full Name' column to the aps data frame
 
+def selection_counts(
+    dataset:EnrollmentDataset,
+    by:list[str],
+    years:list[int],
+    filters:dict,
+    unique_students:bool=False
+    ) -> pd.DataFrame:
+    """
+    Function-- selection_counts
+        enrollments (or different students) per group of the selected rows
     Parameters:
-        row (pd.Series): Pandas Series corresponding to a single row of 
-        a DataFrame
-            It should contain the columns: 
-                'Program (Gender)', 'Program (Level)', and 'Program (name)',
-            from which non-NaN values will be concatenated
-
+        dataset (EnrollmentDataset): data snapshot
+        by (list[str]): columns to group by
+        years (list[int]): selected years range
+        filters (dict): {column name: allowed values}
+        unique_students (bool): count each student once per group (see
+            PandasBackend.distinct_students) instead of every enrollment
     Returns:
-        str: A string formed by concatenating the non-NaN values of
-        'Program (Gender)', 'Program (Level)', and 'Program (name)' columns,
-        separated by spaces.
-            Returns an empty string if all specified columns contain NaN values
-    '''
-    # List to hold the non-NaN values
-    details = []
+        pd.DataFrame: by columns and a 'count' column
+    """
+    if not unique_students:
+        return dataset.query.group_count(by=by, years=years, filters=filters)
+    return dataset.query.distinct_students(
+        by=by, years=years, filters=filters)\
+        .rename(columns={"students": "count"})
 
-    for column in ['Program (Gender)', 'Program (Level)', 'Program (name)']:
-        # Append the value if it is not NaN
-        if pd.notna(row[column]):
-            details.append(row[column])
-    # Join the details with a space and return
-    return ' '.join(details)
+
+def count_labels(unique_students:bool) -> dict:
+    """
+    Function-- count_labels
+        plotly axis label of the 'count' column
+    """
+    return {"count": "unique students" if unique_students else "count"}
 
 
 def filter_top_progs(
@@ -151,7 +122,8 @@ def filter_top_progs(
     years:list[int], 
     program_codes: list[str],
     grades:str="hs", 
-    n:int=15
+    n:int=15,
+    stats:ColumnStats=None
     )-> pd.DataFrame:
     '''
     Function-- filter_top_progs
@@ -164,37 +136,27 @@ def filter_top_progs(
         end_gr (int) : end grade (inclusive).  Default is 12th grade
         n (int) : Filter by top n most enrolled programs.  Default is top 10
         progs.
+        stats (ColumnStats) : df's column statistics, to run the most
+        selective filter first (e.g. EnrollmentDataset.stats)
 
     Return:
         aps_top (pd.Dataframe): a dataframe filtered using the above parameters
         with the top n programs
     '''
-    # add a column at end of df of program 'Full name'
-    df['Full name'] = df.apply(concatenate_program_details, axis=1)
-
-    # apply filters
-    aps_top = filter_dataframe(
-        df=filter_dataframe(
-            df=filter_dataframe(
-                df=df,
-                column_name="Code",
-                filters=program_codes),
-            column_name="Acad Yr (start)",
-            filters=[i for i in range(min(years), max(years)+1)]
-        ),
-        column_name='Grade at Time of Activity',
-        filters=grade_level(grades)
-        )
+    # apply filters (read-only: df itself is never modified), as row
+    # positions, so only the selected rows are copied, once, at the end
+    spec = FilterSpec({"Code": program_codes,
+                       "Grade at Time of Activity": grade_level(grades)},
+                      years=years)
+    with METRICS.span("filter_top_progs.filter", rows=len(df)):
+        rows, _ = spec.select(df, stats, name="filter_top_progs.filter")
 
-    # Create an array of the top enrolled programs
-    top_enrolled_progs = aps_top['Full name'].value_counts().head(n).index
+        # Create an array of the top enrolled programs
+        names = df['Full name'].take(rows)
+        top_enrolled_progs = names.value_counts().head(n).index
 
-    # Filter the DataFrame to only keep top_enrolled_programs
-    aps_top = filter_dataframe(
-        df=aps_top, 
-        column_name="Full name", 
-        filters=top_enrolled_progs
-        )
+        # only keep top_enrolled_programs
+        aps_top = df.take(rows[names.isin(top_enrolled_progs).to_numpy()])
 
     return aps_top
 
@@ -326,6 +288,8 @@ def calculate_cramers_v(contingency_table):
     Returns:
         cramers_v (float) : Cramer's V coefficient, rounded to 4 decimals
     '''
+    import scipy.stats as stats
+
     # use scipy.stat's chi-squared contingency function
     # Note: even though we only need the chi2 statistic to calculate Cramer's V
     # all return values shown below by tuple assignment (for reader)
@@ -346,56 +310,29 @@ def calculate_cramers_v(contingency_table):
     return cramers_v.round(4)
 
 
-def generate_heatmap_df(aps_top, program_dict):
+def generate_heatmap_df(aps_top: pd.DataFrame) -> pd.DataFrame:
     '''
     Function-- generate_heatmap_df
         Generate a heatmap dataframe where each cell 
         is the Cramer's V coefficient between two programs.
-        This function iterates through all combinations of top programs,
-        while efficiently skipping any trivial or symmetric cases.
+        Every pair is computed at once from a student x program membership
+        matrix (see aft_stats), so this scales to hundreds of programs.
 
     Parameters:
         aps_top (pd.DataFrame) : Filtered afternoon program dataframe.
-        program_dict (dict) : Dictionary of sets where 
-            keys - program names
-            values - sets of Person IDs
     Returns:
         heatmap_df (pd.DataFrame) : n x n matrix 
             where each cell is the Cramer's V coefficient between two programs.
     '''
-    # get list of all programs from aps_top
-    top_enrolled_progs = list(aps_top['Full name'].unique())
-    
-    # initialize blank heatmap, with program names across rows and columns
+    # programs are in order of first appearance, like aps_top.unique()
+    top_enrolled_progs, membership = membership_matrix(aps_top)
+
     heatmap_df = pd.DataFrame(
-        index=top_enrolled_progs, 
+        cramers_v_matrix(membership),
+        index=top_enrolled_progs,
         columns=top_enrolled_progs
         )
 
-    # Fill the diagonal with 1s (ie, perfect self-correlation)
-    np.fill_diagonal(heatmap_df.values, 1)
-
-    # Iterate through each pair of programs only once
-    # start at i = 0 up to i = 12
-    for i in range(len(top_enrolled_progs)):
-        # iterate j starting from j = i + 1 (since i = j is along diagonal)
-        for j in range(i + 1, len(top_enrolled_progs)):
-            program1 = top_enrolled_progs[i]
-            program2 = top_enrolled_progs[j]
-            cont_table = create_contingency_table(
-                program_dict,
-                program1,
-                program2
-                )
-            cramers_v = calculate_cramers_v(cont_table)
-            heatmap_df.at[program1, program2] = cramers_v
-            
-            # Fill symmetric value on opposite side of diagonal
-            heatmap_df.at[program2, program1] = cramers_v 
-
-    # Replace any NaN values with 0 (for pairs without direct comparison)
-    heatmap_df = heatmap_df.fillna(0).astype(float).round(4)
-
     return heatmap_df
 
 '''----------------------------- Plot Functions ----------------------------'''
@@ -406,39 +343,54 @@ def total_program_enrollment_bar(
     years:list[str],
     demographics:str,
     groupmode:str,
-    grades:str
+    grades:str,
+    unique_students:bool=False,
+    dataset:EnrollmentDataset=None
     ) -> go.Figure:
     """
     Function-- total_program_enrollment_bar
-        creates a histogram with the selected programs and their combined
+        creates a bar chart with the selected programs and their combined
         enrollment in the selected years, organizing by demographics as needed
     Parameters:
         programs (list[str]): selected program names
         years (list[int]): selected years range
-        demographics (str): color filter for the histogram
+        demographics (str): color filter for the bars
+        unique_students (bool): count each student once per bar instead of
+            every enrollment
+        dataset (EnrollmentDataset): data snapshot (default: the current one)
     Returns: 
-        go.Figure: a histogram with bars representing total enrollment
-    """
-
-    # filter original data to include the selected programs + years + grades
-    filtered_df = filter_dataframe(df = filter_dataframe(
-        df=filter_dataframe(
-            df=DATA,
-            column_name="Program (name)",
-            filters=programs
-            ),
-        column_name="Acad Yr (start)",
-        filters=[i for i in range(min(years), max(years)+1)]
-        ), column_name="Grade at Time of Activity", filters=grade_level(grades))
-
-    # generates histogram
-    fig = px.histogram(
-        filtered_df,
-        x="Program (name)",
-        color = demographics,
-        barmode = groupmode
-    )\
-        .update_xaxes(tickangle = -45)
+        go.Figure: a bar chart with bars representing total enrollment
+    """
+    import plotly.express as px
+
+    # one snapshot for the whole figure, even if the data is swapped
+    if dataset is None:
+        dataset = DATASET.current()
+
+    # enrollment of the selected programs + years + grades (pre-counted
+    # with the pandas backend, see aft_backend)
+    with METRICS.span("total_program_enrollment_bar.counts") as span:
+        counts = selection_counts(
+            dataset,
+            by=["Program (name)", demographics],
+            years=years,
+            filters={"Program (name)": programs,
+                     "Grade at Time of Activity": grade_level(grades)},
+            unique_students=unique_students)
+        span.rows = len(counts)
+
+    # generates bar chart
+    with METRICS.span("total_program_enrollment_bar.figure",
+                      rows=len(counts)):
+        fig = px.bar(
+            as_discrete(counts, demographics),
+            x="Program (name)",
+            y="count",
+            color = demographics,
+            labels = count_labels(unique_students),
+            barmode = groupmode
+        )\
+            .update_xaxes(tickangle = -45)
     return fig
 
 
@@ -448,7 +400,9 @@ def program_comparison_bar(
     groupby:str,
     demographics:str,
     groupmode:str,
-    grades:str
+    grades:str,
+    unique_students:bool=False,
+    dataset:EnrollmentDataset=None
     ) -> go.Figure:
     """
     Function-- program_comparison_bar
@@ -456,49 +410,153 @@ def program_comparison_bar(
     Parameters:
         programs (list[str]): selected programs
         years (list[str]): selected years range
-        demographics (str): color filter for the histograms
+        demographics (str): color filter for the bars
         groupmode (str): stacked or grouped bar charts
         groupby (str): demographic to organize charts by (default: by program)
+        unique_students (bool): count each student once per bar instead of
+            every enrollment
+        dataset (EnrollmentDataset): data snapshot (default: the current one)
     Returns:
         go.Figure: plotly figure split by the selected groupby mode
     """
+    import plotly.express as px
+
+    # one snapshot for the whole figure, even if the data is swapped
+    if dataset is None:
+        dataset = DATASET.current()
+
+    with METRICS.span("program_comparison_bar.counts") as span:
+        counts = selection_counts(
+            dataset,
+            by=["Acad Yr (start)", demographics, groupby],
+            years=years,
+            filters={"Program (name)": programs,
+                     "Grade at Time of Activity": grade_level(grades)},
+            unique_students=unique_students)\
+                .sort_values(groupby, kind="stable")
+        span.rows = len(counts)
+
+    with METRICS.span("program_comparison_bar.figure", rows=len(counts)):
+        fig = px.bar(
+            as_discrete(counts, demographics),
+            x="Acad Yr (start)",
+            y="count",
+            color = demographics,
+            labels = {
+                "Acad Yr (start)": "Academic Year",
+                **count_labels(unique_students)
+            },
+            facet_col=groupby,
+            facet_col_wrap=2,
+            barmode=groupmode
+        )\
+            .update_layout(bargap=0.05, bargroupgap=0.1)\
+            .update_xaxes(tickangle=-45, tickmode="linear",
+                          showticklabels=True)\
+            .for_each_annotation(
+                lambda a: a.update(text=a.text.split("=")[-1]))
+    return fig
+
+
+def treemap_counts(
+    years:list[int], 
+    program_codes:list[str],
+    id_variables:list[str],
+    unique_students:bool=False,
+    dataset:EnrollmentDataset=None
+    ) -> pd.DataFrame:
+    """
+    Function-- treemap_counts
+        enrollment of the 10 most popular programs of each combination of
+        the selected demographics, which is all the treemap shows
+    Parameters:
+        years (list[int]): selected years range
+        program_codes (list[str]): selected program codes to examine
+        id_variables (list[str]): selected demographics, in treemap order
+        unique_students (bool): rank and size programs by their # of
+            different students instead of enrollments
+        dataset (EnrollmentDataset): data snapshot (default: the current one)
+    Returns:
+        pd.DataFrame: id_variables, 'Program (name)' and 'Total' columns,
+        most enrolled first within each demographics group
+    """
+    # one snapshot for the whole figure, even if the data is swapped
+    if dataset is None:
+        dataset = DATASET.current()
+
+    column:str="Program (name)"
+    value_name:str="Total"
+
+    # only the non-empty demographics x program combinations are counted,
+    # (pre-counted in the cube with the pandas backend), then the top 10
+    # programs of each group are kept, so any number of demographics can
+    # be selected at once
+    with METRICS.span("treemap.counts") as span:
+        top_ten = selection_counts(
+            dataset,
+            by=id_variables + [column],
+            years=years,
+            filters={"Code": program_codes},
+            unique_students=unique_students)\
+                .dropna(subset=id_variables)\
+                .rename(columns={"count": value_name})\
+                .sort_values(by=value_name, ascending=False, kind="stable")\
+                .groupby(id_variables, observed=True)\
+                .head(10).reset_index(drop=True)
+        span.rows = len(top_ten)
+    return top_ten
+
+
+def treemap_figure(top_ten: pd.DataFrame, id_variables: list[str]):
+    """
+    Function-- treemap_figure
+        Converts treemap_counts() into the popularity treemap. The sectors
+        (one per distinct prefix of the demographics + program path, sized
+        by the sum of its programs) are built level by level from the
+        counts and passed to go.Treemap as ids/parents/values, instead of
+        expanding the path with plotly.express.
+    Parameters:
+        top_ten (pd.DataFrame): output of treemap_counts()
+        id_variables (list[str]): selected demographics, in treemap order
+    Returns:
+        go.Figure: a treemap with the 10 most popular programs among selected
+        demographics
+    """
+    with METRICS.span("treemap.figure", rows=len(top_ten)):
+        sectors = []
+        parent = pd.Series("", index=top_ten.index)
+        for depth, column in enumerate(id_variables + ["Program (name)"]):
+            label = top_ten[column].astype(str)
+            node = label if depth == 0 else parent + "/" + label
+            sectors.append(
+                pd.DataFrame({"id": node, "parent": parent, "label": label,
+                              "value": top_ten["Total"]})
+                .groupby("id", sort=False)
+                .agg(parent=("parent", "first"), label=("label", "first"),
+                     value=("value", "sum"))
+                .reset_index())
+            parent = node
+        sectors = pd.concat(sectors, ignore_index=True)
+
+        fig = go.Figure(go.Treemap(
+            ids=sectors["id"].to_numpy(),
+            parents=sectors["parent"].to_numpy(),
+            labels=sectors["label"].to_numpy(),
+            values=sectors["value"].to_numpy(),
+            branchvalues="total",
+            textinfo="label+value",
+            hovertemplate="%{id}<br>Total=%{value}<extra></extra>"))\
+            .update_layout(margin = dict(t=15, l=15, r=15, b=15))
 
-    filtered_df = filter_dataframe(
-        df = filter_dataframe(
-            df=filter_dataframe(
-                df=DATA,
-                column_name="Program (name)",
-                filters=programs
-                ),
-            column_name="Acad Yr (start)",
-            filters=[i for i in range(min(years), max(years)+1)]
-            ), 
-        column_name="Grade at Time of Activity", 
-        filters=grade_level(grades))\
-            .sort_values(groupby)
-
-    fig = px.histogram(
-        filtered_df,
-        x="Acad Yr (start)",
-        color = demographics,
-        labels = {
-            "Acad Yr (start)": "Academic Year"
-        },
-        facet_col=groupby,
-        facet_col_wrap=2,
-        barmode=groupmode
-    )\
-        .update_traces(bingroup=None)\
-        .update_layout(bargap=0.05, bargroupgap=0.1)\
-        .update_xaxes(tickangle=-45, tickmode="linear", showticklabels=True)\
-        .for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
     return fig
 
 
 def treemap(
     years:list[int], 
     program_codes:list[str],
-    id_variables:list[str]
+    id_variables:list[str],
+    unique_students:bool=False,
+    dataset:EnrollmentDataset=None
     ):
     """
     Function-- treemap
@@ -507,87 +565,340 @@ def treemap(
     Parameters:
         years (list[int]): selected years range
         program_codes (list[str]): selected program codes to examine
-        id_variables (list[str]): selected demographics, takes 2 variables
+        id_variables (list[str]): selected demographics, in treemap order
+        unique_students (bool): rank and size programs by their # of
+            different students instead of enrollments
+        dataset (EnrollmentDataset): data snapshot (default: the current one)
     Returns:
         go.Figure: a treemap with the 10 most popular programs among selected
         demographics
     """
+    return treemap_figure(
+        treemap_counts(years, program_codes, id_variables, unique_students,
+                       dataset),
+        id_variables)
 
-    column:str="Program (name)"
-    value_name:str="Total"
 
-    filtereddf = filter_dataframe(
-        df=filter_dataframe(df=DATA,
-                            column_name="Acad Yr (start)",
-                            filters=[i for i in range(min(years),
-                                                      max(years)+1)]),
-        column_name="Code",
-        filters=program_codes)
-    pivot = pivot_dataframe(df=filtereddf, index=id_variables)
-    melted = melt_pivottable(pivot, id_variables=id_variables,
-                             var_name=column, value_name=value_name)\
-                                .sort_values(by="Total", ascending=False)\
-                                .groupby(id_variables)\
-                                .head(10).reset_index(drop=True)
-
-    fig = px.treemap(melted, path=(id_variables + [column]),
-                     values = value_name)\
-        .update_traces(textinfo="label+value")\
-        .update_layout(margin = dict(t=15, l=15, r=15, b=15))
+def heatmap_counts(
+    years: list[int], 
+    program_codes: list[str], 
+    grades:str="hs",
+    n:int=12,
+    dataset:EnrollmentDataset=None) -> dict:
+    """
+    Function-- heatmap_counts
+        Student enrollment overlaps between the top n most popular
+        programs (within any given years), which are all that is needed for
+        the heatmap's Cramer's V matrix and for any single pair's
+        contingency table (see heatmap_pair_details).
+    Parameters:
+        years (list[int]): List of years to search and filter top programs.
+        program_codes (list[str]): selected program codes to examine
+        grades (str): hs, ms, or all
+        n (int): number of top programs to compare. Default is 12.
+        dataset (EnrollmentDataset): data snapshot (default: the current one)
+    Returns:
+        dict: 
+            "programs" (list[str]): top programs, most popular first
+            "both" (np.array): # of students in both programs of each pair
+            "totals" (np.array): # of students in each program
+            "n" (int): # of students in any of the programs
+    """
+    # one snapshot for the whole figure, even if the data is swapped
+    if dataset is None:
+        dataset = DATASET.current()
+
+    # top n most enrolled programs (by rows, like filter_top_progs), then
+    # the students of each (with the pandas backend, both come from
+    # pre-aggregated counts, see aft_backend)
+    filters = {"Code": program_codes,
+               "Grade at Time of Activity": grade_level(grades)}
+    with METRICS.span("heatmap.filter") as span:
+        top_enrolled_progs = list(dataset.query.top_k(
+            "Full name", n, years=years, filters=filters)["Full name"])
+        aps_top = dataset.query.filter(
+            ["Person ID", "Full name"], years=years,
+            filters={**filters, "Full name": top_enrolled_progs},
+            distinct=True)
+        span.rows = len(aps_top)
+
+    with METRICS.span("heatmap.cooccurrence", rows=len(aps_top)):
+        programs, membership = membership_matrix(aps_top)
+        both, totals, n_students = cooccurrence_counts(membership)
+
+    # most popular programs first
+    order = [programs.index(program) for program in top_enrolled_progs]
+    return {
+        "programs": [programs[i] for i in order],
+        "both": both[np.ix_(order, order)],
+        "totals": totals[order],
+        "n": n_students}
+
+
+def heatmap_pair_details(
+    counts: dict,
+    program_a: str,
+    program_b: str) -> dict:
+    """
+    Function-- heatmap_pair_details
+        Contingency table and test statistics for one heatmap cell,
+        looked up in already computed heatmap_counts (no recompute).
+    Parameters:
+        counts (dict): output of heatmap_counts() (its arrays may be
+            lists, e.g. sent to the browser and back)
+        program_a (str): program on the heatmap's y axis
+        program_b (str): program on the heatmap's x axis
+    Returns:
+        dict: "table" (2 x 2 np.array, laid out like
+        create_contingency_table), "cramers_v", "chi2", "pvalue" and "n"
+    """
+    a = counts["programs"].index(program_a)
+    b = counts["programs"].index(program_b)
+    both = np.asarray(counts["both"])[a, b]
+    totals, n = np.asarray(counts["totals"]), counts["n"]
+
+    chi2, pvalue = chi2_test_from_counts(both, totals[a], totals[b], n)
+    return {
+        "table": contingency_table_from_counts(both, totals[a], totals[b], n),
+        # Cramer's V = √(chi2 / n) for a 2x2 table
+        "cramers_v": round(float(np.sqrt(chi2 / n)), 4) if n else 0.0,
+        "chi2": chi2,
+        "pvalue": pvalue,
+        "n": n}
+
+
+def heatmap_figure(counts: dict) -> go.Figure:
+    """
+    Function-- heatmap_figure
+        Converts heatmap_counts() into a Dash heatmap of the Cramer's V
+        correlation coefficient between every pair of programs.
+    Parameters:
+        counts (dict): output of heatmap_counts()
+    Returns:
+        go.Figure: A heatmap of the Cramer's V correlation coefficients
+    """
+    import plotly.express as px
+
+    with METRICS.span("heatmap.cramers_v",
+                      rows=len(counts["programs"]) ** 2):
+        heatmap_df = pd.DataFrame(
+            cramers_v_from_counts(counts["both"], counts["totals"],
+                                  counts["n"]),
+            index=counts["programs"],
+            columns=counts["programs"]
+            )
 
+    # Generate dash heatmap visual
+    with METRICS.span("heatmap.figure", rows=heatmap_df.size):
+        fig = px.imshow(heatmap_df,
+                        labels=dict(color="Correlation"),
+                        x=heatmap_df.columns,
+                        y=heatmap_df.columns,
+                        color_continuous_scale='matter',  # color palette
+                        color_continuous_midpoint=0.15,
+                        range_color=[0, 0.4]  # Set range of colors
+                        )
+
+    # Fills heatmap cells with correlation coefficient, rounded to
+    # 2 decimal places. A text template on the trace (rather than one
+    # annotation per cell) keeps large heatmaps responsive; past ~20
+    # programs the labels would be unreadable anyway.
+    if len(heatmap_df) <= 20:
+        fig.update_traces(texttemplate="%{z:.2f}",
+                          textfont=dict(color='white'))
+
+    # Make axis titles bold
+    fig.update_layout(
+        xaxis=dict(title=dict(font=dict(size=18))),
+        yaxis=dict(title=dict(font=dict(size=18))))
     return fig
 
 
 def generate_dash_heatmap(
     years: list[int], 
     program_codes: list[str], 
-    grades:str="hs"):
+    grades:str="hs",
+    n:int=12,
+    dataset:EnrollmentDataset=None) -> go.Figure:
     """
     Function-- generate_dash_heatmap
-        Converts a Cramer's V correlation matrix of the top 12 most popular
+        Converts a Cramer's V correlation matrix of the top n most popular
         after-school programs (within any given years) into a Dash heatmap.
     Parameters:
         years (list[int]): List of years to search and filter top programs.
+        program_codes (list[str]): selected program codes to examine
+        grades (str): hs, ms, or all
+        n (int): number of top programs to compare. Default is 12.
+        dataset (EnrollmentDataset): data snapshot (default: the current one)
     Returns:
         go.Figure: A heatmap of the Cramer's V correlation coefficient of
-        the top 12 most popular programs within a range of years.
-    """
-    aps_top = filter_top_progs(
-        DATA,
-        years=years, 
-        program_codes=program_codes,
-        grades=grades, 
-        n=12)
-    
-    program_dict = create_enrollment_dict(aps_top)
-    heatmap_df = generate_heatmap_df(aps_top, program_dict)
-    
-    # Generate dash heatmap visual
-    fig = px.imshow(heatmap_df,
-                    labels=dict(color="Correlation"),
-                    x=heatmap_df.columns,
-                    y=heatmap_df.columns,
-                    color_continuous_scale='matter',  # Change color palette
-                    color_continuous_midpoint=0.15,
-                    range_color=[0, 0.4]  # Set range of colors
-                    )
-
-    # Fills heatmap cells with correlation coefficient
-    annotations = []
-    for i, row in enumerate(heatmap_df.values):
-        for j, value in enumerate(row):
-            annotations.append(dict(
-                x=j,
-                y=i,
-                text=str(round(value, 2)),
-                # Round correlation coefficient to 2 decimal places
-                showarrow=False,
-                font=dict(color='white')
-            ))
-    fig.update_layout(annotations=annotations)
+        the top n most popular programs within a range of years.
+    """
+    return heatmap_figure(
+        heatmap_counts(years, program_codes, grades, n, dataset))
 
-    # Make axis titles bold
-    fig.update_layout(
-        xaxis=dict(title=dict(font=dict(size=18))),
-        yaxis=dict(title=dict(font=dict(size=18))))
+
+def transition_heatmap(
+    years:list[int],
+    program_codes:list[str],
+    n:int=12,
+    dataset:EnrollmentDataset=None
+    ) -> go.Figure:
+    """
+    Function-- transition_heatmap
+        heatmap of where the students of the n most enrolled programs go
+        the next season: each row is a program in the selected years and
+        codes, and each column the share of its enrollments followed by
+        that program, by any other program, or by no enrollment
+    Parameters:
+        years (list[int]): selected years range (of the first season)
+        program_codes (list[str]): selected program codes to examine
+        n (int): number of programs shown. Default is 12.
+        dataset (EnrollmentDataset): data snapshot (default: the current one)
+    Returns:
+        go.Figure: a heatmap of season to season transition shares
+    """
+    import plotly.express as px
+    from .aft_trajectory import NOT_ENROLLED
+
+    # one snapshot for the whole figure, even if the data is swapped
+    if dataset is None:
+        dataset = DATASET.current()
+
+    with METRICS.span("transition_heatmap.counts") as span:
+        counts = dataset.trajectories.transition_counts(
+            years=years, filters={"Code": program_codes})\
+            .astype({"From": str, "To": str})
+        top = list(counts.groupby("From")["count"].sum()
+                   .sort_values(ascending=False, kind="stable").index[:n])
+
+        # programs past the top n are added up into one column
+        other = "Other programs"
+        counts = counts[counts["From"].isin(top)]
+        counts = counts.assign(To=counts["To"].where(
+            counts["To"].isin(top + [NOT_ENROLLED]), other))
+        matrix = counts.pivot_table(index="From", columns="To",
+                                    values="count", aggfunc="sum",
+                                    fill_value=0)\
+            .reindex(index=top, columns=top + [other, NOT_ENROLLED],
+                     fill_value=0)
+        shares = matrix.div(matrix.sum(axis=1).where(lambda x: x > 0),
+                            axis=0)
+        span.rows = matrix.size
+
+    with METRICS.span("transition_heatmap.figure", rows=matrix.size):
+        fig = px.imshow(shares,
+                        labels=dict(x="Next season", y="Program",
+                                    color="Share"),
+                        x=shares.columns,
+                        y=shares.index,
+                        color_continuous_scale="matter",
+                        range_color=[0, 1],
+                        aspect="auto")\
+            .update_traces(
+                customdata=matrix.to_numpy(),
+                hovertemplate="%{y} → %{x}<br>%{z:.1%} "
+                              "(%{customdata} enrollments)<extra></extra>")
+        if len(top) <= 20:
+            fig.update_traces(texttemplate="%{z:.0%}")
+    return fig
+
+
+def retention_bar(
+    programs:list[str],
+    years:list[int],
+    demographics:str,
+    dataset:EnrollmentDataset=None
+    ) -> go.Figure:
+    """
+    Function-- retention_bar
+        bar chart of the share of each selected program's students who
+        are back in it the next year (see StudentTrajectories.retention),
+        split by demographics
+    Parameters:
+        programs (list[str]): selected program names
+        years (list[int]): selected years range
+        demographics (str): color filter for the bars
+        dataset (EnrollmentDataset): data snapshot (default: the current one)
+    Returns:
+        go.Figure: a bar chart of year to year retention
+    """
+    import plotly.express as px
+
+    # one snapshot for the whole figure, even if the data is swapped
+    if dataset is None:
+        dataset = DATASET.current()
+
+    with METRICS.span("retention_bar.counts") as span:
+        retention = dataset.trajectories.retention(
+            by=[demographics], years=years,
+            filters={"Program (name)": programs})
+        span.rows = len(retention)
+
+    with METRICS.span("retention_bar.figure", rows=len(retention)):
+        fig = px.bar(
+            as_discrete(retention, demographics),
+            x="Program (name)",
+            y="retention",
+            color=demographics,
+            hover_data=["students", "retained"],
+            labels={"retention": "Back the next year"},
+            barmode="group"
+        )\
+            .update_yaxes(tickformat=".0%")\
+            .update_xaxes(tickangle=-45)
+    return fig
+
+
+def persistence_funnel(
+    programs:list[str],
+    years:list[int],
+    demographics:str,
+    start_grade:int=7,
+    dataset:EnrollmentDataset=None
+    ) -> go.Figure:
+    """
+    Function-- persistence_funnel
+        line chart of the share of each selected program's start_grade
+        students who are still in it in every grade through grade 12
+        (see StudentTrajectories.persistence), one line per program and
+        demographics group
+    Parameters:
+        programs (list[str]): selected program names
+        years (list[int]): selected years range (of the start_grade year)
+        demographics (str): line style filter
+        start_grade (int): grade the students start from
+        dataset (EnrollmentDataset): data snapshot (default: the current one)
+    Returns:
+        go.Figure: a line chart of persistence by grade
+    """
+    import plotly.express as px
+
+    # one snapshot for the whole figure, even if the data is swapped
+    if dataset is None:
+        dataset = DATASET.current()
+
+    with METRICS.span("persistence_funnel.counts") as span:
+        funnel = dataset.trajectories.persistence(
+            by=[demographics], start_grade=start_grade, years=years,
+            filters={"Program (name)": programs})
+        span.rows = len(funnel)
+
+    with METRICS.span("persistence_funnel.figure", rows=len(funnel)):
+        fig = px.line(
+            as_discrete(funnel, demographics),
+            x="grade",
+            y="persistence",
+            color="Program (name)",
+            line_dash=None if demographics == "Program (name)"
+                else demographics,
+            hover_data=["students", "observed"],
+            labels={
+                "grade": "Grade",
+                "persistence": f"Still enrolled since grade {start_grade}"
+            },
+            markers=True
+        )\
+            .update_yaxes(tickformat=".0%", range=[0, 1.05])\
+            .update_xaxes(dtick=1)
     return fig
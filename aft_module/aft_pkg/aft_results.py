@@ -0,0 +1,300 @@
+'''
+AFT Data Visualization Tool
+Result Store
+'''
+'''-------------------------- Imports & Constants --------------------------'''
+
+# pre-existing python libraries
+import argparse
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import stat
+import threading
+import time
+
+# our custom-made libraries
+from .aft_cache import normalize
+from .aft_data_org import (DATASET, GRADES, TREEMAP_DEMOGS,
+                           EnrollmentDataset)
+from .aft_metrics import METRICS
+from .aft_plot_functions import heatmap_counts, treemap_counts
+
+# folder of the stored results (AFT_RESULTS_DIR to change it, by default
+# next to the enrollment CSV, see results_path) and its size limit in MB
+# (AFT_RESULTS_MAX_MB); the least recently used results are deleted past it
+RESULTS_DIR = os.environ.get("AFT_RESULTS_DIR")
+RESULTS_MAX_BYTES = int(os.environ.get("AFT_RESULTS_MAX_MB", 256)) \
+    * 1024 ** 2
+
+# bumped whenever a stored result's format changes, so old ones are
+# never read back
+STORE_VERSION = 1
+
+# selections precomputed by prime(): years ranges ending at the last
+# year (None: every year), with every program code and with each alone
+PRIME_SPANS = [None, 1, 5, 10]
+PRIME_HEATMAP_N = 12
+PRIME_TREEMAP_DEMOGS = ["Race/ethnicity", "Gender code"]
+
+'''--------------------------------- Store ---------------------------------'''
+
+def results_path(csv_path: str) -> str:
+    '''
+    Function-- results_path
+        default folder of the stored results, next to the CSV they are
+        computed from
+    '''
+    return csv_path + ".results"
+
+
+def private_folder(path: str) -> bool:
+    '''
+    Function-- private_folder
+        Creates the folder if it is missing, and returns whether only this
+        user can write to it: it must be a directory (not a link) owned by
+        this user, not writable by its group or others. Files read back
+        with pickle are only trusted from such a folder, since anyone who
+        can write to it could run code in the server.
+    '''
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid() and \
+        not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+class ResultStore:
+    '''
+    Class-- ResultStore
+        Disk-backed store of deterministic results (e.g. heatmap overlap
+        counts and treemap aggregates), kept across restarts and shared by
+        every server worker and background job using the same folder.
+
+        Each result is a pickle file named after the hash of its key: the
+        function, the content hash of the dataset it was computed from and
+        its normalized arguments (see aft_cache.normalize), so a result is
+        found again whatever process computed it, and never used for other
+        data. Files are written to a temporary name and renamed into
+        place, so other processes never read a half-written result. Past
+        max_bytes, the least recently used files are deleted.
+
+        The results are unpickled, so the folder is only used if this user
+        alone can write to it (see private_folder); otherwise every result
+        is computed, and nothing is read or stored.
+
+    Attributes:
+        directory (str) : folder of the result files
+        max_bytes (int) : size limit of the folder
+        private (bool) : whether the folder is used (checked once)
+        hits, misses, writes, evictions (int) : counters of this process
+    '''
+
+    def __init__(self, directory: str, max_bytes: int = RESULTS_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._private = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def _path(self, key) -> str:
+        digest = hashlib.sha256(
+            repr((STORE_VERSION, key)).encode()).hexdigest()
+        return os.path.join(self.directory, digest + ".pkl")
+
+    @property
+    def private(self) -> bool:
+        if self._private is None:
+            self._private = private_folder(self.directory)
+        return self._private
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key, compute):
+        '''
+        Method-- get
+            Returns the stored result for key, or computes, stores and
+            returns it. An unreadable file (e.g. deleted by another
+            process's eviction meanwhile) is treated as missing, and a
+            folder that can't be written to only skips storing.
+        '''
+        if not self.private:
+            self._count("misses")
+            return compute()
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                value = pickle.load(file)
+            # marks it as recently used, for the eviction order
+            os.utime(path)
+            self._count("hits")
+            return value
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self._count("misses")
+
+        value = compute()
+        try:
+            temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary, "wb") as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, path)
+            self._count("writes")
+            self._evict()
+        except OSError:
+            pass
+        return value
+
+    def _evict(self) -> None:
+        '''deletes the least recently used files past max_bytes'''
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self._count("evictions")
+            except OSError:
+                # already deleted by another process
+                pass
+            total -= size
+
+    def clear(self) -> None:
+        '''deletes every stored result'''
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".pkl"):
+                    os.remove(entry.path)
+
+    def stats(self) -> dict:
+        '''this process's counters'''
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions}
+
+    def memoize(self, unordered: tuple = (), dataset: str = "dataset"):
+        '''
+        Method-- memoize
+            Decorator storing a function's results, keyed on its
+            normalized arguments, with its dataset argument replaced by
+            the dataset's content hash.
+
+        Parameters:
+            unordered (tuple[str]) : argument names whose order doesn't
+                matter (e.g. selected program codes)
+            dataset (str) : name of the dataset snapshot argument (the
+                current snapshot if it is None)
+        '''
+        def decorator(func):
+            signature = inspect.signature(func)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                if bound.arguments.get(dataset) is None:
+                    bound.arguments[dataset] = DATASET.current()
+                key = (func.__qualname__,) + tuple(
+                    (name, value.content_hash if name == dataset
+                     else normalize(value, name in unordered))
+                    for name, value in bound.arguments.items())
+                return self.get(key, lambda: func(*bound.args,
+                                                  **bound.kwargs))
+            return wrapper
+        return decorator
+
+'''----------------------------- Stored Results ----------------------------'''
+
+# shared by the dashboard and the priming command below
+RESULTS = ResultStore(RESULTS_DIR or results_path(DATASET.path))
+
+stored_heatmap_counts = RESULTS.memoize(
+    unordered=("program_codes",))(heatmap_counts)
+stored_treemap_counts = RESULTS.memoize(
+    unordered=("program_codes",))(treemap_counts)
+
+
+def prime(dataset=None, spans: list = PRIME_SPANS) -> int:
+    '''
+    Function-- prime
+        Computes and stores the heatmap counts and treemap aggregates of
+        the most common selections, e.g. at deploy time, so the first
+        users don't wait for them: the years ranges in spans (ending at
+        the last year), with every program code and with each code alone,
+        every grades option for the heatmap, and the dashboard's default
+        heatmap size and treemap demographics.
+
+    Parameters:
+        dataset (EnrollmentDataset) : data snapshot (default: the current
+            one)
+        spans (list) : # of years of each range (None: every year)
+
+    Returns:
+        int : # of selections primed (already stored ones included)
+    '''
+    if dataset is None:
+        dataset = DATASET.current()
+    last_year = max(dataset.years)
+    all_codes = list(dataset.codes)
+    n = min(PRIME_HEATMAP_N, len(dataset.program_list))
+    demographics = [d for d in PRIME_TREEMAP_DEMOGS if d in TREEMAP_DEMOGS]
+
+    primed = 0
+    with METRICS.span("results.prime") as span:
+        for years_back in spans:
+            first_year = min(dataset.years) if years_back is None \
+                else max(last_year - years_back + 1, min(dataset.years))
+            years = [first_year, last_year]
+            for codes in [all_codes] + [[code] for code in all_codes]:
+                for grades in GRADES:
+                    stored_heatmap_counts(years=years, program_codes=codes,
+                                          grades=grades, n=n,
+                                          dataset=dataset)
+                    primed += 1
+                stored_treemap_counts(years=years, program_codes=codes,
+                                      id_variables=demographics,
+                                      dataset=dataset)
+                primed += 1
+        span.rows = primed
+    return primed
+
+'''----------------------------------- Main --------------------------------'''
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Precomputes the heatmap and treemap results of the "
+                    "most common selections into the result store")
+    parser.add_argument("--csv", default=None,
+                        help="enrollment CSV (default: the dashboard's)")
+    parser.add_argument("--clear", action="store_true",
+                        help="delete every stored result first")
+    args = parser.parse_args()
+
+    if args.clear:
+        RESULTS.clear()
+    snapshot = EnrollmentDataset(args.csv) if args.csv \
+        else DATASET.current()
+    start = time.perf_counter()
+    count = prime(snapshot)
+    print(f"primed {count} selections in {time.perf_counter() - start:.1f}s"
+          f" into {RESULTS.directory} ({RESULTS.stats()})")
@@ -0,0 +1,184 @@
+'''
+AFT Data Visualization Tool
+Vectorized Statistics
+'''
+'''-------------------------- Imports & Constants --------------------------'''
+
+# pre-existing python libraries
+import math
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+'''------------------------- Membership Functions --------------------------'''
+# student x program membership matrices
+
+def membership_matrix(
+    df: pd.DataFrame,
+    column: str = "Full name",
+    id_column: str = "Person ID"
+    ) -> tuple[list, sparse.csr_matrix]:
+    '''
+    Function-- membership_matrix
+        Builds a sparse student x program membership matrix, where cell
+        (i, j) is 1 if student i enrolled in program j at least once.
+
+    Parameters:
+        df (pd.DataFrame) : enrollment rows to encode
+        column (str) : program column (default: 'Full name')
+        id_column (str) : student column (default: 'Person ID')
+
+    Returns:
+        programs (list) : program names, in order of first appearance
+            (the same order as df[column].unique())
+        membership (sparse.csr_matrix) : n_students x n_programs matrix
+            of 0/1 int64 values
+
+    Note:
+        Students with several rows in the same program (multiple seasons
+        or years) are only counted once, like the sets built by
+        create_enrollment_dict().
+    '''
+    student_codes, _ = pd.factorize(df[id_column])
+    program_codes, programs = pd.factorize(df[column])
+
+    # drop repeated (student, program) pairs so every cell is 0 or 1
+    n_programs = len(programs)
+    pairs = np.unique(student_codes.astype(np.int64) * n_programs
+                      + program_codes)
+    rows, cols = np.divmod(pairs, n_programs)
+
+    membership = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.int64), (rows, cols)),
+        shape=(student_codes.max() + 1 if len(student_codes) else 0,
+               n_programs)
+        )
+    return list(programs), membership
+
+
+def cooccurrence_counts(membership) -> tuple[np.ndarray, np.ndarray, int]:
+    '''
+    Function-- cooccurrence_counts
+        Counts every pairwise program overlap with a single matrix product.
+
+    Parameters:
+        membership (sparse matrix or np.array) : n_students x n_programs
+            0/1 membership matrix
+
+    Returns:
+        both (np.array) : n_programs x n_programs matrix,
+            both[i, j] = # of students enrolled in program i and j
+        totals (np.array) : # of students enrolled in each program
+        n (int) : total # of students
+    '''
+    both = membership.T @ membership
+    if sparse.issparse(both):
+        both = both.toarray()
+    both = np.asarray(both, dtype=np.int64)
+    return both, np.diag(both).copy(), membership.shape[0]
+
+
+def contingency_table_from_counts(
+    both: int,
+    total_a: int,
+    total_b: int,
+    n: int
+    ) -> np.ndarray:
+    '''
+    Function-- contingency_table_from_counts
+        Rebuilds the 2x2 contingency table for one program pair from
+        overlap counts, in the same layout as create_contingency_table().
+
+    Returns:
+        contingency_table (np.array) : 2 x 2 contingency table
+            _ _ _ _ _ _ _ _ _ _
+            | A & B  | A only  |
+            |- - - - - - - - - |
+            | B only | Neither |
+            | - - - - - - - - -|
+    '''
+    return np.array([
+        [both, total_a - both],
+        [total_b - both, n - total_a - total_b + both]
+        ])
+
+'''--------------------------- Cramer's V Engine ---------------------------'''
+
+def cramers_v_from_counts(
+    both: np.ndarray,
+    totals: np.ndarray,
+    n: int
+    ) -> np.ndarray:
+    '''
+    Function-- cramers_v_from_counts
+        Closed-form Cramer's V for every 2x2 program pair at once.
+
+        For a 2x2 table [[a, b], [c, d]] with margins
+        A = a + b, B = a + c and n = a + b + c + d:
+
+            chi2 = n * (ad - bc)^2 / (A * (n - A) * B * (n - B))
+            ad - bc = n * a - A * B
+
+        so Cramer's V = |n * a - A * B| / √(A * (n - A) * B * (n - B)),
+        which is what calculate_cramers_v() returns (no Yates correction).
+
+    Parameters:
+        both (np.array) : pairwise overlap counts
+        totals (np.array) : # of students enrolled in each program
+        n (int) : total # of students
+
+    Returns:
+        cramers_v (np.array) : n_programs x n_programs matrix,
+            rounded to 4 decimals, with 1s on the diagonal. Pairs with an
+            empty margin (where chi-squared is undefined) are set to 0.
+    '''
+    totals = totals.astype(np.float64)
+    numerator = np.abs(n * both.astype(np.float64)
+                       - np.outer(totals, totals))
+    spread = totals * (n - totals)
+    denominator = np.sqrt(np.outer(spread, spread))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cramers_v = np.where(denominator > 0, numerator / denominator, 0.0)
+
+    np.fill_diagonal(cramers_v, 1)
+    return cramers_v.round(4)
+
+
+def cramers_v_matrix(membership) -> np.ndarray:
+    '''
+    Function-- cramers_v_matrix
+        Cramer's V coefficient between every pair of programs in a
+        student x program membership matrix.
+
+    Parameters:
+        membership (sparse matrix or np.array) : n_students x n_programs
+            0/1 membership matrix (see membership_matrix())
+
+    Returns:
+        cramers_v (np.array) : n_programs x n_programs matrix
+    '''
+    return cramers_v_from_counts(*cooccurrence_counts(membership))
+
+
+def chi2_test_from_counts(
+    both: int,
+    total_a: int,
+    total_b: int,
+    n: int
+    ) -> tuple[float, float]:
+    '''
+    Function-- chi2_test_from_counts
+        Chi-squared test of independence (no Yates correction, like
+        calculate_cramers_v()) for one program pair, from overlap counts.
+
+    Returns:
+        chi2 (float) : Chi-squared statistic, 0 if a margin is empty
+        pvalue (float) : p-value with 1 degree of freedom, i.e.
+            P(Z^2 > chi2) = erfc(√(chi2 / 2)) for a standard normal Z
+    '''
+    spread = float(total_a) * (n - total_a) * total_b * (n - total_b)
+    if spread == 0:
+        return 0.0, 1.0
+    chi2 = n * (float(n) * both - float(total_a) * total_b) ** 2 / spread
+    return chi2, math.erfc(math.sqrt(chi2 / 2))
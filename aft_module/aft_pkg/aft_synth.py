@@ -0,0 +1,359 @@
+'''
+AFT Data Visualization Tool
+Synthetic Enrollment Data
+'''
+'''-------------------------- Imports & Constants --------------------------'''
+
+# pre-existing python libraries
+import argparse
+import numpy as np
+import pandas as pd
+
+SEASONS = ["Fall", "Winter", "Spring"]
+
+# program catalog: (code, name, season, popularity, cluster, gender, leveled)
+# - programs in the same cluster are co-enrolled (see generate_enrollment())
+# - gender is "Boys"/"Girls" for single-gender teams, "both" for teams
+#   split by the student's gender, or None
+# - leveled programs get a 'Program (Level)' from the student's grade
+PROGRAMS = [
+    ("S", "Soccer", "Fall", 9, "field", "both", True),
+    ("S", "Football", "Fall", 5, "field", "Boys", True),
+    ("S", "Field Hockey", "Fall", 4, "field", "Girls", True),
+    ("S", "Volleyball", "Fall", 3, "court", "Girls", True),
+    ("S", "Cross Country", "Fall", 4, "endurance", "both", False),
+    ("S", "Crew", "Fall", 3, "endurance", "both", True),
+    ("S", "Basketball", "Winter", 7, "court", "both", True),
+    ("S", "Hockey", "Winter", 6, "field", "both", True),
+    ("S", "Squash", "Winter", 3, "racket", "both", True),
+    ("S", "Swimming", "Winter", 4, "endurance", "both", False),
+    ("S", "Wrestling", "Winter", 2, "court", "Boys", False),
+    ("S", "Skiing", "Winter", 3, "endurance", "both", False),
+    ("S", "Lacrosse", "Spring", 7, "field", "both", True),
+    ("S", "Baseball", "Spring", 4, "field", "Boys", True),
+    ("S", "Softball", "Spring", 3, "field", "Girls", True),
+    ("S", "Tennis", "Spring", 4, "racket", "both", True),
+    ("S", "Track", "Spring", 5, "endurance", "both", False),
+    ("S", "Crew", "Spring", 4, "endurance", "both", True),
+    ("S", "Golf", "Spring", 2, "racket", None, False),
+    ("S", "Ultimate", "Spring", 2, "court", None, False),
+    ("A", "Fall Play", "Fall", 4, "stage", None, False),
+    ("A", "Technical Theater", "Fall", 2, "stage", None, False),
+    ("A", "Orchestra", "Fall", 2, "music", None, False),
+    ("A", "Dance", "Fall", 3, "stage", None, False),
+    ("A", "Musical", "Winter", 5, "stage", None, False),
+    ("A", "Jazz Band", "Winter", 2, "music", None, False),
+    ("A", "Chorus", "Winter", 2, "music", None, False),
+    ("A", "Dance", "Winter", 3, "stage", None, False),
+    ("A", "Spring Play", "Spring", 3, "stage", None, False),
+    ("A", "Studio Art", "Spring", 3, "visual", None, False),
+    ("A", "Film", "Spring", 2, "visual", None, False),
+    ("A", "Improv", "Spring", 2, "stage", None, False),
+    ("O", "Debate", "Fall", 2, "academic", None, False),
+    ("O", "Outing Club", "Fall", 2, "outdoor", None, False),
+    ("O", "Robotics", "Winter", 3, "academic", None, False),
+    ("O", "Model UN", "Winter", 2, "academic", None, False),
+    ("O", "Yearbook", "Spring", 2, "visual", None, False),
+    ("O", "Outdoor Leadership", "Spring", 2, "outdoor", None, False),
+    ("C", "Community Service", "Fall", 2, "service", None, False),
+    ("C", "Community Service", "Winter", 2, "service", None, False),
+    ("C", "Community Service", "Spring", 2, "service", None, False),
+    ("SC", "Strength & Conditioning", "Fall", 1, "fitness", None, False),
+    ("SC", "Strength & Conditioning", "Winter", 3, "fitness", None, False),
+    ("SC", "Strength & Conditioning", "Spring", 1, "fitness", None, False),
+    ("IP", "Independent Project", "Fall", 1, "independent", None, False),
+    ("IP", "Independent Project", "Winter", 1, "independent", None, False),
+    ("IP", "Independent Project", "Spring", 1, "independent", None, False),
+    ("TM", "Team Manager", "Fall", 1, "field", None, False),
+    ("TM", "Team Manager", "Winter", 1, "court", None, False),
+    ("TM", "Team Manager", "Spring", 1, "field", None, False),
+    ("E", "Exempt", "Fall", 0.5, "exempt", None, False),
+    ("E", "Exempt", "Winter", 0.5, "exempt", None, False),
+    ("E", "Exempt", "Spring", 0.5, "exempt", None, False),
+    ("L", "Leave", "Fall", 0.2, "away", None, False),
+    ("L", "Leave", "Winter", 0.2, "away", None, False),
+    ("L", "Leave", "Spring", 0.2, "away", None, False),
+    ("SA", "Semester Away", "Fall", 0.3, "away", None, False),
+    ("SA", "Semester Away", "Spring", 0.3, "away", None, False)]
+
+# students: entry grade and how likely each one is
+ENTRY_GRADES = {7: 0.55, 9: 0.35, 10: 0.06, 11: 0.04}
+
+# chance of a Varsity (vs. JV) spot on a leveled team, by grade;
+# middle schoolers (grades 7-8) are always on "Middle School" teams
+VARSITY_SHARE = {9: 0.15, 10: 0.35, 11: 0.6, 12: 0.8}
+
+# students per generated chunk, so memory use doesn't grow with the scale
+CHUNK_STUDENTS = 100_000
+
+# shorthand for the --rows option, e.g. "38k" or "10M"
+SCALE_SUFFIXES = {"k": 10 ** 3, "m": 10 ** 6, "b": 10 ** 9}
+
+'''-------------------------- Generator Functions --------------------------'''
+
+def parse_rows(value: str) -> int:
+    '''
+    Function-- parse_rows
+        number of rows from a count like "38000", "38k", "1M" or "100m"
+    '''
+    value = str(value).strip().lower().replace("_", "")
+    if value[-1:] in SCALE_SUFFIXES:
+        return int(float(value[:-1]) * SCALE_SUFFIXES[value[-1]])
+    return int(value)
+
+
+def _grouped_sampler(groups: np.ndarray, weights: np.ndarray,
+                     n_groups: int):
+    '''
+    Function-- _grouped_sampler
+        Vectorized weighted sampling of an item within a group.
+
+        Items are sorted by group and each group's normalized cumulative
+        weights are shifted by its group number, so group g covers
+        (g, g + 1]; sampling from group g with a uniform u in [0, 1) is a
+        single searchsorted of g + u.
+
+    Returns:
+        sample (callable) : sample(groups, u) -> item per draw
+        has_items (np.array) : whether each group has any items
+    '''
+    order = np.argsort(groups, kind="stable")
+    sorted_groups = groups[order]
+    cumulative = np.cumsum(weights[order], dtype=np.float64)
+    starts = np.searchsorted(sorted_groups, np.arange(n_groups))
+    ends = np.searchsorted(sorted_groups, np.arange(n_groups), side="right")
+    has_items = ends > starts
+
+    before = np.where(starts > 0, cumulative[starts - 1], 0)
+    group_total = cumulative[ends - 1] - before
+    with np.errstate(divide="ignore", invalid="ignore"):
+        keys = sorted_groups + (cumulative - before[sorted_groups]) \
+            / group_total[sorted_groups]
+    keys[ends[has_items] - 1] = np.arange(n_groups)[has_items] + 1
+
+    def sample(draw_groups: np.ndarray, u: np.ndarray) -> np.ndarray:
+        position = np.searchsorted(keys, draw_groups + u, side="right")
+        return order[np.minimum(position, len(order) - 1)]
+    return sample, has_items
+
+
+def _student_chunk(rng: np.random.Generator, n_students: int,
+                   first_person_id: int, years: range) -> pd.DataFrame:
+    '''
+    Function-- _student_chunk
+        Demographics and enrollment years of n_students students.
+
+    Returns:
+        pd.DataFrame : one row per student and year they were at the
+            school within years, ordered by student and year
+    '''
+    entry_grade = rng.choice(list(ENTRY_GRADES), n_students,
+                             p=list(ENTRY_GRADES.values()))
+    full_tenure = 12 - entry_grade + 1
+    # a few students leave before graduating
+    tenure = np.minimum(full_tenure, rng.geometric(0.04, n_students))
+    start_year = rng.integers(years.start - full_tenure + 1, years.stop)
+
+    students = pd.DataFrame({
+        "Person ID": np.arange(n_students) + first_person_id,
+        "Gender code": rng.choice(["M", "F", "N"], n_students,
+                                  p=[0.49, 0.49, 0.02]),
+        "Race/ethnicity": rng.choice(8, n_students,
+            p=[0.08, 0.55, 0.1, 0.1, 0.08, 0.05, 0.02, 0.02]),
+        "FA": rng.choice(3, n_students, p=[0.6, 0.25, 0.15]),
+        "Grad year": start_year + full_tenure})
+
+    # one row per student-year, restricted to the year range
+    student = np.repeat(np.arange(n_students), tenure)
+    year_number = np.arange(len(student)) \
+        - np.repeat(np.cumsum(tenure) - tenure, tenure)
+    student_years = students.iloc[student].reset_index(drop=True).assign(**{
+        "Acad Yr (start)": start_year[student] + year_number,
+        "Grade at Time of Activity": entry_grade[student] + year_number})
+    in_range = student_years["Acad Yr (start)"].between(years.start,
+                                                        years.stop - 1)
+    return student_years[in_range.to_numpy()].reset_index(drop=True)
+
+
+def generate_enrollment(
+    rows: int,
+    seed: int = 0,
+    rows_per_student: float = 7.6,
+    years: range = range(2002, 2024),
+    affinity: float = 0.7,
+    persistence: float = 0.6
+    ):
+    '''
+    Function-- generate_enrollment
+        Seeded synthetic enrollment data in the aft_v3.csv schema (see the
+        README), generated in chunks of CHUNK_STUDENTS students.
+
+        Each student has an entry grade, demographics and a run of
+        consecutive years at the school, with one slot per season and
+        year. Every slot draws a program from that season: with
+        probability affinity from the student's favorite cluster of
+        programs (e.g. field sports, stage arts), otherwise from all of
+        the season's programs, by popularity. With probability
+        persistence a student instead repeats last year's program for
+        that season. Exactly `rows` slots are kept as enrollment rows.
+
+    Parameters:
+        rows (int) : total # of enrollment rows
+        seed (int) : random seed; the same arguments give the same data
+        rows_per_student (float) : average rows per student, which sets
+            the # of students (38000 rows / 5000 students by default)
+        years (range) : academic years covered
+        affinity (float) : co-enrollment strength between programs in the
+            same cluster, from 0 (none) to 1
+        persistence (float) : chance of repeating a program year to year
+
+    Yields:
+        pd.DataFrame : chunks of enrollment rows, ordered by student, year
+            and season
+    '''
+    catalog = pd.DataFrame(PROGRAMS, columns=[
+        "Code", "Program (name)", "Program (Season)", "popularity",
+        "cluster", "gender", "leveled"])
+    season = catalog["Program (Season)"].map(SEASONS.index).to_numpy()
+    cluster_codes, clusters = pd.factorize(catalog["cluster"])
+    popularity = catalog["popularity"].to_numpy(dtype=np.float64)
+
+    by_season, _ = _grouped_sampler(season, popularity, len(SEASONS))
+    by_cluster, cluster_has_items = _grouped_sampler(
+        cluster_codes * len(SEASONS) + season, popularity,
+        len(clusters) * len(SEASONS))
+    cluster_weights = np.bincount(cluster_codes, popularity)
+    cluster_weights /= cluster_weights.sum()
+
+    n_students = max(1, round(rows / rows_per_student))
+    for chunk_number, first in enumerate(range(0, n_students,
+                                               CHUNK_STUDENTS)):
+        rng = np.random.default_rng([seed, chunk_number])
+        chunk_students = min(CHUNK_STUDENTS, n_students - first)
+        chunk_rows = rows * (first + chunk_students) // n_students \
+            - rows * first // n_students
+
+        student_years = _student_chunk(rng, chunk_students,
+                                       100_000 + first, years)
+        favorite = rng.choice(len(clusters), chunk_students,
+                              p=cluster_weights)
+
+        # one slot per student, season and year, ordered by student and
+        # season so each student's years of a season are consecutive
+        slots = np.repeat(np.arange(len(student_years)), len(SEASONS))
+        slot_season = np.tile(np.arange(len(SEASONS)), len(student_years))
+        student = student_years["Person ID"].to_numpy()[slots] \
+            - 100_000 - first
+        order = np.lexsort((slots, slot_season, student))
+        slots, slot_season, student = \
+            slots[order], slot_season[order], student[order]
+
+        # fresh picks: the favorite cluster's programs of that season, or
+        # the whole season when affinity misses or the cluster has none
+        cluster_group = favorite[student] * len(SEASONS) + slot_season
+        use_cluster = (rng.random(len(slots)) < affinity) \
+            & cluster_has_items[cluster_group]
+        u = rng.random(len(slots))
+        program = np.where(use_cluster,
+                           by_cluster(cluster_group, u),
+                           by_season(slot_season, u))
+
+        # repeats: carry the latest fresh pick of the same student & season
+        first_of_run = np.ones(len(slots), dtype=bool)
+        first_of_run[1:] = (student[1:] != student[:-1]) \
+            | (slot_season[1:] != slot_season[:-1])
+        fresh = first_of_run | (rng.random(len(slots)) >= persistence)
+        program = program[np.maximum.accumulate(
+            np.where(fresh, np.arange(len(slots)), 0))]
+
+        enrollment = student_years.iloc[slots].reset_index(drop=True)
+        gender = catalog["gender"].to_numpy()[program]
+        student_gender = np.where(enrollment["Gender code"] == "F",
+                                  "Girls", "Boys")
+
+        # students only join single-gender teams of their own gender
+        eligible = ~np.isin(gender, ["Boys", "Girls"]) \
+            | ((gender == student_gender)
+               & (enrollment["Gender code"] != "N").to_numpy())
+        candidates = np.flatnonzero(eligible)
+        keep_rows = min(chunk_rows, len(candidates))
+        kept = np.sort(candidates[np.argpartition(
+            rng.random(len(candidates)), keep_rows - 1)[:keep_rows]]) \
+            if keep_rows else candidates[:0]
+
+        enrollment, program = enrollment.iloc[kept], program[kept]
+        grade = enrollment["Grade at Time of Activity"].to_numpy()
+        varsity = rng.random(len(kept)) < np.select(
+            [grade == g for g in VARSITY_SHARE], list(VARSITY_SHARE.values()))
+        level = np.where(grade <= 8, "Middle School",
+                         np.where(varsity, "Varsity", "JV"))
+        program_gender = gender[kept]
+        program_gender = np.where(program_gender == "both",
+                                  student_gender[kept], program_gender)
+
+        enrollment = enrollment.assign(**{
+            "Code": catalog["Code"].to_numpy()[program],
+            "Program (name)": catalog["Program (name)"].to_numpy()[program],
+            "Program (Gender)": program_gender,
+            "Program (Level)": np.where(
+                catalog["leveled"].to_numpy()[program], level, None),
+            "Program (Season)": catalog["Program (Season)"]
+                .to_numpy()[program]})
+        enrollment = enrollment.sort_values(
+            ["Person ID", "Acad Yr (start)", "Program (Season)"],
+            key=lambda column: column.map(SEASONS.index)
+                if column.name == "Program (Season)" else column,
+            kind="stable")
+
+        yield enrollment[[
+            "Person ID", "Gender code", "Race/ethnicity", "FA",
+            "Acad Yr (start)", "Code", "Program (name)", "Program (Gender)",
+            "Program (Level)", "Program (Season)",
+            "Grade at Time of Activity", "Grad year"]]\
+            .reset_index(drop=True)
+
+
+def synthetic_enrollment(rows: int, **kwargs) -> pd.DataFrame:
+    '''
+    Function-- synthetic_enrollment
+        all chunks of generate_enrollment() as one pd.DataFrame
+    '''
+    return pd.concat(list(generate_enrollment(rows, **kwargs)),
+                     ignore_index=True)
+
+
+def write_enrollment_csv(path: str, rows: int, **kwargs) -> None:
+    '''
+    Function-- write_enrollment_csv
+        Writes generate_enrollment() to a CSV one chunk at a time, so even
+        the 100M row scale only ever holds one chunk in memory.
+    '''
+    for number, chunk in enumerate(generate_enrollment(rows, **kwargs)):
+        chunk.to_csv(path, mode="w" if number == 0 else "a",
+                     header=number == 0, index=False)
+
+'''----------------------------------- Main --------------------------------'''
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Writes a synthetic enrollment CSV (aft_v3.csv schema)")
+    parser.add_argument("path", nargs="?", default="aft_v3.csv",
+                        help="output CSV (default: aft_v3.csv)")
+    parser.add_argument("--rows", type=parse_rows, default=38_000,
+                        help="# of rows, e.g. 38k, 1M, 10M or 100M")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rows-per-student", type=float, default=7.6)
+    parser.add_argument("--first-year", type=int, default=2002)
+    parser.add_argument("--n-years", type=int, default=22)
+    parser.add_argument("--affinity", type=float, default=0.7,
+                        help="co-enrollment strength within a cluster, 0-1")
+    parser.add_argument("--persistence", type=float, default=0.6,
+                        help="chance of repeating a program year to year")
+    args = parser.parse_args()
+
+    write_enrollment_csv(
+        args.path, args.rows, seed=args.seed,
+        rows_per_student=args.rows_per_student,
+        years=range(args.first_year, args.first_year + args.n_years),
+        affinity=args.affinity, persistence=args.persistence)
@@ -0,0 +1,376 @@
+'''
+AFT Data Visualization Tool
+Student Trajectories
+'''
+'''-------------------------- Imports & Constants --------------------------'''
+
+# pre-existing python libraries
+import threading
+import numpy as np
+import pandas as pd
+
+# our custom-made libraries
+from .aft_filters import FilterSpec
+from .aft_ingest import GRADES
+from .aft_metrics import METRICS
+from .aft_years import YEAR_COLUMN
+
+# order of the seasons within an academic year
+SEASONS = ["Fall", "Winter", "Spring"]
+
+SEASON_COLUMN = "Program (Season)"
+GRADE_COLUMN = "Grade at Time of Activity"
+PROGRAM_COLUMN = "Program (name)"
+
+# columns the sequences are built from
+TRAJECTORY_COLUMNS = ["Person ID", YEAR_COLUMN, SEASON_COLUMN,
+                      GRADE_COLUMN, PROGRAM_COLUMN]
+
+# destination of a transition when the student has no enrollment in the
+# next season
+NOT_ENROLLED = "Not enrolled"
+
+# bits of a (Person ID, program, year or grade) key: Person IDs are
+# positive int32s, program codes fit in 16 bits and years since the first
+# year (or grades) in 8
+STEP_BITS = 8
+PROGRAM_BITS = 16
+
+'''------------------------------ Trajectories -----------------------------'''
+
+class StudentTrajectories:
+    '''
+    Class-- StudentTrajectories
+        Sequence analysis of each student's enrollments: which programs
+        students move to from one season to the next, how many come back
+        to a program the next year, and how many stay in it from one grade
+        through grade 12.
+
+        The rows are sorted once by Person ID, year and season (and, for
+        retention and persistence, once by Person ID, program and year or
+        grade), and every measure is then computed for all students at
+        once by comparing the sorted arrays with themselves shifted by one
+        (a row and the row after it), never with a loop per student.
+        Each structure is built on first use and reused by every query;
+        queries take the same selection as the query backends: a years
+        range and {column: allowed values} filters.
+
+    Attributes:
+        last_year (int) : last year in the data; students can't be seen
+            after it, so later years are left out of retention and
+            persistence instead of counted as leaving
+    '''
+
+    def __init__(self, df: pd.DataFrame):
+        self._df = df
+        self._lock = threading.RLock()
+        self._built = {}
+        self.last_year = int(df[YEAR_COLUMN].max()) if len(df) else 0
+
+    def _get(self, name: str, build):
+        '''returns the named structure, building it on first use'''
+        if name not in self._built:
+            with self._lock:
+                if name not in self._built:
+                    with METRICS.span(f"trajectories.{name}",
+                                      rows=len(self._df)):
+                        self._built[name] = build()
+        return self._built[name]
+
+    def _factorize(self, column: str) -> tuple[np.ndarray, pd.Index]:
+        '''
+        Method-- _factorize
+            integer code of each row's value of column (-1 if missing),
+            and the value of each code
+        '''
+        values = self._df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return (values.cat.codes.to_numpy().astype(np.int64),
+                    values.cat.categories)
+        codes, labels = pd.factorize(values)
+        return codes.astype(np.int64), pd.Index(labels)
+
+    def codes(self, column: str) -> tuple[np.ndarray, pd.Index]:
+        '''_factorize(column), kept for later queries'''
+        return self._get(f"codes.{column}",
+                         lambda: self._factorize(column))
+
+    def _column(self, column: str, rows: np.ndarray = None) -> np.ndarray:
+        values = self._df[column].to_numpy()
+        return values if rows is None else values[rows]
+
+    def _selected(self, rows: np.ndarray, years: list[int] = None,
+                  filters: dict = None) -> np.ndarray:
+        '''positions (in rows) of the rows of the selection'''
+        keep = np.arange(len(rows))
+        for predicate in FilterSpec(filters, years, YEAR_COLUMN).predicates:
+            keep = keep[predicate.mask(self._df[predicate.column],
+                                       rows[keep])]
+        return keep
+
+    '''------------------------------ Sequences ----------------------------'''
+
+    def _sorted(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        Method-- _sorted
+            The one sort: positions of the rows with a known season,
+            ordered by Person ID, then term (year and season), with the
+            Person ID and term of each
+        '''
+        season_codes, seasons = self._factorize(SEASON_COLUMN)
+        # season of each code, -1 for missing or unknown seasons
+        order_of = np.append(pd.Index(SEASONS).get_indexer(seasons), -1)
+        season = order_of[season_codes]
+
+        rows = np.flatnonzero(season >= 0)
+        person = self._column("Person ID", rows).astype(np.int64)
+        term = self._column(YEAR_COLUMN, rows).astype(np.int64) \
+            * len(SEASONS) + season[rows]
+        # one key per (student, term), sorted in one argsort
+        first_term = term.min() if len(term) else 0
+        span = term.max() - first_term + 1 if len(term) else 1
+        order = np.argsort(person * span + (term - first_term))
+        return rows[order], person[order], term[order]
+
+    def _transitions(self) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Method-- _transitions
+            Every (enrollment, same student's enrollment the next season)
+            pair, as row positions; -1 when the student isn't enrolled in
+            anything that season. Seasons after the data ends or after
+            grade 12 are left out.
+        '''
+        rows, person, term = self._sorted()
+        n = len(rows)
+
+        # terms: runs of rows of the same student and season
+        new_term = np.ones(n, dtype=bool)
+        new_term[1:] = (person[1:] != person[:-1]) | (term[1:] != term[:-1])
+        starts = np.flatnonzero(new_term)
+        sizes = np.diff(np.append(starts, n))
+        term_person, term_of = person[starts], term[starts]
+
+        # shifted by one term: the next term is the same student's next
+        # season
+        followed = np.zeros(len(starts), dtype=bool)
+        followed[:-1] = (term_person[1:] == term_person[:-1]) \
+            & (term_of[1:] == term_of[:-1] + 1)
+        # a term can't be followed after the data's last season, or after
+        # the last season of grade 12
+        last_season = (term_of % len(SEASONS)) == len(SEASONS) - 1
+        graduated = last_season \
+            & (self._column(GRADE_COLUMN, rows[starts]) >= max(GRADES))
+        can_follow = ~graduated \
+            & (term_of < (self.last_year + 1) * len(SEASONS) - 1)
+
+        # every row of a term paired with every row of the next: the
+        # pairs of each term are numbered 0..a*b-1, and pair i is row
+        # i // b of the term with row i % b of the next
+        first = np.flatnonzero(followed)
+        a, b = sizes[first], sizes[first + 1]
+        pairs = a * b
+        number = np.arange(pairs.sum()) \
+            - np.repeat(np.cumsum(pairs) - pairs, pairs)
+        b = np.repeat(b, pairs)
+        source = np.repeat(starts[first], pairs) + number // b
+        target = np.repeat(starts[first + 1], pairs) + number % b
+
+        # rows of terms not followed by an enrollment
+        left = np.flatnonzero(
+            (can_follow & ~followed)[np.cumsum(new_term) - 1])
+
+        return (rows[np.concatenate([source, left])],
+                np.concatenate([rows[target],
+                                np.full(len(left), -1, dtype=rows.dtype)]))
+
+    def _spells(self, step_column: str) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Method-- _spells
+            One row per (student, program, year or grade of step_column),
+            sorted once by their (Person ID, program, step) key, so the
+            spells of a student in a program are next to each other in
+            step order. Comparing each key with the next one (a shift)
+            finds where a run of consecutive years (or grades) ends.
+
+        Returns:
+            np.array : row position of each spell
+            np.array : # of consecutive years (or grades) the student
+                stays in the program after each spell (0: not the next)
+        '''
+        program, _ = self.codes(PROGRAM_COLUMN)
+        step = self._column(step_column).astype(np.int64)
+        if len(step):
+            step -= step.min()
+        keys = (self._column("Person ID").astype(np.int64)
+                << (PROGRAM_BITS + STEP_BITS)) \
+            | (program << STEP_BITS) | step
+        order = np.argsort(keys)
+        keys = keys[order]
+
+        # one spell per distinct key
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        rows, keys = order[first], keys[first]
+
+        # runs of spells whose keys go up by one: the same student and
+        # program in consecutive years (or grades)
+        continued = np.zeros(len(keys), dtype=bool)
+        continued[:-1] = keys[1:] == keys[:-1] + 1
+        run_start = np.ones(len(keys), dtype=bool)
+        run_start[1:] = ~continued[:-1]
+        run_end = np.flatnonzero(~continued)
+        last = run_end[np.cumsum(run_start) - 1]
+        return rows, keys[last] - keys
+
+    def _retained(self) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Method-- _retained
+            row position of each (student, program, year) spell that
+            could be followed by the next year (not in grade 12 or the
+            data's last year), and whether it is
+        '''
+        rows, stays = self._spells(YEAR_COLUMN)
+        eligible = (self._column(YEAR_COLUMN, rows) < self.last_year) \
+            & (self._column(GRADE_COLUMN, rows) < max(GRADES))
+        return rows[eligible], stays[eligible] > 0
+
+    def warm(self) -> "StudentTrajectories":
+        '''builds every structure the queries use now instead of on
+        first use (see EnrollmentDataset.warm)'''
+        self._get("transitions", self._transitions)
+        self._get("retention", self._retained)
+        self._get("grade_spells", lambda: self._spells(GRADE_COLUMN))
+        return self
+
+    '''------------------------------- Queries -----------------------------'''
+
+    def transition_counts(self,
+                          years: list[int] = None,
+                          filters: dict = None,
+                          column: str = PROGRAM_COLUMN
+                          ) -> pd.DataFrame:
+        '''
+        Method-- transition_counts
+            Season to season transition matrix: how often an enrollment in
+            the selection (the season it starts from) is followed by each
+            program the next season, or by no enrollment (NOT_ENROLLED).
+            A student in several programs in either season counts once per
+            pair of them.
+
+        Parameters:
+            years (list[int]) : years range of the first season
+            filters (dict) : {column name: allowed values} of the first
+                season's enrollment (e.g. {"Code": ["S"]})
+            column (str) : program column the matrix is over
+
+        Returns:
+            pd.DataFrame : 'From', 'To' and 'count' columns, one row per
+                non-empty transition
+        '''
+        sources, targets = self._get("transitions", self._transitions)
+        keep = self._selected(sources, years, filters)
+        codes, labels = self.codes(column)
+        n = len(labels)
+
+        with METRICS.span("trajectories.transition_counts", rows=len(keep)):
+            source = codes[sources[keep]]
+            targets = targets[keep]
+            target = np.full(len(targets), n, dtype=np.int64)
+            target[targets >= 0] = codes[targets[targets >= 0]]
+            counts = np.bincount(source * (n + 1) + target,
+                                 minlength=n * (n + 1))
+            cells = np.flatnonzero(counts)
+            names = np.append(labels.astype(object), NOT_ENROLLED)
+            return pd.DataFrame({"From": names[cells // (n + 1)],
+                                 "To": names[cells % (n + 1)],
+                                 "count": counts[cells]})
+
+    def retention(self,
+                  by: list[str] = (),
+                  years: list[int] = None,
+                  filters: dict = None
+                  ) -> pd.DataFrame:
+        '''
+        Method-- retention
+            Year to year retention of each program: of the students in it
+            in a year of the selection, the share back in it the next year.
+            Grade 12 students, and the data's last year, are left out.
+
+        Parameters:
+            by (list[str]) : columns to split each program by
+            years (list[int]) : selected years range (of the first year)
+            filters (dict) : {column name: allowed values}
+
+        Returns:
+            pd.DataFrame : 'Program (name)', by columns, 'students',
+                'retained' and 'retention' (retained / students)
+        '''
+        rows, retained = self._get("retention", self._retained)
+        keep = self._selected(rows, years, filters)
+        columns = list(dict.fromkeys([PROGRAM_COLUMN] + list(by)))
+
+        with METRICS.span("trajectories.retention", rows=len(keep)):
+            counts = self._df[columns].take(rows[keep])\
+                .assign(retained=retained[keep])\
+                .groupby(columns, observed=True, dropna=False)["retained"]\
+                .agg(students="size", retained="sum").reset_index()
+            return counts.assign(
+                retention=counts["retained"] / counts["students"])
+
+    def persistence(self,
+                    by: list[str] = (),
+                    start_grade: int = min(GRADES),
+                    years: list[int] = None,
+                    filters: dict = None
+                    ) -> pd.DataFrame:
+        '''
+        Method-- persistence
+            Persistence funnel of each program: of the students in it in
+            start_grade (in a year of the selection), how many are in it
+            in every grade from start_grade through each later grade.
+
+            Grades after the data's last year can't be seen yet, so each
+            grade's share is of the students 'observed' that far.
+
+        Parameters:
+            by (list[str]) : columns to split each program by
+            start_grade (int) : grade the funnel starts from
+            years (list[int]) : years range of the start_grade enrollments
+            filters (dict) : {column name: allowed values}
+
+        Returns:
+            pd.DataFrame : 'Program (name)', by columns, 'grade',
+                'students' (still in the program), 'observed' and
+                'persistence' (students / observed)
+        '''
+        rows, stays = self._get(
+            "grade_spells", lambda: self._spells(GRADE_COLUMN))
+        cohort = np.flatnonzero(
+            self._column(GRADE_COLUMN, rows) == start_grade)
+        cohort = cohort[self._selected(rows[cohort], years, filters)]
+        columns = list(dict.fromkeys([PROGRAM_COLUMN] + list(by)))
+
+        with METRICS.span("trajectories.persistence", rows=len(cohort)):
+            grouped = self._df[columns].take(rows[cohort])\
+                .groupby(columns, observed=True, dropna=False)
+            groups = grouped.size().reset_index()[columns]
+            group = grouped.ngroup().to_numpy()
+            first_year = self._column(YEAR_COLUMN, rows[cohort])
+
+            funnel = []
+            for grade in range(start_grade, max(GRADES) + 1):
+                later = grade - start_grade
+                stayed = stays[cohort] >= later
+                observed = first_year + later <= self.last_year
+                funnel.append(groups.assign(
+                    grade=grade,
+                    students=np.bincount(group, weights=stayed & observed,
+                                         minlength=len(groups)),
+                    observed=np.bincount(group, weights=observed,
+                                         minlength=len(groups))))
+            funnel = pd.concat(funnel, ignore_index=True)
+            funnel = funnel.astype({"students": np.int64,
+                                    "observed": np.int64})
+            return funnel.assign(
+                persistence=funnel["students"]
+                / funnel["observed"].where(funnel["observed"] > 0))
@@ -1,7 +1,44 @@
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
+from unittest import mock
 import numpy as np
+import pandas as pd
 import scipy.stats as stats
 
+from aft_pkg.aft_stats import (cramers_v_matrix,
+                               contingency_table_from_counts,
+                               cooccurrence_counts,
+                               chi2_test_from_counts)
+from aft_pkg.aft_index import build_enrollment_index, load_enrollment_index
+from aft_pkg.aft_cube import CountCube
+from aft_pkg.aft_sketch import (SKETCH_PRECISION, StudentSketches,
+                                distinct_counts)
+from aft_pkg.aft_trajectory import (SEASONS, NOT_ENROLLED,
+                                    StudentTrajectories)
+from aft_pkg.aft_years import build_year_prefix_sums, build_year_spans
+from aft_pkg.aft_cache import (FigureCache, estimated_bytes, normalize,
+                               payload_bytes)
+from aft_pkg.aft_data_org import (SCHEMA, load_enrollment_data,
+                                  read_enrollment_csv, DatasetHandle,
+                                  EnrollmentDataset, FULL_NAME_COLUMNS)
+from aft_pkg.aft_backend import (PandasBackend, DuckDBBackend, duckdb,
+                                 STUDENT_YEAR_COLUMNS)
+from aft_pkg.aft_columnar import content_hash
+from aft_pkg.aft_filters import ColumnStats, FilterSpec
+from aft_pkg.aft_results import ResultStore
+from aft_pkg.aft_synth import (synthetic_enrollment, parse_rows,
+                               write_enrollment_csv)
+from aft_pkg.aft_benchmark import measure, compare
+from aft_pkg.aft_ingest import (CODE_LABELS, read_validated_csv,
+                                quarantine_path)
+from aft_pkg.aft_metrics import Metrics
+
 def calculate_cramers_v(contingency_table):
     '''
     Function-- calculate_cramers_v
@@ -83,6 +120,783 @@ class TestFunctions(unittest.TestCase):
         expected2 = 0.1775
         self.assertEqual(cramers_v2, expected2)
 
+    def test_cramers_v_matrix(self):
+        # the vectorized all-pairs engine should match
+        # calculate_cramers_v on every 2x2 table, to 4 decimals
+        rng = np.random.default_rng(5010)
+        membership = rng.random((300, 25)) < rng.random(25) * 0.4
+
+        matrix = cramers_v_matrix(membership.astype(np.int64))
+        both, totals, n = cooccurrence_counts(membership.astype(np.int64))
+
+        for i in range(25):
+            self.assertEqual(matrix[i, i], 1)
+            for j in range(i + 1, 25):
+                table = contingency_table_from_counts(
+                    both[i, j], totals[i], totals[j], n)
+                self.assertEqual(matrix[i, j], calculate_cramers_v(table))
+                self.assertEqual(matrix[j, i], matrix[i, j])
+
+                # and the heatmap drill-down's test statistics
+                # should match scipy's
+                chi2, pvalue = chi2_test_from_counts(
+                    both[i, j], totals[i], totals[j], n)
+                expected = stats.chi2_contingency(table, correction=False)
+                self.assertAlmostEqual(chi2, expected[0])
+                self.assertAlmostEqual(pvalue, expected[1])
+
+    def test_enrollment_index_query(self):
+        # "enrolled in A and B but not C during 2010-2015"
+        # should match the same query done with python sets
+        rng = np.random.default_rng(5010)
+        n = 2000
+        df = pd.DataFrame({
+            "Person ID": rng.integers(0, 300, n),
+            "Program (name)": rng.choice(list("ABCD"), n),
+            "Acad Yr (start)": rng.integers(2005, 2020, n)})
+        index = build_enrollment_index(
+            df, key_columns=["Program (name)", "Acad Yr (start)"])
+
+        during = df[df["Acad Yr (start)"].between(2010, 2015)]
+        def ids(program):
+            return set(during[during["Program (name)"] == program]
+                       ["Person ID"])
+        expected = (ids("A") & ids("B")) - ids("C")
+
+        bitset = index.query(all_of=["A", "B"], none_of=["C"],
+                             filters={"Acad Yr (start)": range(2010, 2016)})
+        self.assertEqual(index.count(bitset), len(expected))
+        self.assertEqual(set(index.decode(bitset)), expected)
+
+    def test_enrollment_index_saved(self):
+        # the saved index loads back without pickling or a rebuild
+        with tempfile.TemporaryDirectory() as folder:
+            csv_path = os.path.join(folder, "aft_v3.csv")
+            write_enrollment_csv(csv_path, 1000, seed=1)
+            df = read_enrollment_csv(csv_path)
+            built = load_enrollment_index(csv_path, df)
+
+            with mock.patch("aft_pkg.aft_index.build_enrollment_index",
+                            side_effect=AssertionError("rebuilt")):
+                loaded = load_enrollment_index(csv_path, df)
+            pd.testing.assert_frame_equal(
+                loaded.keys.astype(str), built.keys.astype(str))
+            self.assertEqual((loaded.matrix != built.matrix).nnz, 0)
+            filters = {"Acad Yr (start)": range(2010, 2016),
+                       "Grade at Time of Activity": [9, 10]}
+            self.assertEqual(
+                set(loaded.decode(loaded.students(filters))),
+                set(built.decode(built.students(filters))))
+
+    def test_count_cube(self):
+        # counts served from the cube should match counting the raw rows
+        rng = np.random.default_rng(5010)
+        n = 2000
+        df = pd.DataFrame({
+            "Program (name)": rng.choice(list("ABCD"), n),
+            "Acad Yr (start)": rng.integers(2005, 2020, n),
+            "Grade at Time of Activity": rng.integers(7, 13, n),
+            "FA": rng.integers(0, 3, n)})
+        cube = CountCube(df)
+
+        counts = cube.counts(by=["Program (name)", "FA"],
+                             programs=["A", "C"],
+                             years=range(2010, 2016),
+                             grades=[9, 10, 11, 12])
+        rows = df[df["Program (name)"].isin(["A", "C"])
+                  & df["Acad Yr (start)"].between(2010, 2015)
+                  & (df["Grade at Time of Activity"] >= 9)]
+        expected = rows.value_counts(["Program (name)", "FA"])
+
+        self.assertEqual(
+            counts.set_index(["Program (name)", "FA"])["count"].to_dict(),
+            expected.to_dict())
+
+    def test_student_sketches(self):
+        # merged sketches should estimate each group's different students
+        # within a few standard errors (exact below ~2.5 x registers is
+        # linear counting), appended rows should merge into them, and the
+        # integer-coded exact count should match nunique
+        rng = np.random.default_rng(5010)
+        n = 60000
+        df = pd.DataFrame({
+            "Person ID": rng.integers(1, 20000, n),
+            "Program (name)": rng.choice(list("ABCD"), n),
+            "Acad Yr (start)": rng.integers(2005, 2020, n),
+            "Grade at Time of Activity": rng.integers(7, 13, n),
+            "FA": rng.integers(0, 3, n)})
+        head, tail = df[:50000], df[50000:].reset_index(drop=True)
+        sketches = StudentSketches(head)
+        sketches.sketch(["FA"])
+        sketches = sketches.appended(df, tail)
+
+        years = [2008, 2016]
+        rows = df[df["Acad Yr (start)"].between(*years)
+                  & df["FA"].isin([0, 1])]
+        expected = rows.groupby("Program (name)")["Person ID"].nunique()
+        estimated = sketches.students(["Program (name)"], years,
+                                      {"FA": [0, 1]})\
+            .set_index("Program (name)")["students"]
+        error = 1.04 / np.sqrt(1 << SKETCH_PRECISION)
+        np.testing.assert_allclose(estimated[expected.index], expected,
+                                   rtol=4 * error)
+
+        codes = rows["Program (name)"].map({"A": 0, "B": 1, "C": 2, "D": 3})
+        self.assertEqual(
+            list(distinct_counts(codes.to_numpy(),
+                                 rows["Person ID"].to_numpy(), 4)),
+            list(expected))
+
+    def test_student_trajectories(self):
+        # transitions, retention and persistence computed with shifts
+        # should match following each student's enrollments in python
+        df = synthetic_enrollment(3000, seed=8)
+        trajectories = StudentTrajectories(df)
+        last_year = int(df["Acad Yr (start)"].max())
+        programs = set(zip(df["Person ID"], df["Program (name)"],
+                           df["Acad Yr (start)"]))
+        by_grade = set(zip(df["Person ID"], df["Program (name)"],
+                           df["Grade at Time of Activity"]))
+
+        term = df["Acad Yr (start)"] * 3 \
+            + df["Program (Season)"].map(SEASONS.index)
+        next_term = {}
+        for person, t, program in zip(df["Person ID"], term,
+                                      df["Program (name)"]):
+            next_term.setdefault((person, t), []).append(program)
+        expected = {}
+        for person, t, program, grade in zip(
+                df["Person ID"], term, df["Program (name)"],
+                df["Grade at Time of Activity"]):
+            following = next_term.get((person, t + 1))
+            if following is None and (t >= last_year * 3 + 2
+                                      or (grade == 12 and t % 3 == 2)):
+                continue
+            for target in following or [NOT_ENROLLED]:
+                expected[program, target] = \
+                    expected.get((program, target), 0) + 1
+        transitions = trajectories.transition_counts()
+        self.assertEqual(
+            dict(zip(zip(transitions["From"], transitions["To"]),
+                     transitions["count"])),
+            expected)
+
+        retention = trajectories.retention(years=[2005, 2015])
+        spells = df[df["Acad Yr (start)"].between(2005, 2015)
+                    & (df["Grade at Time of Activity"] < 12)]\
+            .drop_duplicates(["Person ID", "Program (name)",
+                              "Acad Yr (start)"])
+        back = [(p, g, y + 1) in programs for p, g, y in zip(
+            spells["Person ID"], spells["Program (name)"],
+            spells["Acad Yr (start)"])]
+        self.assertEqual(retention["students"].sum(), len(spells))
+        self.assertEqual(retention["retained"].sum(), sum(back))
+
+        funnel = trajectories.persistence(start_grade=9)\
+            .groupby("grade")["students"].sum()
+        cohort = df[df["Grade at Time of Activity"] == 9]\
+            .drop_duplicates(["Person ID", "Program (name)"])
+        for grade in range(9, 13):
+            stayed = [all((p, g, k) in by_grade for k in range(9, grade + 1))
+                      and y + grade - 9 <= last_year
+                      for p, g, y in zip(cohort["Person ID"],
+                                         cohort["Program (name)"],
+                                         cohort["Acad Yr (start)"])]
+            self.assertEqual(funnel[grade], sum(stayed))
+
+    def test_treemap_figure(self):
+        # the sectors built from the counts should be the ones
+        # plotly.express derives from the same path
+        import plotly.express as px
+        from aft_pkg.aft_plot_functions import treemap_figure
+        rng = np.random.default_rng(5010)
+        top_ten = pd.DataFrame({
+            "Gender code": rng.choice(["F", "M"], 200),
+            "FA": rng.integers(0, 3, 200),
+            "Program (name)": rng.choice(list("ABCDEFGH"), 200)})\
+            .drop_duplicates(ignore_index=True)
+        top_ten["Total"] = rng.integers(1, 100, len(top_ten))
+        path = ["Gender code", "FA"]
+
+        expected = px.treemap(top_ten, path=path + ["Program (name)"],
+                              values="Total").data[0]
+        built = treemap_figure(top_ten, path).data[0]
+        self.assertEqual(
+            dict(zip(built.ids, zip(built.parents, built.values))),
+            dict(zip(expected.ids, zip(expected.parents, expected.values))))
+
+    def test_year_prefix_sums(self):
+        # any year range should give the same totals as filtering rows,
+        # including ranges that run past either end of the data
+        rng = np.random.default_rng(5010)
+        n = 2000
+        df = pd.DataFrame({
+            "Program (name)": rng.choice(list("ABCD"), n),
+            "Acad Yr (start)": rng.integers(2005, 2020, n)})
+        year_sums = build_year_prefix_sums(df, ["Program (name)"])
+
+        for start, end in [(2005, 2019), (2010, 2012), (2013, 2013),
+                           (1990, 2007), (2018, 2030), (2030, 2040)]:
+            totals = year_sums.between(start, end)
+            rows = df[df["Acad Yr (start)"].between(start, end)]
+            expected = rows["Program (name)"].value_counts()
+            for program, total in zip(year_sums.cells["Program (name)"],
+                                      totals):
+                self.assertEqual(total, expected.get(program, 0))
+
+    def test_year_spans(self):
+        # runs of consecutive years (with gaps, and rows appended later)
+        # should select the same cells as filtering rows
+        rng = np.random.default_rng(5010)
+        n = 3000
+        df = pd.DataFrame({
+            "Program (name)": rng.choice(list("ABCD"), n),
+            "Person ID": rng.integers(0, 200, n),
+            "Acad Yr (start)": rng.choice([2005, 2006, 2007, 2010, 2012,
+                                           2013], n)})
+        cells = ["Program (name)", "Person ID"]
+        spans = build_year_spans(df[:2000], cells).appended(df[2000:])
+        self.assertEqual(len(spans.cells),
+                         len(build_year_spans(df, cells).cells))
+
+        for years, filters in [([2005, 2013], {}),
+                               ([2008, 2009], {}),
+                               ([2011, 2011], {"Program (name)": ["B"]}),
+                               ([2006, 2010], {"Program (name)": ["A", "D"],
+                                               "Person ID": range(50)})]:
+            rows = FilterSpec(filters, years).apply(df)
+            selected = spans.cells.take(spans.select(years, filters))
+            self.assertEqual(
+                set(zip(*[selected[c] for c in cells])),
+                set(zip(*[rows[c] for c in cells])))
+
+    def test_figure_cache(self):
+        # normalized keys, LRU eviction and dataset version invalidation
+        version = ["v1"]
+        cache = FigureCache(max_entries=2, version=lambda: version[0])
+        calls = []
+
+        @cache.memoize(unordered=("programs",))
+        def figure(programs, years):
+            calls.append(programs)
+            return {"programs": sorted(programs), "years": years}
+
+        figure(["B", "A"], [2010, 2015])
+        figure(["A", "B", "A"], [2010, 2015])   # same selection: hit
+        self.assertEqual(len(calls), 1)
+
+        figure(["C"], [2010, 2015])
+        figure(["D"], [2010, 2015])             # evicts ["A", "B"]
+        figure(["A", "B"], [2010, 2015])
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(cache.evictions, 2)
+
+        version[0] = "v2"                       # new data: recompute
+        figure(["A", "B"], [2010, 2015])
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+        # numpy scalars and arrays are keyed like the python values
+        self.assertEqual(normalize(np.int64(2010)), 2010)
+        figure(["A", "B"], np.array([np.int64(2010), np.int64(2015)]))
+        self.assertEqual(len(calls), 5)
+
+        # sizes are estimated without serializing, but stay close
+        import plotly.graph_objects as go
+        bars = go.Figure(go.Bar(x=[f"program {i}" for i in range(500)],
+                                y=np.arange(500)))
+        self.assertLess(abs(estimated_bytes(bars) / payload_bytes(bars) - 1),
+                        0.5)
+
+    def test_synthetic_enrollment(self):
+        # seeded, exact row count, the CSV schema and every program code
+        df = synthetic_enrollment(3000, seed=7)
+        self.assertTrue(df.equals(synthetic_enrollment(3000, seed=7)))
+        self.assertFalse(df.equals(synthetic_enrollment(3000, seed=8)))
+        self.assertEqual(len(df), 3000)
+        self.assertEqual(list(df.columns), list(SCHEMA))
+        self.assertEqual(df["Code"].nunique(), 10)
+        self.assertTrue(df["Grade at Time of Activity"].between(7, 12).all())
+        self.assertEqual(parse_rows("38k"), 38_000)
+        self.assertEqual(parse_rows("1M"), 1_000_000)
+
+        # single-gender teams only have students of that gender
+        girls_teams = df[df["Program (Gender)"] == "Girls"]
+        self.assertTrue((girls_teams["Gender code"] == "F").all())
+
+    def test_benchmark_measure(self):
+        # wall time, peak memory and JSON size, compared between runs
+        import plotly.graph_objects as go
+        result = measure(lambda: go.Figure(go.Bar(y=np.arange(10000))),
+                         repeat=2)
+        self.assertGreater(result["warm_s"], 0)
+        self.assertGreater(result["peak_mb"], 0)
+        self.assertGreater(result["json_bytes"], 10000)
+        self.assertIsNone(measure(lambda: 1, repeat=1)["json_bytes"])
+
+        def run(warm_s):
+            return {"results": [{"scale": "38k", "function": "treemap",
+                                 "params": {"years": 5}, "warm_s": warm_s,
+                                 "peak_mb": 1.0}]}
+        self.assertEqual(compare(run(2.0), run(0.5))["speedup"].tolist(),
+                         [4.0])
+
+    def test_metrics_spans(self):
+        # latency percentiles, rows, failures and the rotating log
+        with tempfile.TemporaryDirectory() as folder:
+            log_path = os.path.join(folder, "metrics.log")
+            metrics = Metrics(log_path)
+
+            @metrics.timed()
+            def callback(rows):
+                with metrics.span("stage", rows=rows):
+                    if rows < 0:
+                        raise ValueError(rows)
+
+            for rows in range(100):
+                callback(rows)
+            with self.assertRaises(ValueError):
+                callback(-1)
+
+            snapshot = metrics.snapshot()
+            self.assertEqual(snapshot["callback"]["count"], 101)
+            self.assertEqual(snapshot["callback"]["errors"], 1)
+            self.assertEqual(snapshot["stage"]["rows"], sum(range(100)) - 1)
+            self.assertLessEqual(snapshot["stage"]["p50_ms"],
+                                 snapshot["stage"]["p99_ms"])
+            for handler in metrics.logger.handlers:
+                handler.close()
+            with open(log_path) as log:
+                self.assertEqual(len(log.readlines()), 202)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "needs fork")
+    def test_metrics_shared(self):
+        # spans of forked processes (e.g. background jobs) are combined
+        # with the parent's, each counted once
+        import multiprocessing
+        with tempfile.TemporaryDirectory() as folder:
+            metrics = Metrics(folder=folder)
+            for _ in range(3):
+                with metrics.span("callback"):
+                    pass
+
+            def job():
+                with metrics.span("callback"):
+                    pass
+                with metrics.span("job.stage", rows=10):
+                    pass
+                metrics.flush(final=True)
+
+            for _ in range(2):
+                child = multiprocessing.get_context("fork")\
+                    .Process(target=job)
+                child.start()
+                child.join()
+                self.assertEqual(child.exitcode, 0)
+
+            combined = metrics.combined()
+            self.assertEqual(combined["callback"]["count"], 5)
+            self.assertEqual(combined["job.stage"]["rows"], 20)
+            self.assertEqual(metrics.snapshot()["callback"]["count"], 3)
+            self.assertEqual(sorted(name for name in os.listdir(folder)
+                                    if name.endswith(".json")),
+                             sorted([f"{os.getpid()}.json", "archive.json"]))
+
+            # request threads flushing at once each write a whole file
+            def flush_often():
+                for _ in range(50):
+                    metrics.flush()
+            threads = [threading.Thread(target=flush_often)
+                       for _ in range(8)]
+            with self.assertNoLogs("aft_pkg.aft_metrics"):
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            with open(os.path.join(folder, f"{os.getpid()}.json")) as file:
+                self.assertEqual(json.load(file)["callback"]["count"], 3)
+            self.assertFalse([name for name in os.listdir(folder)
+                              if name.endswith(".tmp")])
+
+    def test_columnar_cache_is_mapped(self):
+        # the cached load equals a CSV parse, without copying any column
+        with tempfile.TemporaryDirectory() as folder:
+            csv_path = os.path.join(folder, "aft_v3.csv")
+            write_enrollment_csv(csv_path, 2000, seed=1)
+            parsed = load_enrollment_data(csv_path)     # writes the cache
+            mapped = load_enrollment_data(csv_path)
+
+            pd.testing.assert_frame_equal(mapped, read_enrollment_csv(csv_path))
+            for name in mapped.columns:
+                values = mapped[name].array
+                values = values.codes if hasattr(values, "codes") \
+                    else mapped[name].to_numpy()
+                self.assertFalse(values.flags.owndata, name)
+                self.assertFalse(values.flags.writeable, name)
+
+            # the content hash is the one the cache was written with,
+            # without reading the CSV again
+            expected = content_hash(csv_path)
+            with mock.patch("aft_pkg.aft_data_org.content_hash",
+                            side_effect=AssertionError("hashed")):
+                self.assertEqual(EnrollmentDataset(csv_path).content_hash,
+                                 expected)
+            del parsed, mapped, values
+
+    def test_dataset_snapshots(self):
+        # read-only snapshots, swapped only when the CSV changes
+        with tempfile.TemporaryDirectory() as folder:
+            csv_path = os.path.join(folder, "aft_v3.csv")
+            write_enrollment_csv(csv_path, 1000, seed=1)
+            handle = DatasetHandle(csv_path)
+            first = handle.current()
+            self.assertEqual(len(first.data), 1000)
+            self.assertFalse(handle.refresh())
+            with self.assertRaises(ValueError):
+                first.data.loc[0, "FA"] = 2
+
+            write_enrollment_csv(csv_path, 1500, seed=2)
+            self.assertTrue(handle.refresh())
+            second = handle.current()
+            self.assertIsNot(first, second)
+            self.assertNotEqual(first.cache_key(), second.cache_key())
+            # callbacks still holding the old snapshot keep its data
+            self.assertEqual(len(first.data), 1000)
+            self.assertEqual(len(second.data), 1500)
+            del first, second, handle
+
+    def test_dataset_append(self):
+        # appended rows update the built structures like a full rebuild
+        with tempfile.TemporaryDirectory() as folder:
+            csv_path = os.path.join(folder, "aft_v3.csv")
+            write_enrollment_csv(csv_path, 1000, seed=1)
+            handle = DatasetHandle(csv_path)
+            first = handle.current()
+            first.index, first.student_years, first.program_list
+            first.cube.counts(["Gender code"], years=[2005, 2010])
+            first.trajectories.warm()
+
+            rows = synthetic_enrollment(300, seed=2)
+            rows.loc[rows.index[:3], "Grad year"] += \
+                2024 - rows.loc[rows.index[:3], "Acad Yr (start)"]
+            rows.loc[rows.index[:3], "Acad Yr (start)"] = 2024
+            rows.loc[rows.index[:3], "Program (name)"] = "New Program"
+            text = rows.to_csv(index=False, header=False)
+            with open(csv_path, "a") as file:
+                file.write(text[:-10])
+            self.assertTrue(handle.refresh())
+            with open(csv_path, "a") as file:
+                file.write(text[-10:])
+            self.assertTrue(handle.refresh())
+            self.assertFalse(handle.refresh())
+
+            appended, full = handle.current(), EnrollmentDataset(csv_path)
+            self.assertEqual(appended.version, full.version)
+            self.assertEqual(len(appended.data), 1300)
+            self.assertEqual(appended.years, full.years)
+            self.assertEqual(appended.program_list, full.program_list)
+            by = ["Program (name)", "Gender code"]
+            for years in ([2002, 2024], [2005, 2010], [2024, 2024]):
+                pd.testing.assert_frame_equal(
+                    appended.cube.counts(by, years=years).astype(object)
+                        .sort_values(by, ignore_index=True),
+                    full.cube.counts(by, years=years).astype(object)
+                        .sort_values(by, ignore_index=True))
+                pd.testing.assert_frame_equal(
+                    *[dataset.student_years.cells.take(
+                        dataset.student_years.select(years)).astype(str)
+                      .sort_values(STUDENT_YEAR_COLUMNS, ignore_index=True)
+                      for dataset in (appended, full)])
+            for filters in ({}, {"Program (name)": ["New Program"]}):
+                self.assertEqual(
+                    set(appended.index.decode(appended.index.students(filters))),
+                    set(full.index.decode(full.index.students(filters))))
+
+            # the trajectories were already built before the swap
+            self.assertEqual(sorted(appended.trajectories._built),
+                             sorted(first.trajectories._built))
+            pd.testing.assert_frame_equal(
+                *[dataset.trajectories.transition_counts()
+                  .sort_values(["From", "To"], ignore_index=True)
+                  for dataset in (appended, full)])
+
+            # anything but an append reloads the whole file
+            write_enrollment_csv(csv_path, 500, seed=3)
+            self.assertTrue(handle.refresh())
+            self.assertEqual(len(handle.current().data), 500)
+            del first, appended, full, handle
+
+    def test_code_labels(self):
+        # each code keeps its own label when codes are missing from the
+        # data or appear only in appended rows
+        with tempfile.TemporaryDirectory() as folder:
+            csv_path = os.path.join(folder, "aft_v3.csv")
+            df = synthetic_enrollment(500, seed=3)
+            df = df[~df["Code"].isin(["A", "IP"])]
+            df.to_csv(csv_path, index=False)
+            handle = DatasetHandle(csv_path)
+            present = sorted(df["Code"].unique())
+            self.assertEqual(handle.current().codes,
+                             {code: CODE_LABELS[code] for code in present})
+
+            rows = synthetic_enrollment(500, seed=4)
+            rows[rows["Code"] == "A"].to_csv(csv_path, mode="a",
+                                             index=False, header=False)
+            self.assertTrue(handle.refresh())
+            self.assertEqual(handle.current().codes["A"], "Arts (A)")
+            self.assertEqual(handle.current().codes["S"], "Sports (S)")
+            self.assertNotIn("IP", handle.current().codes)
+
+    def test_validated_ingestion(self):
+        # invalid rows are left out and quarantined with their reasons
+        with tempfile.TemporaryDirectory() as folder:
+            csv_path = os.path.join(folder, "aft_v3.csv")
+            df = synthetic_enrollment(2000, seed=4)
+            df.to_csv(csv_path, index=False)
+            expected = pd.read_csv(csv_path, dtype=SCHEMA)
+            pd.testing.assert_frame_equal(
+                read_validated_csv(csv_path, SCHEMA, chunk_rows=300),
+                expected)
+
+            df = df.astype({"Grade at Time of Activity": float, "FA": object})
+            df.loc[3, "Grade at Time of Activity"] = None
+            df.loc[7, "FA"] = 5
+            df.loc[8, "Code"] = "ZZ"
+            df.to_csv(csv_path, index=False)
+            quarantine = quarantine_path(csv_path)
+            valid = read_validated_csv(csv_path, SCHEMA, quarantine,
+                                       chunk_rows=300)
+            self.assertEqual(len(valid), 1997)
+            rejected = pd.read_csv(quarantine)
+            self.assertEqual(list(rejected["Line"]), [5, 9, 10])
+            self.assertEqual(list(rejected["Reason"]), [
+                "Grade at Time of Activity is not 7-12",
+                "FA is not 0, 1 or 2",
+                "Code is not a known program code"])
+
+            # text in a number column only rejects its own row
+            df.loc[7, "FA"] = "unknown"
+            df.to_csv(csv_path, index=False)
+            valid = read_validated_csv(csv_path, SCHEMA, quarantine,
+                                       chunk_rows=300)
+            self.assertEqual(len(valid), 1997)
+            self.assertEqual(len(pd.read_csv(quarantine)), 3)
+            pd.testing.assert_frame_equal(
+                valid, expected.drop([3, 7, 8]).reset_index(drop=True))
+
+    def test_filter_plan(self):
+        # one planned selection should keep the same rows as chained
+        # filters, running the most selective filter first
+        df = synthetic_enrollment(5000, seed=7).astype(
+            {"Code": "category", "Gender code": "category"})
+        stats = ColumnStats(df)
+        spec = FilterSpec({"Code": ["S", "A"], "Gender code": ["F"],
+                           "Grade at Time of Activity": [12]},
+                          years=[2005, 2015])
+        chained = df[df["Code"].isin(["S", "A"])]
+        chained = chained[chained["Gender code"] == "F"]
+        chained = chained[chained["Acad Yr (start)"].between(2005, 2015)]
+        chained = chained[chained["Grade at Time of Activity"] == 12]
+
+        pd.testing.assert_frame_equal(
+            spec.apply(df, stats), chained.reset_index(drop=True))
+        rows, counts = spec.select(df, stats)
+        self.assertEqual(list(rows), list(chained.index))
+        self.assertEqual(counts[-1][1], len(chained))
+        estimated = [stats.selectivity(p) for p in spec.plan(stats)]
+        self.assertEqual(estimated, sorted(estimated))
+        self.assertAlmostEqual(
+            stats.selectivity(spec.predicates[0]),
+            df["Acad Yr (start)"].between(2005, 2015).mean())
+
+    def test_result_store(self):
+        # results are found again by another store on the same folder
+        # (e.g. another worker, or after a restart), for a copy of the
+        # same data, but not for other data
+        with tempfile.TemporaryDirectory() as folder:
+            csv_path = os.path.join(folder, "aft_v3.csv")
+            copy_path = os.path.join(folder, "copy.csv")
+            write_enrollment_csv(csv_path, 500, seed=8)
+            with open(csv_path) as source, open(copy_path, "w") as copy:
+                copy.write(source.read())
+            results = os.path.join(folder, "results")
+            calls = []
+
+            def count_rows(codes, dataset):
+                calls.append(codes)
+                return int(dataset.data["Code"].isin(codes).sum())
+
+            first = ResultStore(results).memoize(
+                unordered=("codes",))(count_rows)
+            second = ResultStore(results).memoize(
+                unordered=("codes",))(count_rows)
+            dataset = EnrollmentDataset(csv_path)
+            expected = first(["S", "A"], dataset)
+            self.assertEqual(second(["A", "S", "A"], dataset), expected)
+            self.assertEqual(second(["A", "S"], EnrollmentDataset(copy_path)),
+                             expected)
+            self.assertEqual(len(calls), 1)
+
+            write_enrollment_csv(copy_path, 400, seed=9)
+            second(["S", "A"], EnrollmentDataset(copy_path))
+            self.assertEqual(len(calls), 2)
+
+            # the least recently used results go past the size limit
+            store = ResultStore(results, max_bytes=1)
+            self.assertEqual(store.get("big", lambda: "x" * 100), "x" * 100)
+            self.assertEqual(store.evictions, 3)
+            self.assertEqual(os.listdir(results), [])
+
+            # a result planted in a folder others can write to isn't read
+            with open(store._path("planted"), "wb") as file:
+                pickle.dump("planted", file)
+            self.assertEqual(ResultStore(results).get(
+                "planted", lambda: "computed"), "planted")
+            os.chmod(results, 0o777)
+            shared = ResultStore(results)
+            self.assertFalse(shared.private)
+            self.assertEqual(shared.get("planted", lambda: "computed"),
+                             "computed")
+            del dataset
+
+    def test_query_backends(self):
+        # every backend should answer the same queries as counting the
+        # loaded rows directly (duckdb only if it is installed)
+        with tempfile.TemporaryDirectory() as folder:
+            csv_path = os.path.join(folder, "aft_v3.csv")
+            write_enrollment_csv(csv_path, 3000, seed=6)
+            dataset = EnrollmentDataset(csv_path)
+            df = dataset.data
+            backends = {"pandas": PandasBackend(dataset)}
+            if duckdb is not None:
+                backends["duckdb"] = DuckDBBackend(csv_path,
+                                                   FULL_NAME_COLUMNS)
+
+            years = [2005, 2012]
+            filters = {"Code": ["S", "A"],
+                       "Grade at Time of Activity": [9, 10, 11, 12]}
+            selected = df[df["Acad Yr (start)"].between(*years)
+                          & df["Code"].isin(filters["Code"])
+                          & df["Grade at Time of Activity"].isin(
+                              filters["Grade at Time of Activity"])]
+
+            def table(result, columns):
+                # same rows, whatever the backend's dtypes and row order
+                return result[columns].astype(str)\
+                    .sort_values(columns, ignore_index=True)
+
+            by = ["Program (name)", "Gender code"]
+            expected_counts = selected.groupby(by, observed=True).size()\
+                .rename("count").reset_index()
+            top = selected["Full name"].value_counts()
+            top = top.reset_index().assign(name=top.index.astype(str))\
+                .sort_values(["count", "name"], ascending=[False, True])
+            expected_students = selected.groupby("FA")["Person ID"]\
+                .nunique().rename("students").reset_index()
+            expected_pairs = selected[["Person ID", "Full name"]]\
+                .drop_duplicates()
+
+            for name, backend in backends.items():
+                with self.subTest(backend=name):
+                    pd.testing.assert_frame_equal(
+                        table(backend.group_count(by, years, filters),
+                              by + ["count"]),
+                        table(expected_counts, by + ["count"]))
+                    top_k = backend.top_k("Full name", 5, years, filters)
+                    self.assertEqual(list(top_k["Full name"].astype(str)),
+                                     list(top["name"][:5]))
+                    self.assertEqual(list(top_k["count"]),
+                                     list(top["count"][:5]))
+                    pd.testing.assert_frame_equal(
+                        table(backend.distinct_students(["FA"], years,
+                                                        filters),
+                              ["FA", "students"]),
+                        table(expected_students, ["FA", "students"]))
+                    pd.testing.assert_frame_equal(
+                        table(backend.filter(["Person ID", "Full name"],
+                                             years, filters, distinct=True),
+                              ["Person ID", "Full name"]),
+                        table(expected_pairs, ["Person ID", "Full name"]))
+                    self.assertEqual(
+                        len(backend.filter(["Person ID"], years, filters)),
+                        len(selected))
+            del dataset, df, selected
+
+    def test_heatmap_selection_only_in_job(self):
+        # with background jobs, the heatmap selection (years, codes,
+        # grades, n) only triggers the heatmap job: no callback answered
+        # in the web worker recomputes the counts when it changes
+        script = (
+            "import aft_dashboard\n"
+            "callbacks = aft_dashboard.app.callback_map.items()\n"
+            "if aft_dashboard.BACKGROUND is None:\n"
+            "    callbacks = [('skip', {})]\n"
+            "for output, callback in callbacks:\n"
+            "    ids = [d['id'] for d in callback.get('inputs', [])]\n"
+            "    if output == 'skip' or 'callback' in callback and "
+            "'correlation-heatmap-program-codes' in ids:\n"
+            "        print(output, bool(callback.get('background')))\n")
+        module_root = os.path.dirname(
+            os.path.dirname(os.path.abspath(__file__)))
+
+        with tempfile.TemporaryDirectory() as folder:
+            result = subprocess.run(
+                [sys.executable, "-c", script],
+                cwd=folder, capture_output=True, text=True,
+                env={**os.environ, "PYTHONPATH": module_root,
+                     "AFT_JOBS_DIR": os.path.join(folder, "jobs"),
+                     "AFT_METRICS_DIR": os.path.join(folder, "metrics")})
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        if result.stdout.startswith("skip"):
+            self.skipTest("background job packages aren't installed")
+        self.assertEqual(result.stdout.splitlines(), [
+            "..correlation-heatmap-figure.data..."
+            "correlation-heatmap-counts.data.. True"])
+
+    def test_import_time_budget(self):
+        # importing the plot functions, or the whole dashboard (which
+        # builds its layout), should not read the enrollment data (it
+        # runs in an empty folder, so there is no CSV to read) or pull
+        # in scipy.stats/plotly.express, and should stay within budget:
+        # a multiple of a bare "import dash", with some headroom over the
+        # measured 1-1.5x and 2-3x
+        budgets = {"aft_pkg.aft_plot_functions": 2.0, "aft_dashboard": 3.5}
+        script = (
+            "import sys, time\n"
+            "start = time.perf_counter()\n"
+            "import {module}\n"
+            "print(time.perf_counter() - start)\n"
+            "data_org = sys.modules.get('aft_pkg.aft_data_org')\n"
+            "print('scipy.stats' in sys.modules, "
+            "'plotly.express' in sys.modules, "
+            "bool(data_org and data_org.DATASET.current()._values))\n")
+        module_root = os.path.dirname(
+            os.path.dirname(os.path.abspath(__file__)))
+
+        def import_time(module, folder):
+            # best of two new processes, as imported modules are cached
+            times = []
+            for _ in range(2):
+                result = subprocess.run(
+                    [sys.executable, "-c", script.format(module=module)],
+                    cwd=folder, capture_output=True, text=True,
+                    env={**os.environ, "PYTHONPATH": module_root,
+                         "AFT_JOBS_DIR": os.path.join(folder, "jobs"),
+                         "AFT_METRICS_DIR": os.path.join(folder,
+                                                         "metrics")})
+                self.assertEqual(result.returncode, 0, result.stderr)
+                elapsed, heavy_modules = result.stdout.splitlines()
+                self.assertEqual(heavy_modules, "False False False", module)
+                times.append(float(elapsed))
+            return min(times)
+
+        with tempfile.TemporaryDirectory() as empty_folder:
+            baseline = import_time("dash", empty_folder)
+            for module, budget in budgets.items():
+                self.assertLess(import_time(module, empty_folder),
+                                budget * baseline, module)
+
 def main():
     unittest.main(verbosity=3)
 
@@ -0,0 +1,348 @@
+'''
+AFT Data Visualization Tool
+Year Prefix Sums
+'''
+'''-------------------------- Imports & Constants --------------------------'''
+
+# pre-existing python libraries
+import numpy as np
+import pandas as pd
+
+# our custom-made libraries
+from .aft_filters import FilterSpec
+
+YEAR_COLUMN = "Acad Yr (start)"
+
+'''------------------------------ Prefix Sums ------------------------------'''
+
+class YearPrefixSums:
+    '''
+    Class-- YearPrefixSums
+        Per-year totals of a set of cells (e.g. one cell per program and
+        grade), stored cumulatively along the year axis:
+
+            prefix[i, c] = total of cell c in all years before years[i]
+
+        so the total of every cell over any [start, end] year range is a
+        subtraction of two rows, no matter how many years it spans.
+
+    Attributes:
+        first_year (int) : first year in the data
+        last_year (int) : last year in the data
+        cells (pd.DataFrame) : one row per cell (the cell columns)
+        prefix (np.array) : (n_years + 1) x n_cells cumulative totals
+    '''
+
+    def __init__(self, first_year: int, cells: pd.DataFrame,
+                 prefix: np.ndarray):
+        self.first_year = first_year
+        self.last_year = first_year + len(prefix) - 2
+        self.cells = cells
+        self.prefix = prefix
+
+    def between(self, start: int, end: int) -> np.ndarray:
+        '''
+        Method-- between
+            Totals of every cell from start to end (inclusive).
+
+        Parameters:
+            start (int) : first year
+            end (int) : last year
+
+        Returns:
+            np.array : one total per row of cells
+        '''
+        start = min(max(start, self.first_year), self.last_year + 1)
+        end = min(max(end, self.first_year - 1), self.last_year)
+        if end < start:
+            return np.zeros(len(self.cells), dtype=self.prefix.dtype)
+        return self.prefix[end - self.first_year + 1] \
+            - self.prefix[start - self.first_year]
+
+    def appended(self, df: pd.DataFrame,
+                 weights: str = None) -> "YearPrefixSums":
+        '''
+        Method-- appended
+            New YearPrefixSums that also counts df (e.g. newly appended
+            enrollment rows), without recounting the rows already in.
+
+            df's cells are matched to the existing ones (new cells are
+            added at the end), the year axis is widened if df has new
+            years, and df's own cumulative totals are added on top.
+
+        Parameters:
+            df (pd.DataFrame) : new rows, with the same cell columns
+            weights (str) : column to total up (as in
+                build_year_prefix_sums)
+
+        Returns:
+            YearPrefixSums
+        '''
+        if len(df) == 0:
+            return self
+        cell_columns = list(self.cells.columns)
+        grouped = df.groupby(cell_columns, observed=True, dropna=False,
+                             sort=False)
+        new_cells = grouped.size().reset_index()[cell_columns]
+
+        # position of each of df's cells among the existing ones
+        # (merge matches NaN with NaN and keeps the left order)
+        position = new_cells.merge(
+            self.cells.assign(_position=np.arange(len(self.cells))),
+            on=cell_columns, how="left")["_position"]
+        unseen = position.isna().to_numpy()
+        position = position.to_numpy(dtype=np.float64)
+        position[unseen] = len(self.cells) + np.arange(unseen.sum())
+        cells = append_rows(self.cells, new_cells[unseen])
+
+        years = df[YEAR_COLUMN].to_numpy().astype(np.int64)
+        first_year = min(self.first_year, int(years.min()))
+        last_year = max(self.last_year, int(years.max()))
+        n_years = last_year - first_year + 1
+
+        # the existing totals on the widened axis: zero before the old
+        # first year, and unchanged after the old last year
+        prefix = np.zeros((n_years + 1, len(cells)), dtype=np.int64)
+        start = self.first_year - first_year
+        prefix[start:start + len(self.prefix), :len(self.cells)] = self.prefix
+        prefix[start + len(self.prefix):, :len(self.cells)] = self.prefix[-1]
+
+        prefix += _year_totals(
+            years - first_year, position.astype(np.int64)[
+                grouped.ngroup().to_numpy()],
+            n_years, len(cells),
+            None if weights is None else df[weights].to_numpy()
+            ).cumsum(axis=0)
+
+        largest = int(prefix[-1].max()) if prefix.size else 0
+        return YearPrefixSums(first_year, cells,
+                              prefix.astype(np.min_scalar_type(largest)))
+
+
+class YearSpans:
+    '''
+    Class-- YearSpans
+        Years in which each cell (e.g. each student, program, code and
+        grade) has rows, stored sparsely as runs of consecutive years:
+        one row per run, with its first and last year. A student is
+        usually in a grade for one year, so there are about as many runs
+        as cells, a few bytes each, and a [start, end] range selects the
+        runs that overlap it.
+
+        Runs are sorted by the first cell column (e.g. the program), so
+        a filter on it takes slices of the runs instead of testing all
+        of them; other filters are tested on those slices only.
+
+    Attributes:
+        cells (pd.DataFrame) : cell columns of each run
+        first (np.array) : first year of each run
+        last (np.array) : last year of each run
+    '''
+
+    def __init__(self, cells: pd.DataFrame, first: np.ndarray,
+                 last: np.ndarray):
+        self.cells = cells
+        self.first = first
+        self.last = last
+
+        # where each value of the first column starts (runs are sorted)
+        lead = pd.factorize(cells[cells.columns[0]])[0]
+        starts = np.flatnonzero(np.append(True, lead[1:] != lead[:-1])) \
+            if len(lead) else np.zeros(0, dtype=np.int64)
+        self._lead = pd.Index(cells[cells.columns[0]].to_numpy()[starts])
+        self._bounds = np.append(starts, len(lead))
+
+    def select(self, years: list[int] = None,
+               filters: dict = None) -> np.ndarray:
+        '''
+        Method-- select
+            Positions of the runs overlapping the years range whose cells
+            pass the filters.
+
+        Parameters:
+            years (list[int]) : selected years range (default: all)
+            filters (dict) : {cell column: allowed values}
+
+        Returns:
+            np.array : selected run positions, in order
+        '''
+        filters = dict(filters or {})
+        lead = self.cells.columns[0]
+        if lead in filters:
+            # runs of the selected values, one slice each
+            at = self._lead.get_indexer(pd.Index(list(filters.pop(lead))))
+            at = np.unique(at[at >= 0])
+            lengths = self._bounds[at + 1] - self._bounds[at]
+            rows = np.repeat(self._bounds[at] - np.cumsum(lengths)
+                             + lengths, lengths) + np.arange(lengths.sum())
+        else:
+            rows = np.arange(len(self.cells))
+
+        if years is not None:
+            rows = rows[(self.first[rows] <= max(years))
+                        & (self.last[rows] >= min(years))]
+        for predicate in FilterSpec(filters).predicates:
+            rows = rows[predicate.mask(self.cells[predicate.column], rows)]
+        return rows
+
+    def appended(self, df: pd.DataFrame) -> "YearSpans":
+        '''
+        Method-- appended
+            New YearSpans that also covers df (e.g. newly appended
+            enrollment rows): df's runs are merged into the existing ones
+            without going back to the rows already in.
+
+        Parameters:
+            df (pd.DataFrame) : new rows, with the same cell columns
+
+        Returns:
+            YearSpans
+        '''
+        if len(df) == 0:
+            return self
+        runs = self.cells.assign(first=self.first, last=self.last)
+        return _merge_runs(append_rows(runs, _year_runs(
+            df, list(self.cells.columns))), list(self.cells.columns))
+
+
+def append_rows(df: pd.DataFrame, rows: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Function-- append_rows
+        rows appended to df (same columns), for small tables such as count
+        cells. Categoricals stay categorical, with the categories of both;
+        other columns whose dtypes differ become objects.
+    '''
+    if len(rows) == 0:
+        return df.reset_index(drop=True)
+    columns = {}
+    for name in df.columns:
+        top, bottom = df[name], rows[name]
+        if isinstance(top.dtype, pd.CategoricalDtype) \
+            and isinstance(bottom.dtype, pd.CategoricalDtype):
+            columns[name] = pd.api.types.union_categoricals(
+                [top.array, bottom.array])
+        elif top.dtype == bottom.dtype:
+            columns[name] = np.concatenate(
+                [top.to_numpy(), bottom.to_numpy()])
+        else:
+            columns[name] = np.concatenate(
+                [top.to_numpy(object), bottom.to_numpy(object)])
+    return pd.DataFrame(columns)
+
+
+def _year_totals(
+    year_offsets: np.ndarray,
+    cell_codes: np.ndarray,
+    n_years: int,
+    n_cells: int,
+    weights: np.ndarray = None
+    ) -> np.ndarray:
+    '''
+    Function-- _year_totals
+        (n_years + 1) x n_cells totals per (year, cell), shifted down one
+        row so their cumulative sum starts with a row of zeros
+    '''
+    return np.bincount(
+        (year_offsets + 1) * n_cells + cell_codes,
+        weights=weights,
+        minlength=(n_years + 1) * n_cells
+        ).astype(np.int64).reshape(n_years + 1, n_cells)
+
+
+def build_year_prefix_sums(
+    df: pd.DataFrame,
+    cell_columns: list[str],
+    weights: str = None
+    ) -> YearPrefixSums:
+    '''
+    Function-- build_year_prefix_sums
+        Builds YearPrefixSums over the distinct values of cell_columns.
+
+    Parameters:
+        df (pd.DataFrame) : enrollment rows (or counts, see weights)
+            with an 'Acad Yr (start)' column
+        cell_columns (list[str]) : columns that make up a cell
+        weights (str) : column to total up; by default rows are counted
+
+    Returns:
+        YearPrefixSums
+    '''
+    grouped = df.groupby(list(cell_columns), observed=True, dropna=False,
+                         sort=False)
+    cell_codes = grouped.ngroup().to_numpy()
+    cells = grouped.size().reset_index()[list(cell_columns)]
+
+    years = df[YEAR_COLUMN].to_numpy().astype(np.int64)
+    first_year = int(years.min()) if len(years) else 0
+    n_years = int(years.max()) - first_year + 1 if len(years) else 0
+
+    prefix = _year_totals(
+        years - first_year, cell_codes, n_years, len(cells),
+        None if weights is None else df[weights].to_numpy()
+        ).cumsum(axis=0)
+
+    # cumulative totals only grow, so the last row sets the dtype needed
+    largest = int(prefix[-1].max()) if prefix.size else 0
+    return YearPrefixSums(first_year, cells,
+                          prefix.astype(np.min_scalar_type(largest)))
+
+
+def _year_runs(df: pd.DataFrame, cell_columns: list[str]) -> pd.DataFrame:
+    '''each distinct (cell, year) of df as a one-year run'''
+    runs = df.groupby(list(cell_columns) + [YEAR_COLUMN], observed=True,
+                      dropna=False, sort=False).size().reset_index()
+    years = runs[YEAR_COLUMN].to_numpy()
+    return runs[list(cell_columns)].assign(first=years, last=years)
+
+
+def _merge_runs(runs: pd.DataFrame, cell_columns: list[str]) -> YearSpans:
+    '''
+    Function-- _merge_runs
+        YearSpans of runs (cell columns, 'first' and 'last'), with the
+        overlapping or adjacent runs of each cell merged into one
+    '''
+    grouped = runs.groupby(cell_columns, observed=True, dropna=False)
+    cell_codes = grouped.ngroup().to_numpy().astype(np.int64)
+    cells = grouped.size().reset_index()[cell_columns]
+    first = runs["first"].to_numpy().astype(np.int64)
+    last = runs["last"].to_numpy().astype(np.int64)
+
+    order = np.lexsort((first, cell_codes))
+    cell_codes, first, last = cell_codes[order], first[order], last[order]
+
+    # last year covered so far by each cell's runs: a running max, with
+    # the cell code above the years so it restarts at each cell
+    base = int(first.min()) if len(first) else 0
+    width = int(last.max()) - base + 1 if len(last) else 1
+    reach = np.maximum.accumulate(cell_codes * width + (last - base)) \
+        - cell_codes * width + base
+
+    new_run = np.ones(len(first), dtype=bool)
+    new_run[1:] = (cell_codes[1:] != cell_codes[:-1]) \
+        | (first[1:] > reach[:-1] + 1)
+    starts = np.flatnonzero(new_run)
+    ends = np.append(starts[1:], len(first)) - 1
+
+    dtype = np.min_scalar_type(int(last.max()) if len(last) else 0)
+    return YearSpans(
+        cells.take(cell_codes[starts]).reset_index(drop=True),
+        first[starts].astype(dtype), reach[ends].astype(dtype))
+
+
+def build_year_spans(df: pd.DataFrame,
+                     cell_columns: list[str]) -> YearSpans:
+    '''
+    Function-- build_year_spans
+        Builds YearSpans of the years each distinct combination of
+        cell_columns has rows in.
+
+    Parameters:
+        df (pd.DataFrame) : enrollment rows, with an 'Acad Yr (start)'
+            column
+        cell_columns (list[str]) : columns that make up a cell; runs are
+            sorted by the first one
+
+    Returns:
+        YearSpans
+    '''
+    return _merge_runs(_year_runs(df, cell_columns), list(cell_columns))
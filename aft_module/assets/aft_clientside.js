@@ -0,0 +1,202 @@
+/*
+AFT Data Visualization Tool
+Client-side Callbacks
+
+Presentation-only controls (bar mode, label angle, charts per row and the
+heatmap color range) are applied here, in the browser, to the figure the
+server last stored, so changing them doesn't send a request. Dash loads
+every file in assets/ automatically.
+*/
+
+/*----------------------------- Figure Helpers ----------------------------*/
+
+// figure with a copy of its layout (the traces are shared), so the graph
+// sees a new figure while the stored one stays as the server sent it
+function withLayout(figure) {
+    return {
+        data: figure.data,
+        layout: JSON.parse(JSON.stringify(figure.layout || {}))
+    };
+}
+
+// layout keys of the x or y axes, e.g. ["xaxis", "xaxis2", ...]
+function axisKeys(layout, letter) {
+    var pattern = new RegExp("^" + letter + "axis[0-9]*$");
+    return Object.keys(layout).filter(function (key) {
+        return pattern.test(key);
+    });
+}
+
+// layout key of a trace's axis reference, e.g. "x2" -> "xaxis2"
+function axisKey(ref) {
+    return ref.charAt(0) + "axis" + ref.slice(1);
+}
+
+// first non-empty title of the given axes
+function axisTitle(layout, keys) {
+    for (var i = 0; i < keys.length; i++) {
+        var title = (layout[keys[i]] || {}).title;
+        var text = typeof title === "string" ? title : (title || {}).text;
+        if (text) {
+            return text;
+        }
+    }
+    return "";
+}
+
+function setTitle(axis, text) {
+    axis.title = Object.assign(
+        {}, typeof axis.title === "object" ? axis.title : {}, {text: text});
+}
+
+// bar mode and label angle of every x axis
+function setBars(layout, barmode, tickangle) {
+    layout.barmode = barmode;
+    axisKeys(layout, "x").forEach(function (key) {
+        layout[key].tickangle = tickangle;
+    });
+}
+
+/*-------------------------- Facet Re-arrangement -------------------------*/
+
+// horizontal and vertical space between charts (plotly express defaults)
+var FACET_COL_SPACING = 0.02;
+var FACET_ROW_SPACING = 0.07;
+
+// rounded, so charts in the same row or column compare equal
+function position(value) {
+    return Math.round(value * 1e6);
+}
+
+/*
+Re-arranges the charts of a figure made with facet_col / facet_col_wrap
+into `wrap` charts per row: the charts are taken in reading order (top to
+bottom, left to right), and their axes and titles are moved to the new
+grid. Axes without traces (empty cells of the old grid) are hidden.
+*/
+function wrapFacets(layout, traces, wrap) {
+    var facets = [];
+    var seen = {};
+    traces.forEach(function (trace) {
+        var x = axisKey(trace.xaxis || "x");
+        var y = axisKey(trace.yaxis || "y");
+        if (!seen[x] && layout[x] && layout[y]) {
+            seen[x] = true;
+            facets.push({x: x, y: y});
+        }
+    });
+    if (facets.length === 0) {
+        return;
+    }
+
+    // titles of each chart, matched by where they are above it
+    facets.forEach(function (facet) {
+        facet.center = (layout[facet.x].domain[0]
+                        + layout[facet.x].domain[1]) / 2;
+        facet.top = layout[facet.y].domain[1];
+    });
+    var annotations = layout.annotations || [];
+    facets.forEach(function (facet) {
+        var best = null;
+        var bestDistance = 0.02;
+        annotations.forEach(function (annotation, i) {
+            var distance = Math.abs(annotation.x - facet.center)
+                + Math.abs(annotation.y - facet.top);
+            if (annotation.xref === "paper" && annotation.yref === "paper"
+                && !annotation.claimed && distance < bestDistance) {
+                best = i;
+                bestDistance = distance;
+            }
+        });
+        if (best !== null) {
+            annotations[best].claimed = true;
+            facet.annotation = annotations[best];
+        }
+    });
+    annotations.forEach(function (annotation) {
+        delete annotation.claimed;
+    });
+
+    facets.sort(function (a, b) {
+        return (position(b.top) - position(a.top))
+            || (position(a.center) - position(b.center));
+    });
+
+    var xKeys = axisKeys(layout, "x");
+    var yKeys = axisKeys(layout, "y");
+    var xTitle = axisTitle(layout, xKeys);
+    var yTitle = axisTitle(layout, yKeys);
+    xKeys.concat(yKeys).forEach(function (key) {
+        layout[key].visible = false;
+    });
+
+    var cols = Math.max(1, Math.min(wrap, facets.length));
+    var rows = Math.ceil(facets.length / cols);
+    var rowSpacing = rows > 1 ?
+        Math.min(FACET_ROW_SPACING, 0.5 / (rows - 1)) : 0;
+    var width = (1 - FACET_COL_SPACING * (cols - 1)) / cols;
+    var height = (1 - rowSpacing * (rows - 1)) / rows;
+
+    facets.forEach(function (facet, i) {
+        var row = Math.floor(i / cols);
+        var col = i % cols;
+        var left = col * (width + FACET_COL_SPACING);
+        var top = 1 - row * (height + rowSpacing);
+        var xaxis = layout[facet.x];
+        var yaxis = layout[facet.y];
+
+        xaxis.visible = true;
+        xaxis.domain = [left, left + width];
+        // x titles under the lowest chart of each column only
+        setTitle(xaxis, i + cols >= facets.length ? xTitle : "");
+
+        yaxis.visible = true;
+        yaxis.domain = [Math.max(top - height, 0), top];
+        // y titles and counts left of the first column only
+        setTitle(yaxis, col === 0 ? yTitle : "");
+        yaxis.showticklabels = col === 0;
+
+        if (facet.annotation) {
+            facet.annotation.x = left + width / 2;
+            facet.annotation.y = top;
+        }
+    });
+}
+
+/*--------------------------- Clientside Callbacks ------------------------*/
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    aft: {
+        // total program enrollment: bar mode and label angle
+        bars: function (figure, barmode, tickangle) {
+            if (!figure) {
+                return window.dash_clientside.no_update;
+            }
+            var shown = withLayout(figure);
+            setBars(shown.layout, barmode, tickangle);
+            return shown;
+        },
+
+        // program comparison: bar mode, label angle and charts per row
+        facets: function (figure, barmode, tickangle, wrap) {
+            if (!figure) {
+                return window.dash_clientside.no_update;
+            }
+            var shown = withLayout(figure);
+            setBars(shown.layout, barmode, tickangle);
+            wrapFacets(shown.layout, shown.data || [], wrap || 2);
+            return shown;
+        },
+
+        // correlation heatmap: correlations at the ends of the color scale
+        colorRange: function (figure, range) {
+            if (!figure) {
+                return window.dash_clientside.no_update;
+            }
+            var shown = withLayout(figure);
+            shown.layout.coloraxis = Object.assign(
+                {}, shown.layout.coloraxis, {cmin: range[0], cmax: range[1]});
+            return shown;
+        }
+    }
+});
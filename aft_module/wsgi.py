@@ -0,0 +1,42 @@
+'''
+AFT Data Visualization Tool
+WSGI Entry Point
+'''
+'''-------------------------- Imports & Constants --------------------------'''
+
+# pre-existing python libraries
+import gc
+
+# our custom-made libraries
+from aft_pkg.aft_data_org import DATASET
+from aft_pkg.aft_metrics import METRICS
+from aft_dashboard import app
+
+'''--------------------------------- Server --------------------------------'''
+
+# Production serving with several worker processes, e.g. from the
+# "aft_module" folder:
+#
+#     gunicorn --preload --workers 4 --bind 0.0.0.0:8050 wsgi:application
+#
+# With --preload this module is imported once, in the master process: the
+# dataset is memory-mapped from its columnar cache (see aft_columnar) and
+# its index, year totals and count cubes are built before the workers are
+# forked. Workers then share those pages read-only instead of each loading
+# its own copy, so memory stays about the same as workers are added.
+# Each worker then watches the CSV for appended rows on its own (see
+# DatasetHandle.watch), starting with its first request.
+# Run "python -m aft_pkg.aft_results" before starting the server to
+# precompute the common heatmap and treemap results into the result store
+# the workers share (see aft_results).
+# /metrics combines the spans every worker and background job writes to
+# a shared folder (see Metrics.combined); the master starts it empty
+METRICS.share(METRICS.folder, clear=True)
+DATASET.current().warm()
+
+# moves everything loaded so far out of the garbage collector's reach, so
+# collections in the workers don't write to (and so copy) shared pages
+gc.collect()
+gc.freeze()
+
+application = app.server